@@ -3,11 +3,137 @@ Normalizes the audio of a video file.
 """
 
 import argparse
+import hashlib
+import json
 import os
 import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Optional, cast
 
+from appdirs import user_data_dir  # type: ignore
 from static_ffmpeg import add_paths  # type: ignore
-from static_sox import add_paths as add_paths_sox  # type: ignore
+
+from zcmds.util.ffmpeg_runner import format_seconds, run_ffmpeg
+from zcmds.util.media import (
+    MEDIA_EXTENSIONS,
+    expand_media_paths,
+    ffprobe,
+    get_duration,
+    get_stream,
+    is_in_out_pair,
+    is_media_file,
+)
+
+
+# Streaming platform targets, EBU R128 broadcast would be -23 LUFS.
+DEFAULT_LUFS = -16.0
+DEFAULT_TRUE_PEAK = -1.5
+DEFAULT_LRA = 11.0
+_AUDIO_CODECS = {
+    ".mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    ".wav": ["-c:a", "pcm_s16le"],
+    ".flac": ["-c:a", "flac"],
+    ".ogg": ["-c:a", "libvorbis", "-q:a", "6"],
+    ".opus": ["-c:a", "libopus", "-b:a", "160k"],
+    ".webm": ["-c:a", "libopus", "-b:a", "160k"],
+}
+_AUDIO_ONLY_EXTS = [".mp3", ".wav", ".m4a", ".flac", ".aac", ".ogg", ".opus"]
+LOUDNESS_CACHE_ENV = "ZCMDS_LOUDNESS_CACHE"
+LOUDNESS_CACHE_NAME = "loudness_cache.json"
+_CACHE_LOCK = threading.Lock()
+# Blocks hashed from the start, middle and end of a file to identify its content.
+_FINGERPRINT_BLOCK = 1024 * 1024
+
+
+@dataclass
+class LoudnessStats:
+    """The loudnorm measurement of the first pass."""
+
+    input_i: float
+    input_tp: float
+    input_lra: float
+    input_thresh: float
+    target_offset: float
+
+
+def get_loudness_cache_path() -> Path:
+    env_path = os.environ.get(LOUDNESS_CACHE_ENV)
+    if env_path:
+        return Path(env_path)
+    data_dir = cast(str, user_data_dir("zcmds", "zcmds"))
+    return Path(data_dir) / LOUDNESS_CACHE_NAME
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Identifies a file by its size and sampled content, so renamed or copied
+    files hit the cache without hashing hours of audio.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, size // 2, max(0, size - _FINGERPRINT_BLOCK)):
+            f.seek(offset)
+            digest.update(f.read(_FINGERPRINT_BLOCK))
+    return digest.hexdigest()
+
+
+def _target_key(lufs: float, true_peak: float, lra: float) -> str:
+    return f"{lufs}/{true_peak}/{lra}"
+
+
+def _load_cache(path: Path) -> dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_cached_loudness(
+    fingerprint: str, lufs: float, true_peak: float, lra: float
+) -> Optional[LoudnessStats]:
+    """
+    The cached measurement of a file. The input stats don't depend on the
+    target; the small target offset does and is zero for a new target.
+    """
+    entry = _load_cache(get_loudness_cache_path()).get(fingerprint)
+    if entry is None:
+        return None
+    try:
+        offsets: dict[str, float] = entry.get("offsets", {})
+        return LoudnessStats(
+            input_i=float(entry["input_i"]),
+            input_tp=float(entry["input_tp"]),
+            input_lra=float(entry["input_lra"]),
+            input_thresh=float(entry["input_thresh"]),
+            target_offset=float(offsets.get(_target_key(lufs, true_peak, lra), 0.0)),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def store_loudness(
+    fingerprint: str, stats: LoudnessStats, lufs: float, true_peak: float, lra: float
+) -> None:
+    path = get_loudness_cache_path()
+    with _CACHE_LOCK:
+        cache = _load_cache(path)
+        entry = asdict(stats)
+        offsets = cache.get(fingerprint, {}).get("offsets", {})
+        offsets[_target_key(lufs, true_peak, lra)] = entry.pop("target_offset")
+        entry["offsets"] = offsets
+        cache[fingerprint] = entry
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, path)
 
 
 def ffprobe_duration(filename: str) -> float:
@@ -21,10 +147,8 @@ def ffprobe_duration(filename: str) -> float:
 
 
 def _is_media_file(filename: str) -> bool:
-    print(f"Is media file: {filename}")
     assert os.path.isfile(filename), f"{filename} is not a file"
-    body, ext = os.path.splitext(filename)
-    return ext in [".mp4", ".mkv", ".avi", ".mov", ".mp3", ".wav", ".m4a"]
+    return is_media_file(filename)
 
 
 def _convert_to_wav(path: str, out: str) -> None:
@@ -35,9 +159,9 @@ def _convert_to_wav(path: str, out: str) -> None:
     if len(os.path.dirname(out)):
         os.makedirs(os.path.dirname(out), exist_ok=True)
     add_paths(weak=True)
-    cmd = f'static_ffmpeg -y -i "{path}" -vn -acodec pcm_s16le -ar 44100 -ac 2 "{out}"'
-    print(f"Executing:\n  {cmd}")
-    os.system(cmd)
+    cmd = ["static_ffmpeg", "-y", "-i", path, "-vn", "-acodec", "pcm_s16le"]
+    cmd += ["-ar", "44100", "-ac", "2", out]
+    run_ffmpeg(cmd)
 
 
 def _convert_to_mp3(path: str, out: str) -> None:
@@ -48,9 +172,8 @@ def _convert_to_mp3(path: str, out: str) -> None:
     if len(os.path.dirname(out)):
         os.makedirs(os.path.dirname(out), exist_ok=True)
     # Updated FFmpeg command for AAC conversion
-    cmd = f'static_ffmpeg -y -i "{path}" -vn -acodec aac -b:a 192k "{out}"'
-    print(f"Executing:\n  {cmd}")
-    os.system(cmd)
+    cmd = ["static_ffmpeg", "-y", "-i", path, "-vn", "-acodec", "aac", "-b:a", "192k"]
+    run_ffmpeg(cmd + [out])
 
 
 def _replace_audio(in_vid_mp4: str, in_mp3: str, out_mp3: str) -> None:
@@ -61,36 +184,161 @@ def _replace_audio(in_vid_mp4: str, in_mp3: str, out_mp3: str) -> None:
     assert _is_media_file(in_mp3), f"{in_mp3} is not a media file"
     if len(os.path.dirname(out_mp3)):
         os.makedirs(os.path.dirname(out_mp3), exist_ok=True)
-    video_stmt = "-map 0:v"
+    video_args = ["-map", "0:v"]
     if (
         in_vid_mp4.endswith(".mp3")
         or in_vid_mp4.endswith(".wav")
         or in_vid_mp4.endswith(".m4a")
     ):
-        video_stmt = ""
-    cmd = f'static_ffmpeg -y -i "{in_vid_mp4}" -i "{in_mp3}" {video_stmt} -map 1:a -c copy -shortest "{out_mp3}"'
-    print(f"Executing:\n  {cmd}")
-    rtn = os.system(cmd)
-    if rtn == 0:
+        video_args = []
+    inputs = ["static_ffmpeg", "-y", "-i", in_vid_mp4, "-i", in_mp3]
+    cmd = inputs + video_args + ["-map", "1:a", "-c", "copy", "-shortest", out_mp3]
+    if run_ffmpeg(cmd).ok:
         return  # success
     print(
         f"Failed to replace audio in {in_vid_mp4} with {in_mp3} to {out_mp3}, doing re-encode"
     )
-    cmd = f'static_ffmpeg -y -i "{in_vid_mp4}" -i "{in_mp3}" {video_stmt} -map 1:a -c:v copy -c:a aac -b:a 320k "{out_mp3}"'
-    os.system(cmd)
+    cmd = inputs + video_args + ["-map", "1:a", "-c:v", "copy", "-c:a", "aac"]
+    run_ffmpeg(cmd + ["-b:a", "320k", out_mp3])
 
 
 def strip_ext(path: str) -> str:
     return os.path.splitext(path)[0]
 
 
-def audnorm(path: str, out: str) -> None:
+def _loudnorm_filter(lufs: float, true_peak: float, lra: float) -> str:
+    return f"loudnorm=I={lufs}:TP={true_peak}:LRA={lra}"
+
+
+def parse_loudnorm_json(stderr: str) -> LoudnessStats:
+    """Parses the json block loudnorm prints at the end of the stderr output."""
+    start = stderr.rfind("{")
+    end = stderr.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("no loudnorm measurement found in the ffmpeg output")
+    data = json.loads(stderr[start : end + 1])
+    return LoudnessStats(
+        input_i=float(data["input_i"]),
+        input_tp=float(data["input_tp"]),
+        input_lra=float(data["input_lra"]),
+        input_thresh=float(data["input_thresh"]),
+        target_offset=float(data["target_offset"]),
+    )
+
+
+def measure_loudness(
+    path: str,
+    lufs: float = DEFAULT_LUFS,
+    true_peak: float = DEFAULT_TRUE_PEAK,
+    lra: float = DEFAULT_LRA,
+    duration: Optional[float] = None,
+    quiet: bool = False,
+) -> LoudnessStats:
+    """First pass: decodes only the audio and measures it, nothing is written."""
+    af = _loudnorm_filter(lufs, true_peak, lra) + ":print_format=json"
+    cmd = ["static_ffmpeg", "-y", "-i", path, "-map", "0:a:0", "-vn", "-sn", "-dn"]
+    cmd += ["-af", af, "-f", "null", "-"]
+    result = run_ffmpeg(cmd, duration=duration, outputs=[], quiet=quiet, check=True)
+    return parse_loudnorm_json(result.stderr)
+
+
+def build_normalize_cmd(
+    path: str,
+    out: str,
+    stats: LoudnessStats,
+    lufs: float = DEFAULT_LUFS,
+    true_peak: float = DEFAULT_TRUE_PEAK,
+    lra: float = DEFAULT_LRA,
+    sample_rate: int = 48000,
+) -> list[str]:
     """
-    Normalizes the audio of a video file.
+    Second pass: applies the measured linear gain while encoding the audio and
+    stream copying everything else into out.
+    """
+    ext = os.path.splitext(out)[1].lower()
+    codec_args = _AUDIO_CODECS.get(ext, ["-c:a", "aac", "-b:a", "192k"])
+    if "libopus" in codec_args:
+        # Opus only encodes at 48kHz.
+        sample_rate = 48000
+    af = (
+        f"{_loudnorm_filter(lufs, true_peak, lra)}"
+        f":measured_I={stats.input_i}:measured_TP={stats.input_tp}"
+        f":measured_LRA={stats.input_lra}:measured_thresh={stats.input_thresh}"
+        f":offset={stats.target_offset}:linear=true"
+        # loudnorm works at 192kHz, bring it back to the source rate.
+        f",aresample={sample_rate}"
+    )
+    cmd = ["static_ffmpeg", "-y", "-i", path]
+    if ext not in _AUDIO_ONLY_EXTS:
+        cmd += ["-map", "0:v?", "-c:v", "copy"]
+    cmd += ["-map", "0:a:0", "-af", af]
+    cmd += codec_args
+    if ext in [".mp4", ".mov", ".m4a"]:
+        cmd += ["-movflags", "+faststart"]
+    cmd.append(out)
+    return cmd
+
+
+def audnorm(
+    path: str,
+    out: str,
+    lufs: float = DEFAULT_LUFS,
+    true_peak: float = DEFAULT_TRUE_PEAK,
+    lra: float = DEFAULT_LRA,
+    use_cache: bool = True,
+    quiet: bool = False,
+) -> bool:
+    """
+    Normalizes the audio of a video file to the target loudness with a two pass
+    EBU R128 loudnorm: one measurement pass and one normalize+encode+mux pass.
+    The measurement is cached by content, so re-runs skip straight to the
+    second pass. Returns True if the cached measurement was used.
+    """
+    assert _is_media_file(path), f"{path} is not a media file"
+    if len(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    add_paths(weak=True)
+    info = ffprobe(path)
+    audio = get_stream(info, "audio")
+    if audio is None:
+        raise ValueError(f"{path} has no audio stream")
+    duration = get_duration(info)
+    fingerprint = file_fingerprint(path) if use_cache else ""
+    stats = (
+        load_cached_loudness(fingerprint, lufs, true_peak, lra) if use_cache else None
+    )
+    cached = stats is not None
+    if stats is None:
+        stats = measure_loudness(path, lufs, true_peak, lra, duration, quiet)
+        if use_cache:
+            store_loudness(fingerprint, stats, lufs, true_peak, lra)
+    if not quiet:
+        source = "Cached" if cached else "Measured"
+        print(
+            f"{source} {stats.input_i} LUFS, true peak {stats.input_tp} dBTP,"
+            f" LRA {stats.input_lra} LU"
+        )
+    sample_rate = int(audio.get("sample_rate") or 48000)
+    cmd = build_normalize_cmd(path, out, stats, lufs, true_peak, lra, sample_rate)
+    try:
+        run_ffmpeg(cmd, duration=duration, quiet=quiet, check=True)
+    except subprocess.CalledProcessError:
+        # Don't leave a partial file that looks like a finished one.
+        if os.path.exists(out):
+            os.remove(out)
+        raise
+    return cached
+
+
+def audnorm_sox(path: str, out: str) -> None:
+    """
+    Normalizes the audio of a video file to peak level with sox.
     """
     assert _is_media_file(path), f"{path} is not a media file"
     if len(os.path.dirname(out)):
         os.makedirs(os.path.dirname(out), exist_ok=True)
+    from static_sox import add_paths as add_paths_sox  # type: ignore
+
     add_paths(weak=True)
     add_paths_sox(weak=True)
     # file without extensions
@@ -112,20 +360,135 @@ def audnorm(path: str, out: str) -> None:
     _replace_audio(in_vid_mp4=out_m4a, in_mp3=path, out_mp3=out)
 
 
+def get_batch_out_path(path: str, outdir: Optional[str]) -> str:
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return os.path.join(outdir or os.path.dirname(path), f"{stem}_norm{ext}")
+
+
+def run_batch(
+    paths: list[str],
+    outdir: Optional[str],
+    lufs: float,
+    true_peak: float,
+    lra: float,
+    use_cache: bool,
+    jobs: Optional[int] = None,
+) -> int:
+    """Normalizes many files at once, returns the number that failed."""
+    # loudnorm is single threaded, so one ffmpeg per core keeps them all busy.
+    jobs = max(1, min(jobs or (os.cpu_count() or 1), len(paths)))
+    print(f"Normalizing {len(paths)} files to {lufs} LUFS, {jobs} at a time")
+    add_paths(weak=True)
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+
+    def normalize(path: str) -> Optional[bool]:
+        out = get_batch_out_path(path, outdir)
+        start = time.time()
+        try:
+            cached = audnorm(path, out, lufs, true_peak, lra, use_cache, quiet=True)
+        except (ValueError, AssertionError, subprocess.CalledProcessError) as ex:
+            print(f"  {path}: FAILED: {ex}")
+            return None
+        analysis = "cached analysis" if cached else "analyzed"
+        elapsed = format_seconds(time.time() - start)
+        print(f"  {path} -> {out}: {analysis}, done in {elapsed}")
+        return cached
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(normalize, paths))
+    failed = results.count(None)
+    print(
+        f"Normalized {len(paths) - failed}, failed {failed},"
+        f" {results.count(True)} analyses from the cache"
+    )
+    return failed
+
+
 def main():
     """Main entry point for audnorm."""
     parser = argparse.ArgumentParser(
-        description="Print video durations\n",
+        description="Normalizes audio loudness.\n\n"
+        "  audnorm in.mp4 out.mp4\n"
+        "  audnorm lectures/ *.m4a --outdir normalized\n",
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("vidfile", help="Path to vid file", nargs="?")
-    parser.add_argument("out", help="Path to vid file", nargs="?")
+    parser.add_argument(
+        "paths",
+        help="input and output file, or files, directories and globs to batch",
+        nargs="*",
+    )
+    parser.add_argument(
+        "--outdir", help="batch output directory, default is next to each input"
+    )
+    parser.add_argument(
+        "--recursive", action="store_true", help="search directories recursively"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of files processed at once"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="re-measure loudness instead of using the cached analysis",
+    )
+    parser.add_argument(
+        "--lufs", type=float, default=DEFAULT_LUFS, help="integrated loudness target"
+    )
+    parser.add_argument(
+        "--tp", type=float, default=DEFAULT_TRUE_PEAK, help="maximum true peak in dBTP"
+    )
+    parser.add_argument(
+        "--lra", type=float, default=DEFAULT_LRA, help="loudness range target in LU"
+    )
+    parser.add_argument(
+        "-y",
+        "--force",
+        action="store_true",
+        help="overwrite the output file if it exists",
+    )
+    parser.add_argument(
+        "--sox",
+        action="store_true",
+        help="peak normalize with sox through temp wav files (legacy)",
+    )
     args = parser.parse_args()
-    path = args.vidfile or input("in vid file: ")
-    out = args.out or input("out vid file: ")
+    paths: list[str] = args.paths
+    single = is_in_out_pair(paths, args.outdir)
+    if not single:
+        if args.sox:
+            parser.error("--sox only supports a single file")
+        files = expand_media_paths(paths, MEDIA_EXTENSIONS, recursive=args.recursive)
+        # Don't normalize the outputs of a previous run found by a directory scan.
+        files = [f for f in files if f in paths or not strip_ext(f).endswith("_norm")]
+        if not files:
+            print(f"No media files found in {' '.join(paths)}")
+            sys.exit(1)
+        failed = run_batch(
+            files,
+            args.outdir,
+            args.lufs,
+            args.tp,
+            args.lra,
+            not args.no_cache,
+            args.jobs,
+        )
+        sys.exit(1 if failed else 0)
+    path = paths[0] if paths else input("in vid file: ")
+    out = paths[1] if len(paths) > 1 else input("out vid file: ")
+    if os.path.exists(out) and not args.force:
+        print(f"{out} already exists, use --force to overwrite it")
+        sys.exit(1)
     if len(os.path.dirname(out)):
         os.makedirs(os.path.dirname(out), exist_ok=True)
-    audnorm(path, out)
+    if args.sox:
+        audnorm_sox(path, out)
+        return
+    try:
+        audnorm(path, out, args.lufs, args.tp, args.lra, not args.no_cache)
+    except (ValueError, subprocess.CalledProcessError) as ex:
+        print(f"{__file__}: ERROR: {ex}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
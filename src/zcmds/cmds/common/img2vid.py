@@ -6,20 +6,106 @@ Stitches a bunch of files together to make a video.
 
 import argparse
 import os
-import subprocess
+import re
 import sys
+from typing import Any, Iterator, Optional
+
+from zcmds.util.ffmpeg_runner import run_ffmpeg
+from zcmds.util.frame_encoder import encode_frames
+
+
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp"]
+_NUMBERED_RE = re.compile(r"^(.*?)(\d+)(\.[^.]+)$")
+# yuv420p needs even dimensions.
+_VIDEO_FILTER = "scale=trunc(iw/2)*2:trunc(ih/2)*2,format=yuv420p"
 
 
 def get_files(path: str) -> list[str]:
-    """Returns a list of files in a directory sorted by name."""
+    """Returns a list of image files in a directory sorted by name."""
     files: list[str] = [
-        f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))
+        f
+        for f in os.listdir(path)
+        if os.path.isfile(os.path.join(path, f))
+        and os.path.splitext(f.lower())[1] in IMAGE_EXTENSIONS
     ]
     files.sort()
     files = [os.path.join(path, f) for f in files]
     return files
 
 
+def detect_sequence(files: list[str]) -> Optional[tuple[str, int]]:
+    """
+    Returns an image2 pattern and start number if the files are one contiguous
+    numbered sequence like frame_0001.png, frame_0002.png, ...
+    """
+    if not files:
+        return None
+    matches = [_NUMBERED_RE.match(os.path.basename(f)) for f in files]
+    if any(m is None for m in matches):
+        return None
+    parts = [m.groups() for m in matches if m is not None]
+    prefix, _, suffix = parts[0]
+    if any(p[0] != prefix or p[2] != suffix for p in parts):
+        return None
+    numbers = sorted(int(p[1]) for p in parts)
+    if numbers != list(range(numbers[0], numbers[0] + len(numbers))):
+        return None
+    widths = {len(p[1]) for p in parts}
+    if len(widths) == 1 and any(p[1].startswith("0") for p in parts):
+        digits = f"%0{widths.pop()}d"
+    elif all(not p[1].startswith("0") or p[1] == "0" for p in parts):
+        digits = "%d"
+    else:
+        return None
+    directory = os.path.dirname(files[0])
+    pattern = prefix.replace("%", "%%") + digits + suffix.replace("%", "%%")
+    return os.path.join(directory, pattern), numbers[0]
+
+
+def encode_sequence(
+    pattern: str, start_number: int, frame_count: int, out_path: str, fps: float
+) -> bool:
+    """The image2 demuxer reads the sequence as one input."""
+    cmd = ["static_ffmpeg", "-y", "-framerate", str(fps), "-start_number"]
+    cmd += [str(start_number), "-i", pattern, "-vf", _VIDEO_FILTER]
+    cmd += ["-c:v", "libx264", out_path]
+    return run_ffmpeg(cmd, duration=frame_count / fps).ok
+
+
+def _load_images(files: list[str], size: tuple[int, int]) -> Iterator[Any]:
+    from PIL import Image
+
+    for file in files:
+        with Image.open(file) as img:
+            frame = img.convert("RGB")
+        if frame.size != size:
+            frame = frame.resize(size)
+        yield frame
+
+
+def encode_images(files: list[str], out_path: str, fps: float) -> bool:
+    """
+    Decodes the images one at a time and streams them to ffmpeg as rawvideo,
+    for files that aren't a numbered sequence or mix formats and sizes.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        print("Encoding unnumbered images needs Pillow: pip install pillow")
+        return False
+    with Image.open(files[0]) as first:
+        size = first.size
+    result = encode_frames(
+        _load_images(files, size),
+        size[0],
+        size[1],
+        out_path,
+        fps=fps,
+        frame_count=len(files),
+    )
+    return result.ok
+
+
 def main() -> None:
     """Main function."""
     parser = argparse.ArgumentParser(
@@ -28,29 +114,29 @@ def main() -> None:
     )
     parser.add_argument("input", help="input")
     parser.add_argument("--fps", help="fps of the output video", default=30, type=int)
+    parser.add_argument("--out", help="output video, default is <input>.mp4")
     args = parser.parse_args()
     infile = args.input
-    outfile = os.path.splitext(args.input)[0] + ".mp4"
+    outfile = args.out or os.path.splitext(os.path.normpath(args.input))[0] + ".mp4"
     if not os.path.exists(infile):
         print(f"{infile} does not exist")
         sys.exit(1)
     files: list[str] = get_files(infile)
-    infiles_stmt = ""
-    for f in files:
-        infiles_stmt += f' -i "{f}"'
-    time_per_frame = 1.0 / args.fps
-    concat_file_str = ""
-    temp_concat_file = ".concat.txt"
-    for file in files:
-        file_path: str = file.replace("\\", "/")
-        concat_file_str += f"file {file_path}\n"
-        concat_file_str += f"duration {time_per_frame}\n"
-    with open(temp_concat_file, "w") as f:
-        f.write(concat_file_str)
-    cmd = f'static_ffmpeg -hide_banner -f concat -i {temp_concat_file} -c:v libx264 -start_number 0 -vf "format=yuv420p" -pix_fmt yuv420p {outfile}'
-    print(f"Executing:\n  {cmd}\n")
-    subprocess.call(cmd, shell=True, universal_newlines=True)
-    os.remove(temp_concat_file)
+    if not files:
+        print(f"No images found in {infile}")
+        sys.exit(1)
+    sequence = detect_sequence(files)
+    if sequence is not None:
+        pattern, start_number = sequence
+        print(f"Encoding {len(files)} numbered images as {pattern}")
+        ok = encode_sequence(pattern, start_number, len(files), outfile, args.fps)
+    else:
+        print(f"Streaming {len(files)} images to ffmpeg")
+        ok = encode_images(files, outfile, args.fps)
+    if not ok:
+        print(f"Failed to generate {outfile}")
+        sys.exit(1)
+    print(f"Generated {outfile}")
 
 
 if __name__ == "__main__":
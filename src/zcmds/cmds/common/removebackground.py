@@ -1,17 +1,27 @@
 import argparse
 import atexit
 import concurrent.futures
+import importlib.util
+import json
+import multiprocessing
 import os
+import queue
 import shutil
+import signal
 import subprocess
 import sys
 import threading
 import time
 import warnings
 import webbrowser
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional
+
+from zcmds.util.ffmpeg_runner import FfmpegProgress, run_ffmpeg
+from zcmds.util.frame_encoder import decode_frames
+from zcmds.util.media import ffprobe, get_duration, get_stream, parse_frame_rate
 
 
 # notes: https://github.com/danielgatis/rembg/issues/312
@@ -48,6 +58,26 @@ MODELS = {
 
 MODEL_CHOICES = list(MODELS.keys())
 
+# Frames decoded but not yet encoded, per worker. Keeps memory flat no matter
+# how long the video is.
+FRAMES_IN_FLIGHT_PER_WORKER = 2
+# The rembg cli flags: -a -ae 15 --post-process-mask
+REMOVE_KWARGS: dict[str, Any] = {
+    "alpha_matting": True,
+    "alpha_matting_erode_size": 15,
+    "post_process_mask": True,
+}
+# Mean absolute difference, 0-1, below which a frame reuses the last mask.
+DEFAULT_REUSE_THRESHOLD = 0.01
+# Consecutive frames that may reuse one mask before inference runs again.
+DEFAULT_MAX_REUSE = 15
+# Frames are compared at about this size.
+_DIFF_SIZE = 64
+# worker_id of frames that skipped inference.
+_REUSED = -1
+# Resumable runs record each finished frame here, in the work directory.
+MANIFEST_NAME = "manifest.jsonl"
+
 
 @dataclass
 class RemoveBackgroundVideoResult:
@@ -55,6 +85,23 @@ class RemoveBackgroundVideoResult:
     mp4_path: Path
 
 
+@dataclass
+class WorkerStats:
+    worker_id: int
+    frames: int = 0
+    busy_seconds: float = 0.0
+
+
+@dataclass
+class SegmentStats:
+    workers: list[WorkerStats] = field(default_factory=lambda: [])
+    reused: int = 0
+
+    @property
+    def frames(self) -> int:
+        return self.reused + sum(w.frames for w in self.workers)
+
+
 @dataclass
 class VidInfo:
     width: int
@@ -104,30 +151,12 @@ def open_browser_with_delay(url: str, delay: float) -> None:
 
 
 def get_video_info(video_path: Path) -> VidInfo:
-    # use static_ffmpeg to get the video dimensions using the ffprobe and the
-    # json output feature
-    assert shutil.which("vidinfo") is not None, "vidinfo not found"
     assert video_path.exists(), f"Video file not found: {video_path}"
-    command = f'vidinfo "{video_path}"'
-    stdout = subprocess.check_output(command, shell=True).decode("utf-8")
-    lines = stdout.split("\n")
-    height: Optional[int] = None
-    width: Optional[int] = None
-    fps: Optional[float] = None
-    for line in lines:
-        if "Height: " in line:
-            height = int(line.split("Height: ")[1])
-        if "Width: " in line:
-            width = int(line.split("Width: ")[1])
-        if "Framerate: " in line:
-            fps_str = line.split("Framerate: ")[1]
-            # split out the " fps" part
-            fps = float(fps_str.split(" ")[0])
-    assert height is not None, "Height not found in video info"
-    assert width is not None, "Width not found in video info"
+    video = get_stream(ffprobe(str(video_path)), "video")
+    assert video is not None, f"No video stream in {video_path}"
+    fps = parse_frame_rate(video.get("r_frame_rate"))
     assert fps is not None, "Framerate not found in video info"
-    # return width, height, fps
-    return VidInfo(width, height, fps)
+    return VidInfo(int(video["width"]), int(video["height"]), fps)
 
 
 def _exec(cmd: str) -> None:
@@ -137,6 +166,588 @@ def _exec(cmd: str) -> None:
         raise OSError(f"Error running command: {cmd}, return code: {rtn}")
 
 
+def rembg_available() -> bool:
+    """True if rembg can be imported for the in process streaming pipeline."""
+    return importlib.util.find_spec("rembg") is not None
+
+
+def worker_env(
+    worker_id: int, workers: int, gpus: Optional[list[int]] = None
+) -> dict[str, str]:
+    """
+    Environment of one segmentation worker. The cores are split between the
+    workers, rembg sizes its onnxruntime thread pools from OMP_NUM_THREADS, so
+    N workers don't each start a pool as big as the machine. With gpus the
+    workers are pinned round robin.
+    """
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    env = {"OMP_NUM_THREADS": str(threads)}
+    if gpus:
+        env["CUDA_VISIBLE_DEVICES"] = str(gpus[worker_id % len(gpus)])
+    return env
+
+
+def frame_signature(frame: bytes, width: int, height: int) -> Any:
+    """A small grayscale copy of an RGB frame, cheap to compare."""
+    import numpy as np
+
+    step = max(1, max(width, height) // _DIFF_SIZE)
+    pixels: Any = np.frombuffer(frame, np.uint8)
+    pixels = pixels.reshape(height, width, 3)[::step, ::step]
+    return pixels.mean(axis=2, dtype=np.float32)
+
+
+def frame_difference(a: Any, b: Any) -> float:
+    """Mean absolute difference of two frame signatures, 0 to 1."""
+    import numpy as np
+
+    return float(np.abs(a - b).mean()) / 255
+
+
+def apply_alpha(rgb: bytes, alpha: bytes) -> bytes:
+    """RGBA from an RGB frame and the alpha channel of another."""
+    import numpy as np
+
+    rgba = np.empty((len(alpha), 4), np.uint8)
+    pixels: Any = np.frombuffer(rgb, np.uint8)
+    rgba[:, :3] = pixels.reshape(-1, 3)
+    rgba[:, 3] = np.frombuffer(alpha, np.uint8)
+    return rgba.tobytes()
+
+
+def _exit_with_parent() -> None:
+    """
+    Exits the worker once the parent is gone. Polling in_queue isn't enough: a
+    parent killed mid put leaves a partial frame that get() blocks on forever.
+    """
+    parent = multiprocessing.parent_process()
+    if parent is not None:
+        parent.join()
+        os._exit(1)
+
+
+def _segment_worker(
+    worker_id: int,
+    env: dict[str, str],
+    model: str,
+    width: int,
+    height: int,
+    in_queue: "multiprocessing.Queue[Any]",
+    out_queue: "multiprocessing.Queue[Any]",
+) -> None:
+    """
+    Worker process: loads the model once, then turns RGB frames from in_queue
+    into RGBA frames on out_queue until it gets None.
+    """
+    # Ctrl-C goes to the parent, which terminates the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    threading.Thread(target=_exit_with_parent, daemon=True).start()
+    # Must be set before onnxruntime is imported.
+    os.environ.update(env)
+    try:
+        from PIL import Image
+
+        rembg: Any = importlib.import_module("rembg")
+        session = rembg.new_session(model)
+    except Exception as ex:  # noqa: BLE001
+        out_queue.put((-1, worker_id, 0.0, f"failed to load {model}: {ex}"))
+        return
+    while True:
+        job = in_queue.get()
+        if job is None:
+            return
+        index, data = job
+        start = time.monotonic()
+        try:
+            img = Image.frombytes("RGB", (width, height), data)
+            out = rembg.remove(img, session=session, **REMOVE_KWARGS)
+            rgba = out.convert("RGBA").tobytes()
+        except Exception as ex:  # noqa: BLE001
+            error = f"segmenting frame {index} failed: {ex}"
+            out_queue.put((-1, worker_id, 0.0, error))
+            return
+        out_queue.put((index, worker_id, time.monotonic() - start, rgba))
+
+
+def remove_background_frames(
+    frames: Iterable[bytes],
+    width: int,
+    height: int,
+    model: str = MODEL,
+    workers: int = 1,
+    gpus: Optional[list[int]] = None,
+    stats: Optional[SegmentStats] = None,
+    reuse_threshold: Optional[float] = None,
+    max_reuse: int = DEFAULT_MAX_REUSE,
+) -> Iterator[bytes]:
+    """
+    Streams RGB frames through worker processes that each hold one model
+    session and yields the RGBA results in order. Workers take the next frame
+    as soon as they are free, so a slow worker doesn't hold up the others. At
+    most FRAMES_IN_FLIGHT_PER_WORKER * workers frames are held at once.
+
+    Args:
+        gpus: Device ids the workers are pinned to round robin.
+        stats: Filled in as frames complete.
+        reuse_threshold: Frames that differ from the last segmented frame by
+            less than this reuse its mask instead of running inference, at
+            most max_reuse in a row.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    in_queue: "multiprocessing.Queue[Any]" = ctx.Queue()
+    out_queue: "multiprocessing.Queue[Any]" = ctx.Queue()
+    # Frames left in the queues must not block interpreter exit.
+    in_queue.cancel_join_thread()
+    out_queue.cancel_join_thread()
+    procs = [
+        ctx.Process(
+            target=_segment_worker,
+            args=(
+                i,
+                worker_env(i, workers, gpus),
+                model,
+                width,
+                height,
+                in_queue,
+                out_queue,
+            ),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    if stats is None:
+        stats = SegmentStats()
+    stats.workers[:] = [WorkerStats(i) for i in range(workers)]
+    for proc in procs:
+        proc.start()
+    slots = threading.Semaphore(workers * FRAMES_IN_FLIGHT_PER_WORKER)
+    stop = threading.Event()
+    total: list[int] = []
+    feed_errors: list[BaseException] = []
+
+    def feed() -> None:
+        count = 0
+        reference: Any = None
+        run = 0
+        try:
+            for index, frame in enumerate(frames):
+                while not slots.acquire(timeout=0.25):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                count += 1
+                if reuse_threshold is not None:
+                    # Compared to the last segmented frame, not the previous
+                    # one, so slow drift still triggers inference.
+                    signature = frame_signature(frame, width, height)
+                    if (
+                        reference is not None
+                        and run < max_reuse
+                        and frame_difference(signature, reference) < reuse_threshold
+                    ):
+                        run += 1
+                        out_queue.put((index, _REUSED, 0.0, frame))
+                        continue
+                    reference, run = signature, 0
+                in_queue.put((index, frame))
+        except BaseException as ex:  # noqa: BLE001
+            feed_errors.append(ex)
+        finally:
+            close = getattr(frames, "close", None)
+            if close is not None:
+                close()
+            total.append(count)
+            for _ in procs:
+                in_queue.put(None)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    pending: dict[int, tuple[bool, bytes]] = {}
+    alpha = b""
+    next_index = 0
+    try:
+        while not total or next_index < total[0]:
+            try:
+                index, worker_id, seconds, data = out_queue.get(timeout=1)
+            except queue.Empty:
+                if not any(proc.is_alive() for proc in procs):
+                    raise RuntimeError("all segmentation workers exited")
+                continue
+            if index < 0:
+                raise RuntimeError(f"worker {worker_id}: {data}")
+            if worker_id == _REUSED:
+                stats.reused += 1
+            else:
+                stat = stats.workers[int(worker_id)]
+                stat.frames += 1
+                stat.busy_seconds += seconds
+            pending[index] = (worker_id == _REUSED, data)
+            while next_index in pending:
+                reused, data = pending.pop(next_index)
+                # In order, so the last segmented frame is the reference the
+                # reused frame was compared to.
+                if reused:
+                    data = apply_alpha(data, alpha)
+                elif reuse_threshold is not None:
+                    alpha = data[3::4]
+                yield data
+                next_index += 1
+                slots.release()
+        if feed_errors:
+            raise feed_errors[0]
+    finally:
+        stop.set()
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        for proc in procs:
+            proc.join(timeout=5)
+
+
+def build_alpha_encode_cmd(
+    video_path: Path,
+    width: int,
+    height: int,
+    fps: float,
+    bitrate_megs: float,
+    webm_path: Path,
+    mp4_path: Path,
+) -> list[str]:
+    """
+    One ffmpeg reading RGBA frames from stdin that writes the vp9 webm and the
+    HEVC mp4 together, muxing in the source audio.
+    """
+    cmd = ["static_ffmpeg", "-y", "-f", "rawvideo", "-pix_fmt", "rgba"]
+    cmd += ["-s", f"{width}x{height}", "-framerate", str(fps), "-i", "-"]
+    cmd += ["-i", str(video_path)]
+    cmd += webm_args(bitrate_megs) + [str(webm_path)]
+    return cmd + mp4_args(bitrate_megs) + [str(mp4_path)]
+
+
+def webm_args(bitrate_megs: float) -> list[str]:
+    """vp9 with alpha for Chrome/Firefox, frames from input 0, audio from 1."""
+    args = ["-map", "0:v:0", "-map", "1:a:0?", "-c:v", "libvpx-vp9"]
+    args += ["-b:v", f"{bitrate_megs}M", "-auto-alt-ref", "0"]
+    return args + ["-pix_fmt", "yuva420p", "-c:a", "libvorbis"]
+
+
+def mp4_args(bitrate_megs: float) -> list[str]:
+    """
+    HEVC for Safari. The only encoder that keeps the alpha channel in a form
+    Safari iOS plays is hevc_videotoolbox, x265 can't encode alpha.
+    """
+    args = ["-map", "0:v:0", "-map", "1:a:0?", "-c:v", "libx265"]
+    args += ["-b:v", f"{bitrate_megs}M", "-tag:v", "hvc1"]
+    return args + ["-pix_fmt", "yuv420p", "-c:a", "aac"]
+
+
+def encode_png_frames(
+    pattern: Path,
+    video_path: Path,
+    fps: float,
+    bitrate_megs: float,
+    webm_path: Path,
+    mp4_path: Path,
+    start_number: int = 1,
+    video_filter: Optional[str] = None,
+    out_fps: Optional[float] = None,
+) -> None:
+    """
+    Encodes an RGBA png sequence to the webm and the mp4 at the same time,
+    muxing the source audio directly instead of in a second pass.
+    """
+    inputs = ["-framerate", str(fps), "-start_number", str(start_number)]
+    inputs += ["-i", str(pattern), "-i", str(video_path)]
+    filter_args = ["-vf", video_filter] if video_filter else []
+    if out_fps:
+        filter_args += ["-r", str(out_fps)]
+    duration = get_duration(ffprobe(str(video_path)))
+    percents = {"webm": 0.0, "mp4": 0.0}
+    lock = threading.Lock()
+
+    def encode(name: str, args: list[str], out: Path) -> None:
+        def on_progress(progress: FfmpegProgress) -> None:
+            with lock:
+                percents[name] = progress.percent or 0.0
+                line = "  ".join(f"{k} {v:5.1f}%" for k, v in percents.items())
+                print(f"\r  {line}", end="", flush=True)
+
+        cmd = ["static_ffmpeg", "-y", *inputs, *filter_args, *args, str(out)]
+        run_ffmpeg(cmd, duration=duration, on_progress=on_progress, check=True)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(encode, "webm", webm_args(bitrate_megs), webm_path),
+            executor.submit(encode, "mp4", mp4_args(bitrate_megs), mp4_path),
+        ]
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            print()
+
+
+class FrameManifest:
+    """
+    The finished frames of a resumable run. Each segmented frame is saved as
+    an RGBA png and then appended to manifest.jsonl, so a frame is either
+    fully recorded or redone. The first line holds the settings the frames
+    were made with, a run with other settings starts over.
+    """
+
+    def __init__(self, workdir: Path, settings: dict[str, Any]) -> None:
+        self.frames_dir = workdir / "frames"
+        self.path = workdir / MANIFEST_NAME
+        self.done: set[int] = set()
+        self.frames_dir.mkdir(parents=True, exist_ok=True)
+        if self.path.exists() and not self._load(settings):
+            print(f"Settings changed since the last run, starting over in {workdir}")
+            shutil.rmtree(self.frames_dir, ignore_errors=True)
+            self.frames_dir.mkdir(parents=True, exist_ok=True)
+            self.path.unlink()
+        if not self.path.exists():
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"settings": settings}) + "\n")
+        self._file = open(self.path, "a", encoding="utf-8")
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read() != b"\n":
+                # End the line an interrupted write left behind.
+                self._file.write("\n")
+
+    def _load(self, settings: dict[str, Any]) -> bool:
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        try:
+            if json.loads(lines[0]).get("settings") != settings:
+                return False
+        except (IndexError, json.JSONDecodeError):
+            return False
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # cut off by the interruption
+            if (self.path.parent / entry["path"]).exists():
+                self.done.add(int(entry["frame"]))
+        return True
+
+    def frame_path(self, index: int) -> Path:
+        return self.frames_dir / f"{index:07d}.png"
+
+    def add(self, index: int, rgba: bytes, width: int, height: int) -> None:
+        from PIL import Image
+
+        path = self.frame_path(index)
+        tmp = path.with_suffix(".tmp")
+        image = Image.frombytes("RGBA", (width, height), rgba)
+        # Fast compression, these are deleted once the videos are encoded.
+        image.save(tmp, format="PNG", compress_level=1)
+        os.replace(tmp, path)
+        entry = {"frame": index, "path": str(path.relative_to(self.path.parent))}
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self.done.add(index)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _decode_size(
+    vidinfo: VidInfo, output_height: Optional[int], fps_override: Optional[float]
+) -> tuple[int, int, str]:
+    """Width, height and decode filter for the output height and fps."""
+    width, height = vidinfo.width, vidinfo.height
+    filters: list[str] = []
+    if fps_override:
+        filters.append(f"fps={fps_override}")
+    if output_height is not None:
+        # Segmenting at the output size is the same result for less work.
+        width = int(width * output_height / height / 2) * 2
+        height = output_height
+        filters.append(f"scale={width}:{height}")
+    return width, height, ",".join(filters)
+
+
+def stream_remove_background(
+    video_path: Path,
+    bitrate_megs: float,
+    output_height: Optional[int] = None,
+    fps_override: Optional[float] = None,
+    model: str = MODEL,
+    num_jobs: int = 1,
+    gpus: Optional[list[int]] = None,
+    reuse_threshold: Optional[float] = None,
+    max_reuse: int = DEFAULT_MAX_REUSE,
+) -> RemoveBackgroundVideoResult:
+    """
+    Decodes, segments and encodes in one pipeline without writing any frames to
+    disk: ffmpeg rawvideo out, worker processes, ffmpeg rawvideo in.
+    """
+    vidinfo = get_video_info(video_path)
+    print(f"Video dimensions: {vidinfo.width}x{vidinfo.height}")
+    width, height, video_filter = _decode_size(vidinfo, output_height, fps_override)
+    fps = fps_override or vidinfo.fps
+    webm_path, mp4_path = get_out_paths(video_path, model)
+    frames = decode_frames(video_path, width, height, "rgb24", video_filter)
+    stats = SegmentStats()
+    rgba_frames = remove_background_frames(
+        frames,
+        width,
+        height,
+        model,
+        num_jobs,
+        gpus,
+        stats,
+        reuse_threshold,
+        max_reuse,
+    )
+    cmd = build_alpha_encode_cmd(
+        video_path, width, height, fps, bitrate_megs, webm_path, mp4_path
+    )
+    device = f"gpus {gpus}" if gpus else "cpu"
+    print(f"Removing the background with {num_jobs} {model} worker(s) on {device}")
+    start = time.monotonic()
+    try:
+        run_ffmpeg(
+            cmd,
+            duration=get_duration(ffprobe(str(video_path))),
+            outputs=[str(webm_path), str(mp4_path)],
+            check=True,
+            stdin_data=rgba_frames,
+        )
+    except BaseException:
+        # ffmpeg finalizes the outputs when its input ends early, so a failed
+        # run would otherwise leave complete looking but truncated videos.
+        for path in (webm_path, mp4_path):
+            path.unlink(missing_ok=True)
+        raise
+    print_segment_stats(stats, time.monotonic() - start)
+    return _print_result(webm_path, mp4_path)
+
+
+def resumable_remove_background(
+    video_path: Path,
+    workdir: Path,
+    bitrate_megs: float,
+    output_height: Optional[int] = None,
+    fps_override: Optional[float] = None,
+    model: str = MODEL,
+    num_jobs: int = 1,
+    gpus: Optional[list[int]] = None,
+    reuse_threshold: Optional[float] = None,
+    max_reuse: int = DEFAULT_MAX_REUSE,
+    keep_files: bool = False,
+) -> RemoveBackgroundVideoResult:
+    """
+    Like stream_remove_background but every segmented frame is kept in workdir
+    with a manifest, so an interrupted run continues where it stopped. The
+    work directory is only removed once both videos are encoded.
+    """
+    vidinfo = get_video_info(video_path)
+    print(f"Video dimensions: {vidinfo.width}x{vidinfo.height}")
+    width, height, video_filter = _decode_size(vidinfo, output_height, fps_override)
+    fps = fps_override or vidinfo.fps
+    settings = {
+        "video": str(video_path.resolve()),
+        "size": video_path.stat().st_size,
+        "model": model,
+        "width": width,
+        "height": height,
+        "fps": fps,
+    }
+    manifest = FrameManifest(workdir, settings)
+    if manifest.done:
+        print(f"Resuming, {len(manifest.done)} frames are already done in {workdir}")
+    # Indices of the frames sent for segmentation, they come back in order.
+    indices: deque[int] = deque()
+    total = 0
+
+    def todo() -> Iterator[bytes]:
+        nonlocal total
+        for index, frame in enumerate(
+            decode_frames(video_path, width, height, "rgb24", video_filter)
+        ):
+            total = index + 1
+            if index not in manifest.done:
+                indices.append(index)
+                yield frame
+
+    stats = SegmentStats()
+    device = f"gpus {gpus}" if gpus else "cpu"
+    print(f"Removing the background with {num_jobs} {model} worker(s) on {device}")
+    start = time.monotonic()
+    try:
+        for rgba in remove_background_frames(
+            todo(),
+            width,
+            height,
+            model,
+            num_jobs,
+            gpus,
+            stats,
+            reuse_threshold,
+            max_reuse,
+        ):
+            manifest.add(indices.popleft(), rgba, width, height)
+            if stats.frames % 100 == 0:
+                print(f"\r  {len(manifest.done)}/{total} frames", end="", flush=True)
+    finally:
+        manifest.close()
+    print(f"\r  {len(manifest.done)}/{total} frames")
+    print_segment_stats(stats, time.monotonic() - start)
+    missing = [i for i in range(total) if i not in manifest.done]
+    if not total or missing:
+        raise RuntimeError(f"{len(missing)} of {total} frames were not segmented")
+    webm_path, mp4_path = get_out_paths(video_path, model)
+    encode_png_frames(
+        manifest.frames_dir / "%07d.png",
+        video_path,
+        fps,
+        bitrate_megs,
+        webm_path,
+        mp4_path,
+        start_number=0,
+    )
+    if not keep_files:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return _print_result(webm_path, mp4_path)
+
+
+def get_out_paths(video_path: Path, model: str) -> tuple[Path, Path]:
+    """The webm and mp4 written for video_path."""
+    stem = str(video_path.with_suffix(""))
+    return Path(f"{stem}-nobg-{model}.webm"), Path(f"{stem}-nobg-{model}.mp4")
+
+
+def _print_result(webm_path: Path, mp4_path: Path) -> RemoveBackgroundVideoResult:
+    print(
+        f"Generated transparent supporting webm (vp9 with yuva420p) for Chrome/Firefox: {webm_path}"
+    )
+    print(
+        f"Generated transparent supporting mp4 (HEVC with yuva420p) for Safari: {mp4_path}"
+    )
+    return RemoveBackgroundVideoResult(webm_path, mp4_path)
+
+
+def print_segment_stats(stats: SegmentStats, elapsed: float) -> None:
+    """Frames per worker, how much of the run each one spent segmenting and
+    how many frames reused a mask."""
+    for stat in stats.workers:
+        fps = stat.frames / stat.busy_seconds if stat.busy_seconds else 0.0
+        busy = 100 * stat.busy_seconds / elapsed if elapsed else 0.0
+        print(
+            f"  worker {stat.worker_id}: {stat.frames} frames,"
+            f" {fps:.1f} frames/s, busy {busy:.0f}%"
+        )
+    if stats.reused:
+        print(
+            f"  skipped inference on {stats.reused} of {stats.frames} frames"
+            f" ({100 * stats.reused / stats.frames:.0f}%) by reusing the last mask"
+        )
+
+
 def chunkify(data_list: list[Any], num_chunks: int) -> list[list[Any]]:
     chunk_size = (len(data_list) + num_chunks - 1) // num_chunks
     return [data_list[i : i + chunk_size] for i in range(0, len(data_list), chunk_size)]
@@ -167,14 +778,57 @@ def video_remove_background(
     keep_files: bool = False,
     exposed_gpus: Optional[list[int]] = None,
     num_jobs: Optional[int] = None,
+    reuse_threshold: Optional[float] = None,
+    max_reuse: int = DEFAULT_MAX_REUSE,
+    resume: bool = False,
 ) -> RemoveBackgroundVideoResult:
+    if rembg_available():
+        workers = num_jobs or len(exposed_gpus or [0])
+        gpus = exposed_gpus if has_cuda() else None
+        if resume:
+            return resumable_remove_background(
+                video_path,
+                output_dir,
+                bitrate_megs,
+                output_height,
+                fps_override,
+                model,
+                workers,
+                gpus,
+                reuse_threshold,
+                max_reuse,
+                keep_files,
+            )
+        return stream_remove_background(
+            video_path,
+            bitrate_megs,
+            output_height,
+            fps_override,
+            model,
+            workers,
+            gpus,
+            reuse_threshold,
+            max_reuse,
+        )
+    if reuse_threshold is not None:
+        print("Mask reuse needs rembg importable, every frame will be segmented")
+    if resume:
+        print("Skipping finished frames needs rembg importable, keeping the files")
+    print(
+        "rembg can't be imported, falling back to extracting frames for the rembg"
+        " cli. pip install rembg to stream frames without writing them to disk."
+    )
+    install_rembg_if_missing()
     output_dir.mkdir(parents=True, exist_ok=True)
-    if not keep_files:
+    if not keep_files and not resume:
         schedule_cleanup(output_dir)
     vidinfo: VidInfo = get_video_info(video_path)
     print(f"Video dimensions: {vidinfo.width}x{vidinfo.height}")
-    cmd = f"static_ffmpeg -hide_banner -y -i {video_path} {output_dir}/%07d.png"
-    _exec(cmd)
+    run_ffmpeg(
+        ["static_ffmpeg", "-y", "-i", video_path, f"{output_dir}/%07d.png"],
+        outputs=[],
+        check=True,
+    )
     print(f"Images saved to {output_dir}")
 
     if num_jobs is None:
@@ -235,58 +889,21 @@ def video_remove_background(
             for img in chunk_output_dir.glob("*.png"):
                 shutil.move(str(img), str(final_output_dir / img.name))
 
-    fps: float = fps_override if fps_override else vidinfo.fps
-    out_vid_path = Path(str(video_path.with_suffix("")) + "-nobackground.webm")
-    filter_stmt = ""
+    video_filter: Optional[str] = None
     if output_height is not None:
-        filter_stmt = f'-vf "scale=trunc(oh*a/2)*2:{output_height}"'
-
-    # Generate webm format for Chrome/Firefox
-    cmd = (
-        f"static_ffmpeg -hide_banner -y -framerate {vidinfo.fps}"
-        f' -i "{final_output_dir}/%07d.png" {filter_stmt} -c:v libvpx-vp9 -b:v {bitrate_megs}M'
-        f' -auto-alt-ref 0 -pix_fmt yuva420p -an -r {fps} "{out_vid_path}"'
-    )
-    _exec(cmd)
-
-    # Command to merge the audio from the original video with the new video
-    final_output_path = Path(str(video_path.with_suffix("")) + f"-nobg-{model}.webm")
-    print(f"Mixing audio from {video_path} into {final_output_path}")
-    cmd = (
-        f'static_ffmpeg -hide_banner -y -i "{out_vid_path}" -i "{video_path}"'
-        f' -c:v copy -c:a libvorbis -map 0:v:0 -map 1:a:0 "{final_output_path}"'
+        video_filter = f"scale=trunc(oh*a/2)*2:{output_height}"
+    webm_path, mp4_path = get_out_paths(video_path, model)
+    encode_png_frames(
+        final_output_dir / "%07d.png",
+        video_path,
+        vidinfo.fps,
+        bitrate_megs,
+        webm_path,
+        mp4_path,
+        video_filter=video_filter,
+        out_fps=fps_override,
     )
-    _exec(cmd)
-
-    # Generate HEVC mp4 format for Safari
-    tmp_mp4 = Path(str(video_path.with_suffix("")) + "-nobackground.mp4")
-    # Generate HEVC mp4 format for Safari
-    # So apparently the only codec to encode alpha channel compatible with Safari iOS is to use the
-    # hevc_videotoolbox encoder. The software x265 encoder does not support alpha channel encoding.
-    # so we will have to come back to this.
-    cmd = (
-        f"static_ffmpeg -hide_banner -y -framerate {vidinfo.fps}"
-        f' -i "{final_output_dir}/%07d.png" {filter_stmt} -c:v libx265 -b:v {bitrate_megs}M'
-        f' -tag:v hvc1 -an -r {fps} "{tmp_mp4}"'
-    )
-
-    _exec(cmd)
-
-    # now mix in the audio
-    out_mp4 = Path(str(video_path.with_suffix("")) + f"-nobg-{model}.mp4")
-    cmd = (
-        f'static_ffmpeg -hide_banner -y -i "{tmp_mp4}" -i "{video_path}"'
-        f' -c:v copy -c:a aac -map 0:v:0 -map 1:a:0 "{out_mp4}"'
-    )
-    _exec(cmd)
-
-    print(
-        f"Generated transparent supporting webm (vp9 with yuva420p) for Chrome/Firefox: {final_output_path}"
-    )
-    print(
-        f"Generated transparent supporting mp4 (HEVC with yuva420p) for Safari: {out_mp4}"
-    )
-    return RemoveBackgroundVideoResult(final_output_path, out_mp4)
+    return _print_result(webm_path, mp4_path)
 
 
 def is_video_file(file_path: Path) -> bool:
@@ -355,14 +972,38 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--jobs",
         type=int,
-        help="Number of parallel jobs to run (default: same as --gpu-count)",
+        help="Number of segmentation worker processes, each loads the model once."
+        " On cpu the cores are split between them (default: same as --gpu-count)",
+    )
+    parser.add_argument(
+        "--reuse-masks",
+        type=float,
+        nargs="?",
+        const=DEFAULT_REUSE_THRESHOLD,
+        metavar="THRESHOLD",
+        help="Reuse the last mask for frames that barely differ from the last"
+        " segmented frame, for static camera footage. THRESHOLD is the mean"
+        f" pixel difference from 0 to 1 (default: {DEFAULT_REUSE_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--max-reuse",
+        type=int,
+        default=DEFAULT_MAX_REUSE,
+        help=f"Frames in a row that may reuse one mask (default: {DEFAULT_MAX_REUSE})",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep every finished frame in the work directory so an interrupted"
+        " run continues where it stopped",
     )
     return parser.parse_args()
 
 
 def cli() -> int:
-    install_rembg_if_missing()
     args = parse_args()
+    if args.file is None or not is_video_file(args.file):
+        install_rembg_if_missing()
 
     if args.file is None:
         open_browser_with_delay(f"http://localhost:{PORT}", 4)
@@ -383,6 +1024,9 @@ def cli() -> int:
             model=args.model,
             exposed_gpus=[int(i) for i in range(args.gpu_count)],
             num_jobs=args.jobs or args.gpu_count,
+            reuse_threshold=args.reuse_masks,
+            max_reuse=args.max_reuse,
+            resume=args.resume,
         )
         diff = time.time() - start
         print(f"Time taken: {diff:.2f} seconds")
@@ -392,7 +1036,13 @@ def cli() -> int:
     return 0
 
 
+def _raise_on_sigterm(signum: int, frame: Any) -> None:
+    # Same cleanup as Ctrl-C, so the segmentation workers are terminated.
+    raise KeyboardInterrupt
+
+
 def main() -> int:
+    signal.signal(signal.SIGTERM, _raise_on_sigterm)
     try:
         return cli()
     except KeyboardInterrupt:
@@ -1,6 +1,35 @@
 import argparse
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from zcmds.util.ffmpeg_runner import run_ffmpeg
+from zcmds.util.media import (
+    MEDIA_EXTENSIONS,
+    expand_media_paths,
+    ffprobe,
+    get_stream,
+    is_in_out_pair,
+)
+
+
+# Channel order of the layouts channelsplit understands, see `ffmpeg -layouts`.
+LAYOUT_CHANNELS = {
+    "mono": ["FC"],
+    "stereo": ["FL", "FR"],
+    "2.1": ["FL", "FR", "LFE"],
+    "3.0": ["FL", "FR", "FC"],
+    "quad": ["FL", "FR", "BL", "BR"],
+    "4.0": ["FL", "FR", "FC", "BC"],
+    "5.0": ["FL", "FR", "FC", "BL", "BR"],
+    "5.0(side)": ["FL", "FR", "FC", "SL", "SR"],
+    "5.1": ["FL", "FR", "FC", "LFE", "BL", "BR"],
+    "5.1(side)": ["FL", "FR", "FC", "LFE", "SL", "SR"],
+    "7.1": ["FL", "FR", "FC", "LFE", "BL", "BR", "SL", "SR"],
+}
+# Stereo keeps the names older versions produced.
+_CHANNEL_SUFFIXES = {"FL": "_left", "FR": "_right"}
 
 
 def _apply_name_suffix(path: str, new_name_suffix: str) -> str:
@@ -28,31 +57,157 @@ def _print_file_exists(path: str) -> None:
         print(f"WARNING: failed to generate {path}")
 
 
+def get_channel_out_path(out_wav: str, channel: str) -> str:
+    suffix = _CHANNEL_SUFFIXES.get(channel, f"_{channel}")
+    return _apply_name_suffix(out_wav, suffix)
+
+
+def is_channel_output(path: str) -> bool:
+    """True if path looks like a wav this command wrote, e.g. talk_left.wav."""
+    name, ext = os.path.splitext(path)
+    if ext.lower() != ".wav":
+        return False
+    channels = {c for names in LAYOUT_CHANNELS.values() for c in names}
+    return any(name.endswith(get_channel_out_path("", c)) for c in channels)
+
+
+def probe_layout(path: str) -> str:
+    """The channel layout of the first audio stream, guessed from the count if unset."""
+    audio = get_stream(ffprobe(path), "audio")
+    if audio is None:
+        raise ValueError(f"{path} has no audio stream")
+    layout = audio.get("channel_layout")
+    if layout:
+        return layout
+    channels = int(audio.get("channels", 2))
+    for name, names in LAYOUT_CHANNELS.items():
+        if len(names) == channels:
+            return name
+    raise ValueError(f"{path} has {channels} channels and no known layout")
+
+
+def build_split_cmd(
+    path: str, layout: str, channels: list[str], out_paths: list[str]
+) -> list[str]:
+    """
+    One decode feeding channelsplit, with a mapped mono output per channel.
+    """
+    pads = "".join(f"[{c}]" for c in channels)
+    graph = (
+        f"[0:a:0]channelsplit=channel_layout={layout}:channels={'+'.join(channels)}"
+        f"{pads}"
+    )
+    cmd = ["static_ffmpeg", "-y", "-i", path, "-filter_complex", graph]
+    for channel, out_path in zip(channels, out_paths):
+        cmd += ["-map", f"[{channel}]", out_path]
+    return cmd
+
+
+def split_channels(
+    path: str,
+    out_wav: str,
+    layout: Optional[str] = None,
+    channels: Optional[list[str]] = None,
+    quiet: bool = False,
+) -> list[str]:
+    """
+    Splits the audio of path into one mono wav per channel, named after out_wav.
+    Returns the paths that were written.
+    """
+    layout = layout or probe_layout(path)
+    if layout not in LAYOUT_CHANNELS:
+        supported = ", ".join(LAYOUT_CHANNELS)
+        raise ValueError(f"unsupported channel layout {layout}, use one of {supported}")
+    channels = channels or LAYOUT_CHANNELS[layout]
+    unknown = [c for c in channels if c not in LAYOUT_CHANNELS[layout]]
+    if unknown:
+        raise ValueError(f"{layout} has no {', '.join(unknown)} channel")
+    out_paths = [get_channel_out_path(out_wav, c) for c in channels]
+    cmd = build_split_cmd(path, layout, channels, out_paths)
+    result = run_ffmpeg(cmd, outputs=out_paths, quiet=quiet)
+    if not result.ok:
+        raise ValueError(f"ffmpeg failed with code {result.returncode}")
+    return [p for p in out_paths if os.path.exists(p)]
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description="Print video durations\n",
+        description="Splits audio channels into mono wav files\n\n"
+        "  stereo2mono in.mp4 out.wav\n"
+        "  stereo2mono recordings/ --layout 5.1 --outdir split\n",
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("vidfile", help="Path to vid file", nargs="?")
-    parser.add_argument("outwavfile", help="Path to output wav file", nargs="?")
+    parser.add_argument(
+        "paths",
+        help="input and output wav file, or files, directories and globs to batch",
+        nargs="*",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=list(LAYOUT_CHANNELS),
+        help="channel layout of the input, default is the probed layout",
+    )
+    parser.add_argument(
+        "--channels", help="comma separated channels to keep, e.g. FL,FR,FC"
+    )
+    parser.add_argument(
+        "--outdir", help="batch output directory, default is next to each input"
+    )
+    parser.add_argument(
+        "--recursive", action="store_true", help="search directories recursively"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of files processed at once"
+    )
     args = parser.parse_args()
-    path = args.vidfile or input("in vid file: ")
-    out_wav = args.outwavfile or path
-    out_wav = _apply_ext(out_wav, ".wav")
-    if not os.path.exists(path):
-        print(f"{path} does not exist")
+    paths: list[str] = args.paths
+    channels = args.channels.split(",") if args.channels else None
+    # Two paths keep the original "stereo2mono in out" meaning.
+    if is_in_out_pair(paths, args.outdir):
+        path = paths[0] if paths else input("in vid file: ")
+        out_wav = _apply_ext(paths[1] if len(paths) > 1 else path, ".wav")
+        if not os.path.exists(path):
+            print(f"{path} does not exist")
+            sys.exit(1)
+        try:
+            out_paths = split_channels(path, out_wav, args.layout, channels)
+        except ValueError as ex:
+            print(f"{__file__}: ERROR: {ex}")
+            sys.exit(1)
+        print("\nDone\n")
+        for out_path in out_paths:
+            _print_file_exists(out_path)
+        return
+
+    files = expand_media_paths(paths, MEDIA_EXTENSIONS, recursive=args.recursive)
+    # Don't split the outputs of a previous run found by a directory scan.
+    files = [f for f in files if f in paths or not is_channel_output(f)]
+    if not files:
+        print(f"No media files found in {' '.join(paths)}")
         sys.exit(1)
-    out_left_path = _apply_name_suffix(out_wav, "_left")
-    out_right_path = _apply_name_suffix(out_wav, "_right")
-    cmd0 = f'static_ffmpeg -y -i "{path}" -filter_complex "[0:a]channelsplit=channel_layout=stereo:channels=FR[right]" -map "[right]" "{out_right_path}"'
-    cmd1 = f'static_ffmpeg -y -i "{path}" -filter_complex "[0:a]channelsplit=channel_layout=stereo:channels=FL[left]" -map "[left]" "{out_left_path}"'
-    print(f"Executing:\n  {cmd0}\n")
-    os.system(cmd0)
-    print(f"Executing:\n  {cmd1}\n")
-    os.system(cmd1)
-    print("\nDone\n")
-    _print_file_exists(out_right_path)
-    _print_file_exists(out_left_path)
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+    # A decode plus channelsplit is single threaded, one file per core.
+    jobs = max(1, min(args.jobs or (os.cpu_count() or 1), len(files)))
+    print(f"Splitting {len(files)} files, {jobs} at a time")
+
+    def split(path: str) -> bool:
+        out_wav = _apply_ext(path, ".wav")
+        if args.outdir:
+            out_wav = os.path.join(args.outdir, os.path.basename(out_wav))
+        try:
+            out_paths = split_channels(path, out_wav, args.layout, channels, quiet=True)
+        except (ValueError, OSError) as ex:
+            print(f"  {path}: FAILED: {ex}")
+            return False
+        print(f"  {path}: {len(out_paths)} channels")
+        return True
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(split, files))
+    failed = results.count(False)
+    print(f"Split {len(results) - failed}, failed {failed}")
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":
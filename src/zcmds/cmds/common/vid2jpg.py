@@ -1,34 +1,167 @@
 # pylint: skip-file
 
 import argparse
+import math
 import os
-import subprocess
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from zcmds.util.ffmpeg_runner import run_ffmpeg
+from zcmds.util.media import VIDEO_EXTENSIONS, expand_media_paths, ffprobe, get_duration
+
+
+DEFAULT_THUMB_WIDTH = 320
 
 
 def stripext(s: str) -> str:
     return os.path.splitext(s)[0]
 
 
+def thumbnail_times(duration: float, count: int) -> list[float]:
+    """Evenly spread times, each in the middle of its slice of the video."""
+    return [round(duration * (i + 0.5) / count, 3) for i in range(count)]
+
+
+def build_thumbnail_cmd(
+    infile: str, timestamp: float, out: str, width: int
+) -> list[str]:
+    """
+    Input seeks and decodes only keyframes, so a thumbnail costs one keyframe
+    decode. -noaccurate_seek keeps the keyframe at or before the timestamp
+    instead of skipping ahead to the next one; that frame has a negative
+    timestamp, which passthrough keeps from being dropped.
+    """
+    cmd = ["static_ffmpeg", "-y", "-skip_frame", "nokey", "-noaccurate_seek"]
+    cmd += ["-ss", f"{timestamp:.3f}", "-i", infile, "-map", "0:v:0"]
+    cmd += ["-frames:v", "1", "-fps_mode", "passthrough"]
+    cmd += ["-vf", f"scale={width}:-2", "-q:v", "3", out]
+    return cmd
+
+
+def extract_thumbnails(
+    infile: str,
+    out_dir: str,
+    count: int,
+    width: int = DEFAULT_THUMB_WIDTH,
+    jobs: Optional[int] = None,
+) -> list[str]:
+    """Extracts count thumbnails spread over infile, returns the ones written."""
+    duration = get_duration(ffprobe(infile))
+    if not duration:
+        raise ValueError(f"{infile} has no known duration")
+    os.makedirs(out_dir, exist_ok=True)
+    times = thumbnail_times(duration, count)
+    outs = [os.path.join(out_dir, f"{i + 1:03d}.jpg") for i in range(count)]
+    # Each seek is mostly waiting on disk, more workers than cores is fine.
+    jobs = max(1, min(jobs or (os.cpu_count() or 1) * 2, count))
+
+    def extract(i: int) -> bool:
+        cmd = build_thumbnail_cmd(infile, times[i], outs[i], width)
+        return run_ffmpeg(cmd, quiet=True).ok and os.path.exists(outs[i])
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(extract, range(count)))
+    return [out for out, ok in zip(outs, results) if ok]
+
+
+def build_contact_sheet(images: list[str], out: str) -> bool:
+    """Tiles same sized images into one image, as square as possible."""
+    cols = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / cols)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        concat_list = os.path.join(tmpdir, "images.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for image in images:
+                escaped = os.path.abspath(image).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        cmd = ["static_ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list]
+        cmd += ["-vf", f"tile={cols}x{rows}:padding=4:margin=4", "-frames:v", "1"]
+        cmd += ["-q:v", "3", out]
+        return run_ffmpeg(cmd, quiet=True).ok
+
+
+def run_thumbnails(
+    infiles: list[str],
+    count: int,
+    width: int,
+    sheet: bool,
+    jobs: Optional[int],
+    outname: Optional[str],
+) -> int:
+    """Thumbnails for every input, returns the number of inputs that failed."""
+    failed = 0
+    for infile in infiles:
+        base = stripext(outname) if outname else stripext(infile)
+        out_dir = base + "_imgs"
+        try:
+            images = extract_thumbnails(infile, out_dir, count, width, jobs)
+        except (ValueError, OSError) as ex:
+            print(f"{infile}: FAILED: {ex}")
+            failed += 1
+            continue
+        line = f"{infile}: {len(images)}/{count} thumbnails in {out_dir}"
+        if sheet and images:
+            sheet_path = base + "_sheet.jpg"
+            if build_contact_sheet(images, sheet_path):
+                line += f", contact sheet {sheet_path}"
+            else:
+                line += ", contact sheet FAILED"
+        print(line)
+        if len(images) < count:
+            failed += 1
+    return failed
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Extracts a video frame.\n",
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("input", help="input")
+    parser.add_argument("input", help="input, or several with --count", nargs="+")
     parser.add_argument("--timestamp", help="start of the clip")
     parser.add_argument("--length", help="length of the clip")
     parser.add_argument("--outname", help="output name of the file")
+    parser.add_argument(
+        "--count",
+        type=int,
+        help="extract this many keyframe thumbnails spread over the whole video",
+    )
+    parser.add_argument(
+        "--sheet",
+        action="store_true",
+        help="tile the --count thumbnails into one image",
+    )
+    parser.add_argument(
+        "--width", type=int, default=DEFAULT_THUMB_WIDTH, help="thumbnail width"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of seeks run at once"
+    )
     parser.add_argument("--no-open-folder", action="store_true", help="debug")
     args = parser.parse_args()
-    infile = args.input
+    if args.count:
+        infiles = expand_media_paths(args.input, VIDEO_EXTENSIONS)
+        if not infiles:
+            print(f"No videos found in {' '.join(args.input)}")
+            sys.exit(1)
+        if args.outname and len(infiles) > 1:
+            parser.error("--outname only works with a single input")
+        failed = run_thumbnails(
+            infiles, args.count, args.width, args.sheet, args.jobs, args.outname
+        )
+        sys.exit(1 if failed else 0)
+    if len(args.input) > 1:
+        parser.error("multiple inputs need --count")
+    infile = args.input[0]
     timestamp = args.timestamp or input("timestamp: ")
     length = args.length or input("length (secs): ")
     do_open_folder = not args.no_open_folder
     if args.outname:
         output_path = os.path.splitext(args.outname)[0]
     else:
-        output_path = os.path.splitext(args.input)[0]
+        output_path = os.path.splitext(infile)[0]
     output_path = output_path + "_imgs"
     if not os.path.exists(infile):
         print(f"{infile} does not exist")
@@ -36,15 +169,12 @@ def main():
 
     if not os.path.isdir(output_path):
         os.makedirs(output_path)
-    # ffmpeg -i foo.avi -r 1 -s WxH -f image2 foo-%03d.jpeg -ss -frames:v
-    file_output_fmt = f'"{output_path}/%03d.jpg"'
-
-    cmd = f'static_ffmpeg -hide_banner -i "{infile}" -ss {timestamp} -t {length} -f image2 {file_output_fmt}'
-    print(f"Executing:\n  {cmd}\n")
-    subprocess.call(cmd, shell=True, universal_newlines=True, stderr=subprocess.DEVNULL)
-    if not os.path.exists(output_path):
-        print(f"Error, did not generate {output_path}")
-        print(f"Error from cmd:\n  {cmd}\n")
+    # Input seeking jumps to the timestamp instead of decoding up to it.
+    cmd = ["static_ffmpeg", "-y", "-ss", str(timestamp), "-t", str(length)]
+    cmd += ["-i", infile, "-f", "image2", os.path.join(output_path, "%03d.jpg")]
+    result = run_ffmpeg(cmd, outputs=[])
+    if not result.ok or not os.listdir(output_path):
+        print(f"Error, did not generate images in {output_path}")
     else:
         print(f"Generated images are in directory: {output_path}")
         if do_open_folder:
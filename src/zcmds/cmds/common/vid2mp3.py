@@ -3,7 +3,92 @@
 import argparse
 import os
 import sys
-from pathlib import Path
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from zcmds.cmds.common.audnorm import audnorm
+from zcmds.util.ffmpeg_runner import format_seconds, run_ffmpeg
+from zcmds.util.media import (
+    AUDIO_EXTENSIONS,
+    VIDEO_EXTENSIONS,
+    expand_media_paths,
+    get_stream,
+    probe_many,
+)
+
+
+# Output extension -> source codecs that can be stream copied into it.
+PASSTHROUGH_CODECS = {
+    ".mp3": ["mp3"],
+    ".m4a": ["aac", "alac"],
+    ".wav": ["pcm_s16le"],
+}
+ENCODERS = {
+    ".mp3": ["-c:a", "libmp3lame"],
+    ".m4a": ["-c:a", "aac", "-b:a", "192k"],
+    ".wav": ["-c:a", "pcm_s16le"],
+}
+# Used for --format auto when the source codec has no passthrough container.
+_AUTO_FALLBACK_EXT = ".mp3"
+# Directory scans skip mp3s, they are almost always outputs of an earlier run.
+INPUT_EXTENSIONS = VIDEO_EXTENSIONS + [e for e in AUDIO_EXTENSIONS if e != ".mp3"]
+
+
+def get_audio_codec(info: Any) -> Optional[str]:
+    if isinstance(info, Exception):
+        return None
+    audio = get_stream(info, "audio")
+    return audio.get("codec_name") if audio else None
+
+
+def auto_ext(codec: Optional[str]) -> str:
+    """The output extension that lets the source audio be stream copied."""
+    for ext, codecs in PASSTHROUGH_CODECS.items():
+        if codec in codecs:
+            return ext
+    return _AUTO_FALLBACK_EXT
+
+
+def get_out_path(
+    filename: str, fmt: str, codec: Optional[str], outdir: Optional[str]
+) -> str:
+    ext = auto_ext(codec) if fmt == "auto" else f".{fmt}"
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(outdir or os.path.dirname(filename), stem + ext)
+
+
+def is_same_file(a: str, b: str) -> bool:
+    return os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b))
+
+
+def can_copy(out_path: str, codec: Optional[str]) -> bool:
+    ext = os.path.splitext(out_path)[1].lower()
+    return codec in PASSTHROUGH_CODECS.get(ext, [])
+
+
+def build_cmd(
+    filename: str,
+    out_path: str,
+    codec: Optional[str],
+    start: str | None,
+    end: str | None,
+) -> list[str]:
+    """Stream copies the audio when the output container takes the codec as is."""
+    ext = os.path.splitext(out_path)[1].lower()
+    cmd = ["static_ffmpeg", "-y"]
+    if start:
+        cmd += ["-ss", start]
+    if end:
+        cmd += ["-to", end]
+    cmd += ["-i", filename, "-vn", "-sn", "-dn", "-map", "0:a:0"]
+    if can_copy(out_path, codec):
+        cmd += ["-c:a", "copy"]
+    else:
+        cmd += ENCODERS[ext]
+    if ext == ".m4a":
+        cmd += ["-movflags", "+faststart"]
+    return cmd + [out_path]
 
 
 def run(
@@ -12,55 +97,142 @@ def run(
     normalize: bool,
     start: str | None,
     end: str | None,
+    codec: Optional[str] = None,
+    quiet: bool = False,
 ) -> int:
     if not os.path.exists(filename):
         print(f"{filename} does not exist")
         sys.exit(1)
     if output:
         out_path = output
-        assert out_path.endswith(".mp3") or out_path.endswith(".wav")
+        assert os.path.splitext(out_path)[1].lower() in ENCODERS, out_path
     else:
-        out_path = str(Path(filename).with_suffix(".mp3"))
-    cmd = f'static_ffmpeg -y -hide_banner -i "{filename}"'
-    if start:
-        cmd += f" -ss {start}"
-    if end:
-        cmd += f" -to {end}"
-    if out_path.endswith(".wav"):
-        cmd += f' -vn -acodec pcm_s16le -y ".{out_path}"'
-    else:
-        cmd += f' -vn -c:a libmp3lame -y ".{out_path}"'
-    print(f"Executing:\n  {cmd}")
-    os.system(cmd)
-    assert os.path.exists(f".{out_path}")
+        out_path = get_out_path(filename, "mp3", codec, None)
+    if is_same_file(out_path, filename):
+        print(f"{filename} is already the output, pass --output or --outdir")
+        return 1
+    out_dir, out_name = os.path.split(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_out_path = os.path.join(out_dir, f".{out_name}")
+    cmd = build_cmd(filename, tmp_out_path, codec, start, end)
+    result = run_ffmpeg(cmd, quiet=quiet)
+    if not result.ok or not os.path.exists(tmp_out_path):
+        print(f"Failed to extract the audio of {filename}")
+        if quiet:
+            print(result.stderr)
+        return 1
     if not normalize:
-        os.rename(f".{out_path}", f"{out_path}")
-    else:
-        cmd = f'audnorm ".{out_path}" "{out_path}"'
-        print(f"Executing:\n  {cmd}")
-        rtn = os.system(cmd)
-        if rtn != 0:
-            print(f"Failed to normalize {out_path}")
-            return 1
-        os.remove(f".{out_path}")
-    os.system(cmd)
+        os.replace(tmp_out_path, out_path)
+        return 0
+    try:
+        audnorm(tmp_out_path, out_path, quiet=quiet)
+    except Exception as ex:  # noqa: BLE001
+        print(f"Failed to normalize {out_path}: {ex}")
+        return 1
+    finally:
+        os.remove(tmp_out_path)
     return 0
 
 
+def run_batch(
+    filenames: list[str],
+    fmt: str,
+    outdir: Optional[str],
+    normalize: bool,
+    start: str | None,
+    end: str | None,
+    jobs: Optional[int],
+) -> int:
+    """Extracts the audio of many files at once, returns the number that failed."""
+    codecs = {f: get_audio_codec(info) for f, info in probe_many(filenames).items()}
+    # Stream copies are disk bound and encodes are single threaded, one per core
+    # keeps either kind busy.
+    jobs = max(1, min(jobs or (os.cpu_count() or 1), len(filenames)))
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    # An input that is its own output would be overwritten in place.
+    skipped = [
+        f for f in filenames if is_same_file(get_out_path(f, fmt, codecs[f], outdir), f)
+    ]
+    for filename in skipped:
+        print(f"  {filename}: skipped, it is already the output")
+    filenames = [f for f in filenames if f not in skipped]
+    print(f"Extracting audio from {len(filenames)} files, {jobs} at a time")
+
+    def extract(filename: str) -> bool:
+        codec = codecs[filename]
+        if codec is None:
+            print(f"  {filename}: no audio stream")
+            return False
+        out_path = get_out_path(filename, fmt, codec, outdir)
+        mode = "copied" if can_copy(out_path, codec) else "encoded"
+        rtn = run(filename, out_path, normalize, start, end, codec, quiet=True)
+        if rtn == 0:
+            print(f"  {filename} -> {out_path}: {mode}")
+        return rtn == 0
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(extract, filenames))
+    failed = results.count(False)
+    print(f"Extracted {len(results) - failed}, failed {failed}")
+    return failed
+
+
 def main() -> int:
     parser = argparse.ArgumentParser()
-    parser.add_argument("filename", help="The video file to convert to audio")
+    parser.add_argument(
+        "filename",
+        help="The video files, directories or globs to convert to audio",
+        nargs="+",
+    )
     parser.add_argument("-o", "--output", help="The output file name")
+    parser.add_argument(
+        "--format",
+        choices=["mp3", "m4a", "wav", "auto"],
+        default="mp3",
+        help="output format, auto picks the one that stream copies the source audio",
+    )
+    parser.add_argument("--outdir", help="batch output directory")
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of files processed at once"
+    )
+    parser.add_argument(
+        "--recursive", action="store_true", help="search directories recursively"
+    )
     parser.add_argument("-n", "--normalize", action="store_true")
     parser.add_argument("--start", help="Start time for cutting (format: HH:MM:SS)")
     parser.add_argument("--end", help="End time for cutting (format: HH:MM:SS)")
     args = parser.parse_args()
-    filename = sys.argv[1:2][0]
-    output_format = "wav" if args.output and args.output.endswith(".wav") else "mp3"
-    print(f"Converting {filename} to {output_format}")
-    rtn = run(filename, args.output, args.normalize, args.start, args.end)
+    filenames = expand_media_paths(
+        args.filename, INPUT_EXTENSIONS, recursive=args.recursive
+    )
+    if not filenames:
+        print(f"No media files found in {' '.join(args.filename)}")
+        return 1
+    if len(filenames) > 1 or args.outdir:
+        if args.output:
+            parser.error("--output only works with a single input, use --outdir")
+        failed = run_batch(
+            filenames,
+            args.format,
+            args.outdir,
+            args.normalize,
+            args.start,
+            args.end,
+            args.jobs,
+        )
+        return 1 if failed else 0
+    filename = filenames[0]
+    codec = get_audio_codec(probe_many([filename])[filename])
+    output = args.output or get_out_path(filename, args.format, codec, None)
+    print(f"Converting {filename} to {os.path.splitext(output)[1][1:]}")
+    start_time = time.time()
+    rtn = run(filename, output, args.normalize, args.start, args.end, codec)
+    if rtn == 0:
+        print(f"Generated {output} in {format_seconds(time.time() - start_time)}")
     return rtn
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
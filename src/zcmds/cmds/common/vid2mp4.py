@@ -5,6 +5,9 @@ import os
 import sys
 from pathlib import Path
 
+from zcmds.util.chunked_encode import encode_chunked
+from zcmds.util.ffmpeg_runner import run_ffmpeg
+
 
 VERSION = "0.2.0"
 
@@ -50,6 +53,12 @@ def main():
         default=23,
     )
     parser.add_argument("--height", help="Output video height.", type=int, default=None)
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        default=0,
+        help="with --rencode, split at keyframes and encode N chunks in parallel",
+    )
     parser.add_argument("--version", help="Print version and exit", action="store_true")
     args = parser.parse_args()
     if args.version:
@@ -92,17 +101,31 @@ def main():
     else:
         preset = "veryslow"  # Default x264 preset
 
-    scale_cmd = f'-vf scale="trunc(oh*a/2)*2:{args.height}"' if args.height else ""
-
+    cmd = ["static_ffmpeg", "-y", "-i", filename]
     if args.rencode:
-        quality_stmt = f"-crf {args.crf}" if args.crf else "-b:v 0 -crf 23"
+        video_args: list[str] = []
+        if args.height:
+            video_args += ["-vf", f"scale=trunc(oh*a/2)*2:{args.height}"]
+        quality_args = (
+            ["-crf", str(args.crf)] if args.crf else ["-b:v", "0", "-crf", "23"]
+        )
         if codec == "h264_nvenc":
-            quality_stmt = f"-cq {args.crf}" if args.crf else "-cq 23"
-        cmd = f'static_ffmpeg -hide_banner -i "{filename}" {scale_cmd} -vcodec {codec} -preset {preset} {quality_stmt} -c:a copy -y "{out_path}"'
+            quality_args = ["-cq", str(args.crf)] if args.crf else ["-cq", "23"]
+        video_args += ["-vcodec", codec, "-preset", preset] + quality_args
+        if args.chunks > 1:
+            if not encode_chunked(
+                filename, str(out_path), video_args, ["-c:a", "copy"], args.chunks
+            ):
+                sys.exit(1)
+            print(f"Generated {out_path}")
+            return
+        cmd += video_args + ["-c:a", "copy"]
     else:
-        cmd = f'ffmpeg -i "{filename}" -c copy "{out_path}"'
-    print(f"Running:\n  {cmd}")
-    os.system(cmd)
+        cmd += ["-c", "copy"]
+    cmd.append(str(out_path))
+    result = run_ffmpeg(cmd)
+    if not result.ok:
+        sys.exit(1)
     print(f"Generated {out_path}")
 
 
@@ -4,14 +4,21 @@ Concatenates two videos together
 
 import argparse
 import os
-import subprocess
+import sys
 import tempfile
-from dataclasses import dataclass
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from zcmds.util.encode_queue import default_job_threads
+from zcmds.util.ffmpeg_runner import run_ffmpeg
+from zcmds.util.media import ffprobe, get_stream, probe_many
 
 
 _SAMPLE_RATE = 44100
 _CRF_DEFAULT = 18
+# Pieces are normalized to mpegts, which concatenates cleanly with -c copy.
+_PIECE_EXT = ".ts"
 
 
 @dataclass
@@ -20,6 +27,28 @@ class Resolution:
     height: int
 
 
+@dataclass(frozen=True)
+class StreamFormat:
+    """Everything that has to match for inputs to be joined with -c copy."""
+
+    video_codec: str
+    width: int
+    height: int
+    pix_fmt: str
+    frame_rate: str
+    # A copied stream keeps the first input's parameter sets, these must match.
+    profile: Optional[str] = None
+    level: Optional[int] = None
+    audio_codec: Optional[str] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    duration: Optional[float] = field(default=None, compare=False)
+
+    @property
+    def resolution(self) -> Resolution:
+        return Resolution(self.width, self.height)
+
+
 def sanitize(s: str) -> str:
     return s.replace(":", "_")
 
@@ -28,63 +57,242 @@ def stripext(s: str) -> str:
     return os.path.splitext(s)[0]
 
 
-def exec(cmd: str) -> Tuple[int, str, str]:
-    proc = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True,
+def get_stream_format(info: dict[str, Any]) -> StreamFormat:
+    video = get_stream(info, "video")
+    if video is None:
+        raise ValueError("no video stream")
+    audio = get_stream(info, "audio")
+    duration = info.get("format", {}).get("duration")
+    return StreamFormat(
+        video_codec=video.get("codec_name", ""),
+        width=int(video["width"]),
+        height=int(video["height"]),
+        pix_fmt=video.get("pix_fmt", ""),
+        frame_rate=video.get("r_frame_rate", ""),
+        profile=video.get("profile"),
+        level=video.get("level"),
+        audio_codec=audio.get("codec_name") if audio else None,
+        sample_rate=int(audio["sample_rate"]) if audio else None,
+        channels=int(audio["channels"]) if audio else None,
+        duration=float(duration) if duration else None,
     )
-    stdout, stderr = proc.communicate()
-    return proc.returncode, stdout, stderr
 
 
-def get_resolution(infile: str) -> Resolution:
-    cmd = f'static_ffprobe -v error -select_streams v:0 -show_entries stream=width,height -of csv=p=0 "{infile}"'
-    rtn, stdout, _ = exec(cmd)
-    if rtn != 0:
-        print(f"{__file__}: WARNING: '{cmd}' returned code {rtn}")
-    try:
-        width, height = stdout.split(",")
-    except ValueError:
-        print(f"{__file__}: ERROR: could not parse resolution from '{stdout}'")
-        import sys
+def probe_formats(infiles: list[str]) -> dict[str, StreamFormat]:
+    """Probes all inputs concurrently, exits with an error if any can't be read."""
+    formats: dict[str, StreamFormat] = {}
+    for infile, info in probe_many(infiles).items():
+        try:
+            if isinstance(info, Exception):
+                raise info
+            formats[infile] = get_stream_format(info)
+        except (ValueError, KeyError, OSError) as ex:
+            print(
+                f"{__file__}: ERROR: could not read the video format of {infile}: {ex}"
+            )
+            sys.exit(1)
+    return formats
 
-        sys.exit(1)
-    return Resolution(int(width), int(height))
+
+def get_resolution(infile: str) -> Resolution:
+    return get_stream_format(ffprobe(infile)).resolution
 
 
 def get_highest_resolution(infiles: list[str]) -> Resolution:
-    resolutions = [get_resolution(infile) for infile in infiles]
+    resolutions = [f.resolution for f in probe_formats(infiles).values()]
     return max(resolutions, key=lambda resolution: resolution.width)
 
 
+def get_target_format(
+    formats: list[StreamFormat], resolution: Resolution
+) -> StreamFormat:
+    """
+    The format every input is normalized to: h264/aac at the given resolution,
+    keeping the frame rate and audio layout of the first input at that size.
+    """
+    reference = next((f for f in formats if f.resolution == resolution), formats[0])
+    has_audio = any(f.audio_codec for f in formats)
+    reference_audio = reference.audio_codec == "aac"
+    return StreamFormat(
+        video_codec="h264",
+        width=resolution.width,
+        height=resolution.height,
+        pix_fmt="yuv420p",
+        frame_rate=reference.frame_rate,
+        audio_codec="aac" if has_audio else None,
+        sample_rate=(reference.sample_rate if reference_audio else _SAMPLE_RATE)
+        if has_audio
+        else None,
+        channels=(reference.channels if reference_audio else 2) if has_audio else None,
+    )
+
+
+def fit_filter(resolution: Resolution) -> str:
+    """Scales into the resolution keeping the aspect ratio, padding the rest."""
+    w, h = resolution.width, resolution.height
+    return (
+        f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
+        f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+    )
+
+
+def build_normalize_cmd(
+    infile: str,
+    source: StreamFormat,
+    target: StreamFormat,
+    crf: int,
+    out_path: str,
+    threads: Optional[int] = None,
+) -> list[str]:
+    cmd = ["static_ffmpeg", "-y", "-i", infile]
+    audio_input = "0:a:0"
+    if target.audio_codec and not source.audio_codec:
+        # Inputs without audio get silence so every piece has the same streams.
+        layout = "mono" if target.channels == 1 else "stereo"
+        cmd += ["-f", "lavfi", "-i", f"anullsrc=r={target.sample_rate}:cl={layout}"]
+        audio_input = "1:a:0"
+    cmd += ["-map", "0:v:0"]
+    vf = f"{fit_filter(target.resolution)},fps={target.frame_rate},format={target.pix_fmt}"
+    cmd += ["-vf", vf, "-c:v", "libx264", "-crf", str(crf)]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    if target.audio_codec:
+        cmd += ["-map", audio_input, "-c:a", "aac", "-b:a", "128k"]
+        cmd += ["-ac", str(target.channels), "-ar", str(target.sample_rate)]
+        if audio_input == "1:a:0":
+            cmd += ["-shortest"]
+    cmd.append(out_path)
+    return cmd
+
+
+def _write_concat_list(path: str, files: list[str]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for file in files:
+            escaped = os.path.abspath(file).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def _concat_copy(files: list[str], outname: str, tmpdir: str) -> bool:
+    concat_list = os.path.join(tmpdir, "input.txt")
+    _write_concat_list(concat_list, files)
+    cmd = ["static_ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list]
+    cmd += ["-c", "copy", "-movflags", "+faststart", os.path.abspath(outname)]
+    return run_ffmpeg(cmd).ok
+
+
+def build_concat_graph(formats: list[StreamFormat], target: StreamFormat) -> str:
+    """
+    One filter graph that normalizes every input to the target format and joins
+    them with the concat filter, producing the [v] and [a] output pads.
+    """
+    layout = "mono" if target.channels == 1 else "stereo"
+    chains: list[str] = []
+    pads = ""
+    for i, fmt in enumerate(formats):
+        chains.append(
+            f"[{i}:v:0]{fit_filter(target.resolution)},fps={target.frame_rate},"
+            f"format={target.pix_fmt}[v{i}]"
+        )
+        pads += f"[v{i}]"
+        if not target.audio_codec:
+            continue
+        if fmt.duration is None:
+            raise ValueError(f"input {i} has no known duration")
+        # Audio is padded or trimmed to the input's length so it stays in sync.
+        if fmt.audio_codec:
+            audio = f"[{i}:a:0]aresample={target.sample_rate},apad"
+        else:
+            audio = f"anullsrc=r={target.sample_rate}:cl={layout}"
+        chains.append(
+            f"{audio},aformat=channel_layouts={layout},atrim=end={fmt.duration}[a{i}]"
+        )
+        pads += f"[a{i}]"
+    audio_count = 1 if target.audio_codec else 0
+    chains.append(
+        f"{pads}concat=n={len(formats)}:v=1:a={audio_count}[v]"
+        + ("[a]" if audio_count else "")
+    )
+    return ";".join(chains)
+
+
+def concatenate_single_pass(
+    infiles: list[str],
+    outname: str,
+    resolution: Resolution,
+    crf: int,
+    formats: Optional[dict[str, StreamFormat]] = None,
+) -> bool:
+    """Normalizes and joins all inputs in one encode without intermediate files."""
+    if formats is None:
+        formats = probe_formats(infiles)
+    ordered = [formats[f] for f in infiles]
+    target = get_target_format(ordered, resolution)
+    try:
+        graph = build_concat_graph(ordered, target)
+    except ValueError as ex:
+        print(f"{__file__}: ERROR: {ex}")
+        return False
+    cmd = ["static_ffmpeg", "-y"]
+    for infile in infiles:
+        cmd += ["-i", infile]
+    cmd += ["-filter_complex", graph, "-map", "[v]", "-c:v", "libx264"]
+    cmd += ["-crf", str(crf)]
+    if target.audio_codec:
+        cmd += ["-map", "[a]", "-c:a", "aac", "-b:a", "128k"]
+    cmd += ["-movflags", "+faststart", outname]
+    durations = [f.duration for f in ordered]
+    duration = None if None in durations else sum(d or 0 for d in durations)
+    return run_ffmpeg(cmd, duration=duration).ok
+
+
 def concatenate_videos(
-    infiles: list[str], outname: str, resolution: Resolution, crf: int
-) -> None:
-    # Scale and re-encode the input videos
+    infiles: list[str],
+    outname: str,
+    resolution: Resolution,
+    crf: int,
+    formats: Optional[dict[str, StreamFormat]] = None,
+    jobs: Optional[int] = None,
+) -> bool:
     infiles = [os.path.abspath(infile) for infile in infiles]
-    with tempfile.TemporaryDirectory() as tmpdir:
-        scaled_videos: list[str] = []
-        for i, infile in enumerate(infiles):
-            scaled_video = os.path.join(tmpdir, f"_scaled_video_{i}.mp4")
-            cmd = f'static_ffmpeg -i "{infile}" -vf "scale={resolution.width}:{resolution.height}" -c:v libx264 -crf {crf} -c:a aac -b:a 128k -ac 2 -ar {_SAMPLE_RATE} "{scaled_video}"'
-            rtn, _, _ = exec(cmd)
-            if rtn != 0:
-                print(f"{__file__}: WARNING: '{cmd}' returned code {rtn}")
-            scaled_videos.append(scaled_video)
-
-        # Create the input file list for concatenation
-        with open("input.txt", "w") as f:
-            for scaled_video in scaled_videos:  # type: ignore
-                f.write(f"file '{scaled_video}'\n")
-        # Concatenate the videos
-        cmd = f'static_ffmpeg -f concat -safe 0 -i input.txt -c copy "{os.path.abspath(outname)}"'
-
-        rtn, _, _ = exec(cmd)
-        if rtn != 0:
-            print(f"{__file__}: WARNING: '{cmd}' returned code {rtn}")
+    if formats is None:
+        formats = probe_formats(infiles)
+    else:
+        formats = {os.path.abspath(k): v for k, v in formats.items()}
+    out_dir = os.path.dirname(os.path.abspath(outname))
+    with tempfile.TemporaryDirectory(prefix=".vidcat_", dir=out_dir) as tmpdir:
+        unique = set(formats[f] for f in infiles)
+        if len(unique) == 1 and next(iter(unique)).resolution == resolution:
+            print("All inputs share one format, joining them with a stream copy")
+            return _concat_copy(infiles, outname, tmpdir)
+
+        target = get_target_format([formats[f] for f in infiles], resolution)
+        pieces = [
+            os.path.join(tmpdir, f"_piece_{i}{_PIECE_EXT}") for i in range(len(infiles))
+        ]
+        # Every piece is encoded, even those already in the target format: a
+        # stream copied piece carries its own profile, level and parameter
+        # sets, which change mid-stream when joined with -c copy.
+        print(f"Normalizing {len(infiles)} inputs to {target.width}x{target.height}")
+        threads = default_job_threads()
+        jobs = jobs or max(1, (os.cpu_count() or 1) // threads)
+        jobs = max(1, min(jobs, len(infiles)))
+
+        def prepare(i: int) -> bool:
+            infile = infiles[i]
+            cmd = build_normalize_cmd(
+                infile, formats[infile], target, crf, pieces[i], threads
+            )
+            result = run_ffmpeg(cmd, quiet=True)
+            if result.ok:
+                print(f"  {os.path.basename(infile)}: normalized")
+            else:
+                print(f"  {os.path.basename(infile)}: FAILED\n{result.stderr}")
+            return result.ok
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            if not all(executor.map(prepare, range(len(infiles)))):
+                return False
+        return _concat_copy(pieces, outname, tmpdir)
 
 
 def main() -> int:
@@ -98,14 +306,38 @@ def main() -> int:
         "--crf", default=_CRF_DEFAULT, type=int, help="CRF quality of the file."
     )
     parser.add_argument("--height", help="height of the output video, e.g 1080 = 1080p")
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of inputs normalized at once"
+    )
+    parser.add_argument(
+        "--single-pass",
+        action="store_true",
+        help="re-encode everything in one filter graph, no intermediate files",
+    )
     args = parser.parse_args()
     infiles = args.input
-    resolution: Resolution = get_highest_resolution(infiles)
+    formats = probe_formats(infiles)
+    resolution = max((f.resolution for f in formats.values()), key=lambda r: r.width)
     print(f"Highest resolution: {resolution.width}x{resolution.height}")
-    concatenate_videos(infiles, args.outname, resolution, args.crf)
+    if args.height:
+        height = int(args.height)
+        width = round(resolution.width * height / resolution.height / 2) * 2
+        resolution = Resolution(width, height)
+        print(f"Output resolution: {resolution.width}x{resolution.height}")
+    if args.single_pass:
+        ok = concatenate_single_pass(
+            infiles, args.outname, resolution, args.crf, formats
+        )
+    else:
+        ok = concatenate_videos(
+            infiles, args.outname, resolution, args.crf, formats, args.jobs
+        )
+    if not ok:
+        print(f"Failed to concatenate videos into {args.outname}")
+        return 1
     print(f"Concatenated videos saved as {args.outname}")
     return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
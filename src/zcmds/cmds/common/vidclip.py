@@ -1,12 +1,28 @@
 # pylint: skip-file
 
 import argparse
+import csv
 import os
-import subprocess
+import re
 import sys
+import tempfile
+import time
 from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Callable
 
+from zcmds.util.encode_queue import default_job_threads, submit_and_start
+from zcmds.util.ffmpeg_runner import format_cmd, format_seconds, run_ffmpeg
+from zcmds.util.media import (
+    ffprobe,
+    get_duration,
+    get_stream,
+    keyframe_times,
+    packet_times,
+    parse_frame_rate,
+    timestamp_to_seconds,
+)
+
 
 def sanitize(s: str) -> str:
     return s.replace(":", "_")
@@ -17,18 +33,95 @@ def stripext(s: str) -> str:
 
 
 _CRF_DEFAULT = 18
+_PRESET = "veryslow"
+# Encoders used for the re-encoded edges of a smart cut, by source codec.
+_SMART_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+# mpegts keeps the parameter sets in-band, so the re-encoded and the copied
+# pieces of a smart cut each carry their own SPS/PPS through the concat.
+_SMART_PIECE_EXT = ".ts"
+# Keyframe and cut times closer than this are treated as equal.
+_EPSILON = 0.001
+# CMX3600 event: "001  AX  V  C  00:00:01:00 00:00:05:00 00:00:00:00 00:00:04:00",
+# dissolves and wipes carry a duration after the transition: "002 AX V D 015 ...".
+_EDL_EVENT_RE = re.compile(
+    r"^\s*(\d+)\s+\S+\s+(\S+)\s+(?:C|D|W\d+|K\s*[BO]?)(?:\s+\d+)?\s+"
+    r"(\d+:\d+:\d+[:;]\d+)\s+(\d+:\d+:\d+[:;]\d+)"
+)
 
 
-def exec(cmd: str) -> tuple[int, str, str]:
-    proc = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True,
-    )
-    stdout, stderr = proc.communicate()
-    return proc.returncode, stdout, stderr
+@dataclass
+class Cut:
+    start: str
+    end: str
+    outname: str | None = None
+
+
+def edl_timecode_to_seconds(timecode: str, fps: float) -> float:
+    """
+    Converts an EDL "HH:MM:SS:FF" timecode to seconds. Timecode counts frames
+    at the nominal rate (30 for 29.97), so the frame number is divided by the
+    real rate. A ";" marks drop frame timecode, which skips 2 frame numbers
+    (4 at 59.94) every minute except every tenth.
+    """
+    hours, minutes, seconds, frames = (int(p) for p in re.split("[:;]", timecode))
+    nominal = round(fps)
+    frame = ((hours * 60 + minutes) * 60 + seconds) * nominal + frames
+    if ";" in timecode:
+        dropped = round(nominal / 15)
+        total_minutes = hours * 60 + minutes
+        frame -= dropped * (total_minutes - total_minutes // 10)
+    return frame / fps
+
+
+def parse_cut_list(
+    path: str, fps: float | None = None, source: str | None = None
+) -> list[Cut]:
+    """
+    Parses a cut list. Files ending in .edl are read as CMX3600 EDLs using the
+    source in/out timecodes of the video events, each named
+    <source>_<event#>.<ext>. Anything else is read as CSV with
+    start,end[,outname] rows; a header row, blank lines and lines starting with
+    # are skipped.
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        text = f.read()
+    cuts: list[Cut] = []
+    if path.lower().endswith(".edl"):
+        if not fps:
+            raise ValueError("Reading an EDL needs the frame rate of the source")
+        seen: set[str] = set()
+        for line in text.splitlines():
+            match = _EDL_EVENT_RE.match(line)
+            # Audio events repeat the video cut, only video tracks are cuts.
+            if not match or not match.group(2).upper().startswith("V"):
+                continue
+            event = match.group(1)
+            start = edl_timecode_to_seconds(match.group(3), fps)
+            end = edl_timecode_to_seconds(match.group(4), fps)
+            # A dissolve lists the outgoing clip with zero length, then the
+            # incoming one under the same event number.
+            if end <= start or event in seen:
+                continue
+            seen.add(event)
+            outname = None
+            if source:
+                base, ext = os.path.splitext(source)
+                outname = f"{base}_{event}{ext}"
+            cuts.append(Cut(f"{start:.6f}", f"{end:.6f}", outname))
+        return cuts
+    for row in csv.reader(text.splitlines()):
+        row = [c.strip() for c in row]
+        if not row or not row[0] or row[0].startswith("#"):
+            continue
+        if len(row) < 2:
+            raise ValueError(f"Expected start,end[,outname] but got: {row}")
+        try:
+            timestamp_to_seconds(row[0])
+        except ValueError:
+            continue  # Header row.
+        outname = row[2] if len(row) > 2 and row[2] else None
+        cuts.append(Cut(row[0], row[1], outname))
+    return cuts
 
 
 # Tests if a path exists, and if it does then it names it with the next number
@@ -40,6 +133,68 @@ def get_next_path(path: str) -> str:
         return get_next_path(f"{base}_alt{ext}")
 
 
+def _seek_args(start_timestamp: str | None, end_timestamp: str | None) -> list[str]:
+    """
+    Input seeking: placed before -i so ffmpeg jumps to the nearest keyframe
+    instead of decoding everything from the start of the file.
+    """
+    args: list[str] = []
+    if start_timestamp:
+        args += ["-ss", start_timestamp]
+    if end_timestamp:
+        args += ["-to", end_timestamp]
+    return args
+
+
+def build_encode_cmd(
+    infile: str,
+    height: int | None,
+    crf: int,
+    start_timestamp: str | None,
+    end_timestamp: str | None,
+    output_path: str,
+    threads: int | None = None,
+) -> list[str]:
+    cmd = ["static_ffmpeg", "-y"] + _seek_args(start_timestamp, end_timestamp)
+    cmd += ["-i", infile, "-c:v", "libx264"]
+    if height:
+        cmd += ["-vf", f"scale=trunc(oh*a/2)*2:{height}"]
+    cmd += ["-preset", _PRESET, "-crf", str(crf)]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    cmd.append(output_path)
+    return cmd
+
+
+def build_copy_cmd(
+    infile: str,
+    start_timestamp: str | None,
+    end_timestamp: str | None,
+    output_path: str,
+) -> list[str]:
+    cmd = ["static_ffmpeg", "-y"] + _seek_args(start_timestamp, end_timestamp)
+    cmd += ["-i", infile, "-c", "copy", "-avoid_negative_ts", "make_zero"]
+    cmd.append(output_path)
+    return cmd
+
+
+def snap_to_keyframe(infile: str, timestamp: str) -> str:
+    """Returns the time of the last keyframe at or before timestamp."""
+    seconds = timestamp_to_seconds(timestamp)
+    keyframes = [k for k in keyframe_times(infile, seconds, seconds) if k <= seconds]
+    if not keyframes:
+        return timestamp
+    return f"{keyframes[-1]:.6f}"
+
+
+def _report(output_path: str, ok: bool, print_fcn: Callable[[str], None]) -> bool:
+    if not ok or not os.path.exists(output_path):
+        print_fcn(f"Error, did not generate {output_path}")
+        return False
+    print_fcn(f"\nGenerated: {output_path}")
+    return True
+
+
 def encode(
     infile: str,
     height: int | None,
@@ -48,27 +203,229 @@ def encode(
     end_timestamp: str | None,
     output_path: str,
     print_fcn: Callable[[str], None],
+    quiet: bool = False,
+    threads: int | None = None,
 ) -> bool:
-    vf_scale_part = ""
-    to_stmt = ""
-    from_stmt = ""
-    if height:
-        vf_scale_part = f"-vf trunc(oh*a/2)*2:{height}"
+    cmd = build_encode_cmd(
+        infile, height, crf, start_timestamp, end_timestamp, output_path, threads
+    )
+    result = run_ffmpeg(cmd, quiet=quiet)
+    if not result.ok:
+        print_fcn(
+            f"{__file__}: WARNING: '{format_cmd(cmd)}' returned code {result.returncode}"
+        )
+    return _report(output_path, result.ok, print_fcn)
+
+
+def copy_clip(
+    infile: str,
+    start_timestamp: str | None,
+    end_timestamp: str | None,
+    output_path: str,
+    print_fcn: Callable[[str], None],
+    quiet: bool = False,
+) -> bool:
+    """Stream copies the clip. The start snaps back to the previous keyframe."""
     if start_timestamp:
-        from_stmt = f"-ss {start_timestamp}"
-    if end_timestamp:
-        to_stmt = f"-to {end_timestamp}"
-    cmd = f'static_ffmpeg -hide_banner -i -y "{infile}" -c:v libx264 {vf_scale_part} -preset veryslow -crf {crf} {from_stmt} {to_stmt} "{output_path}"'
-    print_fcn(f"Executing:\n  {cmd}\n")
-    rtn, _, _ = exec(cmd)
-    if rtn != 0:
-        print_fcn(f"{__file__}: WARNING: '{cmd}' returned code {rtn}")
-    if not os.path.exists(output_path):
-        print_fcn(f"Error, did not generate {output_path}")
+        snapped = snap_to_keyframe(infile, start_timestamp)
+        if snapped != start_timestamp:
+            print_fcn(f"Snapped start {start_timestamp} to keyframe at {snapped}s")
+        start_timestamp = snapped
+    cmd = build_copy_cmd(infile, start_timestamp, end_timestamp, output_path)
+    return _report(output_path, run_ffmpeg(cmd, quiet=quiet).ok, print_fcn)
+
+
+def smart_clip(
+    infile: str,
+    crf: int,
+    start_timestamp: str | None,
+    end_timestamp: str | None,
+    output_path: str,
+    print_fcn: Callable[[str], None],
+    quiet: bool = False,
+) -> bool:
+    """
+    Frame accurate cut that only re-encodes the partial GOPs at each edge. The
+    whole GOPs in between are stream copied and the pieces are joined with the
+    concat demuxer. Audio is stream copied from the source in the final mux.
+    """
+    info = ffprobe(infile)
+    video = get_stream(info, "video")
+    encoder = _SMART_ENCODERS.get(video.get("codec_name", "") if video else "")
+    duration = get_duration(info)
+    if video is None or encoder is None or duration is None:
+        print_fcn("Smart cut needs an h264 or hevc source, re-encoding the clip")
+        return encode(
+            infile,
+            None,
+            crf,
+            start_timestamp,
+            end_timestamp,
+            output_path,
+            print_fcn,
+            quiet=quiet,
+        )
+    start = timestamp_to_seconds(start_timestamp) if start_timestamp else 0.0
+    end = timestamp_to_seconds(end_timestamp) if end_timestamp else duration
+    inner = [
+        k
+        for k in keyframe_times(infile, start, end)
+        if start - _EPSILON <= k <= end + _EPSILON
+    ]
+    if len(inner) < 2:
+        print_fcn("No whole GOP inside the clip, re-encoding the clip")
+        return encode(
+            infile,
+            None,
+            crf,
+            start_timestamp,
+            end_timestamp,
+            output_path,
+            print_fcn,
+            quiet=quiet,
+        )
+    first_key, last_key = inner[0], inner[-1]
+    out_dir = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryDirectory(prefix=".smartcut_", dir=out_dir) as tmpdir:
+        pieces: list[tuple[str, list[str]]] = []
+        edge_args = ["-map", "0:v:0", "-an", "-c:v", encoder, "-preset", _PRESET]
+        edge_args += ["-crf", str(crf)]
+        if video.get("pix_fmt"):
+            edge_args += ["-pix_fmt", video["pix_fmt"]]
+        if first_key - start > _EPSILON:
+            head = os.path.join(tmpdir, "0_head" + _SMART_PIECE_EXT)
+            seek = _seek_args(f"{start:.6f}", f"{first_key:.6f}")
+            pieces.append((head, seek + ["-i", infile] + edge_args))
+        middle = os.path.join(tmpdir, "1_middle" + _SMART_PIECE_EXT)
+        # A stream copy with -to stops on decode order and lets reordered frames
+        # of the next GOP through, so the copy is capped by frame count instead.
+        frames = len(
+            [
+                t
+                for t in packet_times(infile, first_key, last_key)
+                if first_key - _EPSILON <= t < last_key - _EPSILON
+            ]
+        )
+        copy_args = ["-ss", f"{first_key:.6f}", "-i", infile, "-map", "0:v:0"]
+        copy_args += ["-frames:v", str(frames), "-c", "copy"]
+        pieces.append((middle, copy_args))
+        if end - last_key > _EPSILON:
+            tail = os.path.join(tmpdir, "2_tail" + _SMART_PIECE_EXT)
+            seek = _seek_args(f"{last_key:.6f}", f"{end:.6f}")
+            pieces.append((tail, seek + ["-i", infile] + edge_args))
+        print_fcn(
+            f"Smart cut: re-encoding {first_key - start:.2f}s + {end - last_key:.2f}s,"
+            f" copying {last_key - first_key:.2f}s"
+        )
+
+        def run_piece(piece: tuple[str, list[str]]) -> bool:
+            path, args = piece
+            return run_ffmpeg(["static_ffmpeg", "-y"] + args + [path], quiet=True).ok
+
+        with ThreadPoolExecutor(max_workers=len(pieces)) as executor:
+            if not all(executor.map(run_piece, pieces)):
+                return _report(output_path, False, print_fcn)
+        concat_list = os.path.join(tmpdir, "concat.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for path, _ in pieces:
+                f.write(f"file '{os.path.basename(path)}'\n")
+        cmd = ["static_ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list]
+        cmd += _seek_args(f"{start:.6f}", f"{end:.6f}") + ["-i", infile]
+        cmd += ["-map", "0:v", "-map", "1:a?", "-c", "copy", output_path]
+        result = run_ffmpeg(cmd, duration=end - start, quiet=quiet)
+    return _report(output_path, result.ok, print_fcn)
+
+
+def run_cut_list(
+    infile: str, cuts: list[Cut], args: argparse.Namespace, jobs: int | None
+) -> bool:
+    """Runs all cuts in parallel and prints a timing report per clip."""
+    duration = get_duration(ffprobe(infile))
+    ext = os.path.splitext(infile)[1]
+    planned: list[tuple[Cut, str]] = []
+    taken: set[str] = set()
+    for cut in sorted(cuts, key=lambda c: timestamp_to_seconds(c.start)):
+        start = timestamp_to_seconds(cut.start)
+        end = timestamp_to_seconds(cut.end)
+        if end <= start or (duration is not None and start >= duration):
+            print(f"Skipping invalid cut {cut.start} - {cut.end}")
+            continue
+        output_path = cut.outname or (
+            stripext(infile) + f"_clip_{sanitize(cut.start)}__{sanitize(cut.end)}{ext}"
+        )
+        if not os.path.splitext(output_path)[1]:
+            output_path += ".mp4"
+        output_path = get_next_path(output_path)
+        while output_path in taken:
+            out_ext = os.path.splitext(output_path)[1]
+            output_path = get_next_path(stripext(output_path) + "_alt" + out_ext)
+        taken.add(output_path)
+        planned.append((cut, output_path))
+    if not planned:
+        print("No valid cuts")
         return False
-    else:
-        print_fcn(f"\nGenerated: {output_path}")
-        return True
+
+    # Copies are disk bound, encodes get a share of the cores.
+    threads = default_job_threads()
+    if jobs is None:
+        jobs = 4 if args.copy else max(1, (os.cpu_count() or 1) // threads)
+    jobs = max(1, min(jobs, len(planned)))
+    print(f"Cutting {len(planned)} clips from {infile}, {jobs} at a time")
+
+    def run_one(item: tuple[Cut, str]) -> tuple[bool, float]:
+        cut, output_path = item
+        start_time = time.time()
+
+        def print_fcn(s: str) -> None:
+            print(f"[{os.path.basename(output_path)}] {s.strip()}")
+
+        if args.copy:
+            ok = copy_clip(infile, cut.start, cut.end, output_path, print_fcn, True)
+        elif args.smart:
+            ok = smart_clip(
+                infile, args.crf, cut.start, cut.end, output_path, print_fcn, True
+            )
+        else:
+            ok = encode(
+                infile,
+                args.height,
+                args.crf,
+                cut.start,
+                cut.end,
+                output_path,
+                print_fcn,
+                quiet=True,
+                threads=threads if jobs > 1 else None,
+            )
+        return ok, time.time() - start_time
+
+    total_start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(run_one, planned))
+    rows = [["CLIP", "START", "END", "LENGTH", "TIME", "SPEED", "STATUS"]]
+    for (cut, output_path), (ok, wall_time) in zip(planned, results):
+        length = timestamp_to_seconds(cut.end) - timestamp_to_seconds(cut.start)
+        rows.append(
+            [
+                os.path.basename(output_path),
+                cut.start,
+                cut.end,
+                f"{length:.2f}s",
+                format_seconds(wall_time),
+                f"{length / wall_time:.1f}x" if wall_time > 0 else "-",
+                "ok" if ok else "FAILED",
+            ]
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print("\nClip timing:")
+    for row in rows:
+        print("  " + "  ".join(c.ljust(w) for c, w in zip(row, widths)))
+    failed = sum(1 for ok, _ in results if not ok)
+    print(
+        f"Cut {len(planned) - failed}/{len(planned)} clips in"
+        f" {format_seconds(time.time() - total_start)}"
+    )
+    return failed == 0
 
 
 def main():
@@ -89,7 +446,54 @@ def main():
         action="store_true",
         help="Use background thread to encode multiple videos",
     )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--copy",
+        action="store_true",
+        help="Stream copy without re-encoding, the start snaps to the previous keyframe",
+    )
+    mode.add_argument(
+        "--smart",
+        action="store_true",
+        help="Frame accurate, re-encodes only the partial GOPs at each edge",
+    )
+    parser.add_argument(
+        "--queue",
+        action="store_true",
+        help="Submit cuts to the persistent encode queue (see: zcmds queue)",
+    )
+    parser.add_argument(
+        "--priority", type=int, default=0, help="queue priority, higher runs first"
+    )
+    parser.add_argument(
+        "--cuts",
+        help="CSV (start,end[,outname] per row) or CMX3600 .edl cut list for the input",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of --cuts clips made at once"
+    )
     args = parser.parse_args()
+    if (args.copy or args.smart) and args.height:
+        parser.error("--height needs a re-encode, it can't be used with --copy/--smart")
+    if args.smart and args.queue:
+        parser.error("--smart can't be combined with --queue")
+    if args.cuts and args.queue:
+        parser.error("--cuts runs its clips in parallel itself, it can't use --queue")
+
+    if args.cuts:
+        if not args.input or not os.path.exists(args.input):
+            print(f"{args.input} does not exist")
+            sys.exit(1)
+        fps = None
+        if args.cuts.lower().endswith(".edl"):
+            video = get_stream(ffprobe(args.input), "video") or {}
+            fps = parse_frame_rate(video.get("r_frame_rate"))
+        try:
+            cuts = parse_cut_list(args.cuts, fps, args.input)
+        except (OSError, ValueError) as ex:
+            print(f"Error reading {args.cuts}: {ex}")
+            sys.exit(1)
+        sys.exit(0 if run_cut_list(args.input, cuts, args, args.jobs) else 1)
 
     is_interactive = (
         (args.start_timestamp is None)
@@ -97,7 +501,7 @@ def main():
         and (args.outname is None)
         and (args.crf == _CRF_DEFAULT)
     )
-    is_interactive = is_interactive or (args.background)
+    is_interactive = is_interactive or args.background or args.queue
 
     infile = args.input or input("Input video: ")
     ext = os.path.splitext(infile)[1]
@@ -135,6 +539,14 @@ def main():
             print(s)
 
         def task() -> bool:
+            if args.copy:
+                return copy_clip(
+                    infile, start_timestamp, end_timestamp, output_path, print_fcn
+                )
+            if args.smart:
+                return smart_clip(
+                    infile, crf, start_timestamp, end_timestamp, output_path, print_fcn
+                )
             return encode(
                 infile,
                 args.height,
@@ -145,14 +557,25 @@ def main():
                 print_fcn=print_fcn,
             )
 
-        if not is_interactive:
+        if args.queue:
+            cmd = build_encode_cmd(
+                infile, args.height, crf, start_timestamp, end_timestamp, output_path
+            )
+            if args.copy:
+                cmd = build_copy_cmd(
+                    infile, start_timestamp, end_timestamp, output_path
+                )
+            job_id = submit_and_start(cmd, priority=args.priority)
+            print(f"Queued job {job_id}: {output_path}")
+        elif not is_interactive:
             task()
             break
         else:
             future = executor.submit(task)
             futures.append(future)
         if "y" not in input("Job is running\nSpecify another cut? (y/n): ").lower():
-            print("Waiting for jobs to finish...")
+            if not args.queue:
+                print("Waiting for jobs to finish...")
             break
         args.start_timestamp = None
         args.end_timestamp = None
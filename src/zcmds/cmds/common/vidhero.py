@@ -1,21 +1,72 @@
 import argparse
 import os
 import sys
-import time
 
+from zcmds.util.ffmpeg_runner import FfmpegResult, format_seconds, run_ffmpeg
+from zcmds.util.media import ffprobe, get_stream, timestamp_to_seconds
 
-def timecode_to_seconds(timecode: str) -> int:
+
+def timecode_to_seconds(timecode: str) -> float:
+    """
+    Converts a timecode like 1:02:03.5, 0:38 or 38 to seconds
+    """
+    return timestamp_to_seconds(timecode)
+
+
+def build_hero_cmd(
+    video_path: str,
+    start_timecode: str,
+    end_timecode: str,
+    duration: float,
+    heights: list[int],
+    has_audio: bool,
+) -> list[str]:
     """
-    Converts a timecode to seconds
+    Builds one command that decodes the segment once (input seeking), applies
+    the fades once and splits the result to every height. The fades are
+    relative to the segment since input seeking restarts the timestamps at 0.
     """
-    time_parts: list[str] = [t for t in timecode.split(":") if t]
-    time_parts = time_parts[::-1]
-    seconds = int(time_parts[0])  # type: ignore
-    if len(time_parts) > 1:
-        seconds += int(time_parts[1]) * 60
-    if len(time_parts) > 2:
-        seconds += int(time_parts[2]) * 60 * 60
-    return seconds
+    fades = f"fade=t=in:st=0:d=1,fade=t=out:st={max(0, duration - 1)}:d=1"
+    # trunc(oh*...) fixes issue with libx264 encoder not liking an add number of width pixels.
+    splits = "".join(f"[s{i}]" for i in range(len(heights)))
+    graph = f"[0:v]{fades},split={len(heights)}{splits}"
+    for i, height in enumerate(heights):
+        graph += f";[s{i}]scale=trunc(oh*a/2)*2:{height}[v{i}]"
+    if has_audio:
+        afades = (
+            f"afade=type=in:start_time=0:duration=1,"
+            f"afade=type=out:start_time={max(0, duration - 1)}:duration=1"
+        )
+        asplits = "".join(f"[a{i}]" for i in range(len(heights)))
+        graph += f";[0:a]{afades},asplit={len(heights)}{asplits}"
+    cmd = ["static_ffmpeg", "-y", "-ss", start_timecode, "-to", end_timecode]
+    cmd += ["-i", video_path, "-filter_complex", graph]
+    return cmd
+
+
+def out_args(out_paths: list[str], crf: int, has_audio: bool) -> list[str]:
+    """Output options apply to one output file, so they repeat for each."""
+    args: list[str] = []
+    for i, out_path in enumerate(out_paths):
+        args += ["-map", f"[v{i}]"]
+        args += ["-map", f"[a{i}]"] if has_audio else ["-an"]
+        args += ["-preset", "veryslow", "-c:v", "libx264", "-crf", str(crf)]
+        args += ["-movflags", "+faststart", out_path]
+    return args
+
+
+def print_report(result: FfmpegResult, out_paths: list[str], duration: float) -> None:
+    print("\nTiming report:")
+    for out_path in out_paths:
+        size = os.path.getsize(out_path) if os.path.exists(out_path) else 0
+        kbps = size * 8 / duration / 1000 if duration > 0 else 0
+        print(f"  {out_path}: {size / 1024 / 1024:.2f}MB, {kbps:.0f}kb/s")
+    cpu = f", cpu {format_seconds(result.cpu_time)}" if result.cpu_time else ""
+    speed = f", {result.speed:.2f}x realtime" if result.speed else ""
+    print(
+        f"  {len(out_paths)} heights from one decode in"
+        f" {format_seconds(result.wall_time)}{cpu}{speed}"
+    )
 
 
 def main():
@@ -47,42 +98,24 @@ def main():
     if not os.path.exists(video_path):
         print(f"{video_path} does not exist")
         sys.exit(1)
-    for height in heights:
-        crf = args.crf
-        path, _ = os.path.splitext(video_path)
-        out_path = os.path.join(path, f"hero_{height}_crf{crf}.mp4")
-        os.makedirs(os.path.dirname(out_path), exist_ok=True)
-        # trunc(oh*...) fixes issue with libx264 encoder not liking an add number of width pixels.
-        start_seconds = timecode_to_seconds(start_timecode)
-        end_seconds = timecode_to_seconds(end_timecode)
-        videofilter_stmt = (
-            "-vf "
-            f'"scale=trunc(oh*a/2)*2:{height},'
-            f"fade=t=in:st={start_seconds}:d=1,"
-            f'fade=t=out:st={end_seconds - 1}:d=1"'
-        )
-        audiofilter_stmt = (
-            f'-af "afade=type=in:start_time={start_seconds}:duration=1,'
-            f'afade=type=out:start_time={end_seconds - 1}:duration=1"'
-        )
-        cmd = (
-            f'static_ffmpeg -y -hide_banner -v quiet -stats -i "{video_path}"'
-            f" -ss {start_timecode} -to {end_timecode}"
-            f" {videofilter_stmt} "
-            f" {audiofilter_stmt} "
-            f' -movflags +faststart -preset veryslow -c:v libx264 -crf {crf} "{out_path}"'
-        )
-        print(f"\nRUNNING:\n  {cmd}\n")
+    crf = args.crf
+    path, _ = os.path.splitext(video_path)
+    os.makedirs(path, exist_ok=True)
+    out_paths = [os.path.join(path, f"hero_{h}_crf{crf}.mp4") for h in heights]
+    start_seconds = timecode_to_seconds(start_timecode)
+    end_seconds = timecode_to_seconds(end_timecode)
+    duration = end_seconds - start_seconds
+    has_audio = not args.mute and get_stream(ffprobe(video_path), "audio") is not None
+    cmd = build_hero_cmd(
+        video_path, start_timecode, end_timecode, duration, heights, has_audio
+    )
+    for out_path in out_paths:
         print("Writing file: " + out_path)
-        start_time = time.time()
-        os.system(cmd)
-        if args.mute:
-            cmd = f'vidmute "{out_path}"'
-            print(f"\nRUNNING:\n  {cmd}\n")
-            os.system(cmd)
-        diff_time = time.time() - start_time
-        diff_time_str = str(round(diff_time, 1))
-        print(f"Generted file: {out_path} in {diff_time_str} seconds")
+    cmd += out_args(out_paths, crf, has_audio)
+    result = run_ffmpeg(cmd, duration=duration, outputs=out_paths)
+    print_report(result, out_paths, duration)
+    if not result.ok:
+        sys.exit(1)
     print("\nDone!\n")
 
 
@@ -1,6 +1,7 @@
 # pylint: skip-file
 
 import argparse
+import json as stdjson
 import os
 import subprocess
 import sys
@@ -8,6 +9,15 @@ from typing import Any, Tuple, cast
 
 import json5 as json
 
+from zcmds.util.media import (
+    DEFAULT_PROBE_WORKERS,
+    expand_media_paths,
+    get_duration,
+    get_stream,
+    parse_frame_rate,
+    probe_many,
+)
+
 
 def exec(cmd: str) -> Tuple[int, str, str]:
     proc = subprocess.Popen(
@@ -153,22 +163,136 @@ def print_short_info(vidfile: str) -> None:
         print("(No audio stream found)")
 
 
+def summarize(vidfile: str, vidinfo_data: dict[str, Any]) -> dict[str, Any]:
+    """Returns the one-line summary (codec, resolution, fps...) of a probed file."""
+    video = get_stream(vidinfo_data, "video")
+    audio = get_stream(vidinfo_data, "audio")
+    fmt = cast(dict[str, Any], vidinfo_data.get("format", {}))
+    bitrate = fmt.get("bit_rate")
+    row: dict[str, Any] = {
+        "file": vidfile,
+        "size": os.path.getsize(vidfile),
+        "codec": video.get("codec_name") if video else None,
+        "width": int(video["width"]) if video and "width" in video else None,
+        "height": int(video["height"]) if video and "height" in video else None,
+        "fps": parse_frame_rate(video.get("r_frame_rate")) if video else None,
+        "bitrate": int(bitrate) if bitrate and str(bitrate).isdigit() else None,
+        "duration": get_duration(vidinfo_data),
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "audio_layout": None,
+    }
+    if audio:
+        row["audio_layout"] = (
+            audio.get("channel_layout") or f"{audio.get('channels')}ch"
+        )
+    return row
+
+
+def format_table(rows: list[dict[str, Any]]) -> str:
+    """Formats summary rows into an aligned text table."""
+    headers = ["CODEC", "RESOLUTION", "FPS", "BITRATE", "DURATION", "AUDIO", "FILE"]
+    lines: list[list[str]] = [headers]
+    for row in rows:
+        if row.get("error"):
+            lines.append(
+                ["ERROR", "", "", "", "", "", f"{row['file']} ({row['error']})"]
+            )
+            continue
+        resolution = f"{row['width']}x{row['height']}" if row["width"] else "-"
+        fps = f"{row['fps']:.2f}" if row["fps"] else "-"
+        bitrate = f"{row['bitrate'] / 1000000:.2f} Mbps" if row["bitrate"] else "-"
+        duration = format_duration(row["duration"]) if row["duration"] else "-"
+        audio = "-"
+        if row["audio_codec"]:
+            audio = f"{row['audio_codec']} {row['audio_layout']}"
+        lines.append(
+            [
+                row["codec"] or "-",
+                resolution,
+                fps,
+                bitrate,
+                duration,
+                audio,
+                row["file"],
+            ]
+        )
+    widths = [max(len(line[i]) for line in lines) for i in range(len(headers) - 1)]
+    out: list[str] = []
+    for line in lines:
+        cells = [cell.ljust(widths[i]) for i, cell in enumerate(line[:-1])]
+        out.append("  ".join(cells + [line[-1]]))
+    return "\n".join(out)
+
+
+def probe_error(ex: Exception) -> str:
+    """The reason ffprobe gave for failing, or the exception itself."""
+    stderr = getattr(ex, "stderr", None)
+    lines = stderr.strip().splitlines() if isinstance(stderr, str) else []
+    return lines[-1] if lines else str(ex)
+
+
+def batch_info(vidfiles: list[str], max_workers: int) -> list[dict[str, Any]]:
+    """Probes all files concurrently and returns a summary row per file."""
+    probed = probe_many(vidfiles, max_workers=max_workers)
+    rows: list[dict[str, Any]] = []
+    for vidfile in vidfiles:
+        result = probed[vidfile]
+        if isinstance(result, Exception):
+            # ffprobe starts its message with the file name, the row has it.
+            error = probe_error(result).removeprefix(f"{vidfile}: ")
+            rows.append({"file": vidfile, "error": error})
+        else:
+            rows.append(summarize(vidfile, result))
+    return rows
+
+
 def main():
     parser = argparse.ArgumentParser(
-        description="Cuts clips from local files.\n",
+        description="Prints info for one or more media files.\n",
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("input", help="input", nargs="?")
+    parser.add_argument(
+        "input", help="input files, directories or globs like *.mp4", nargs="*"
+    )
     parser.add_argument("--full", help="full ffprobe output", action="store_true")
     parser.add_argument("--per-frame", help="per frame info", action="store_true")
+    parser.add_argument(
+        "--json", help="print one json summary per file", action="store_true"
+    )
+    parser.add_argument(
+        "--recursive", help="recurse into directories", action="store_true"
+    )
+    parser.add_argument(
+        "--jobs",
+        help=f"number of concurrent probes (default: {DEFAULT_PROBE_WORKERS})",
+        type=int,
+        default=DEFAULT_PROBE_WORKERS,
+    )
     args = parser.parse_args()
-    infile = args.input or input("Input video: ")
-    if not infile:
+    inputs: list[str] = args.input or [input("Input video: ")]
+    if not any(inputs):
         print("No input file specified")
         sys.exit(1)
-    if not os.path.exists(infile):
-        print(f"File '{infile}' does not exist")
-        sys.exit(1)
+    is_batch = (
+        len(inputs) > 1 or os.path.isdir(inputs[0]) or not os.path.exists(inputs[0])
+    )
+    if is_batch or args.json:
+        if args.full or args.per_frame:
+            parser.error("--full and --per-frame only work with a single file")
+        vidfiles = expand_media_paths(inputs, recursive=args.recursive)
+        if not vidfiles:
+            print(f"No media files found in {', '.join(inputs)}")
+            sys.exit(1)
+        rows = batch_info(vidfiles, max_workers=args.jobs)
+        if args.json:
+            # json5 writes unquoted keys, the stdlib keeps this machine readable.
+            print(stdjson.dumps(rows, indent=4))
+        else:
+            print(format_table(rows))
+        has_errors = any(row.get("error") for row in rows)
+        sys.exit(1 if has_errors else 0)
+
+    infile = inputs[0]
     if not args.full:
         try:
             print_short_info(infile)
@@ -3,8 +3,16 @@
 import argparse
 import multiprocessing
 import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Optional
 
+from zcmds.util.encode_queue import default_job_threads
+from zcmds.util.ffmpeg_runner import format_cmd, format_seconds, run_ffmpeg
+from zcmds.util.media import timestamp_to_seconds
+
 
 CRF_START = 18
 CRF_END = 40
@@ -17,22 +25,93 @@ ENCODING_PRESET = "veryslow"
 # static_ffmpeg -y -hide_banner -i input.mp4 -ss 2:04 -to 03:08 -vf "fade=t=in:st=124:d=1,fade=t=out:st=187:d=1" -crf 36 -movflags +faststart -tune film -preset veryslow out.mp4
 
 
-def get_height(filename: str) -> int:
-    cmd = f'ffprobe -v error -select_streams v:0 -show_entries stream=height -of default=noprint_wrappers=1 "{filename}"'
-    return int(os.popen(cmd).read())
-
-
-def generate_filters(height: Optional[int]):
+def generate_filters(height: Optional[int]) -> list[str]:
     if height is None:
-        return ""
-    scale_stmt = f"scale=-1:{height}:flags=lanczos"
+        return []
+    # -2 keeps the width even, libx264 rejects odd widths.
+    scale_stmt = f"scale=-2:{height}:flags=lanczos"
     # TODO: add a filter for the fade in and out.
     # Example:
     # static_ffmpeg -y -hide_banner -i input.mp4 -ss 2:04 -to 03:08 \
     #  -vf "fade=t=in:st=124:d=1,fade=t=out:st=187:d=1,scale=-1:1080:flags=lanczos" \
     #  -tune film -preset veryslow -threads 17 -c:v libx264 -crf 36 out.mp4
     filters = [scale_stmt]
-    return f' -vf "{",".join(filters)}"'
+    return ["-vf", ",".join(filters)]
+
+
+_SSIM_RE = re.compile(r"SSIM .*All:([\d.]+)")
+_PSNR_RE = re.compile(r"PSNR .*average:([\d.]+|inf)")
+
+
+@dataclass
+class MatrixResult:
+    crf: int
+    path: str
+    ok: bool
+    encode_time: float = 0.0
+    size: int = 0
+    ssim: Optional[float] = None
+    psnr: Optional[float] = None
+
+
+def extract_reference(
+    infile: str, start: str, end: str, height: Optional[int], out_path: str
+) -> bool:
+    """
+    Cuts the clip once with input seeking into a lossless file. Every CRF
+    variant is encoded from it and scored against it.
+    """
+    cmd = ["static_ffmpeg", "-y", "-ss", start, "-to", end, "-i", infile]
+    cmd += generate_filters(height)
+    # Lossless audio too: a stream copy would start on an earlier audio packet,
+    # offset the video and make the mp4 variants pad frames at the start.
+    cmd += ["-c:v", "libx264", "-qp", "0", "-preset", "ultrafast", "-c:a", "flac"]
+    cmd.append(out_path)
+    return run_ffmpeg(cmd).ok
+
+
+def measure_quality(
+    variant: str, reference: str
+) -> tuple[Optional[float], Optional[float]]:
+    """Returns the (SSIM, PSNR) of variant against reference, computed by ffmpeg."""
+    # Both inputs are renumbered frame by frame so the metrics compare the same
+    # frames. Shifting by the start time isn't enough: the mp4 variants carry
+    # an encoder delay and the mkv reference rounds timestamps to the
+    # millisecond, so framesync would pair neighbouring frames.
+    reset = "setpts=N/FRAME_RATE/TB,split"
+    graph = f"[0:v]{reset}[a0][a1];[1:v]{reset}[b0][b1];[a0][b0]ssim;[a1][b1]psnr"
+    cmd = ["static_ffmpeg", "-i", variant, "-i", reference, "-lavfi", graph]
+    cmd += ["-f", "null", "-"]
+    result = run_ffmpeg(cmd, outputs=[], quiet=True)
+    ssim = _SSIM_RE.search(result.stderr)
+    psnr = _PSNR_RE.search(result.stderr)
+    return (
+        float(ssim.group(1)) if ssim else None,
+        float(psnr.group(1)) if psnr else None,
+    )
+
+
+def print_matrix(results: list[MatrixResult], duration: float) -> None:
+    rows = [["CRF", "SIZE", "BITRATE", "TIME", "SSIM", "PSNR", "FILE"]]
+    for r in sorted(results, key=lambda r: r.crf):
+        if not r.ok:
+            rows.append([str(r.crf), "-", "-", "-", "-", "-", "FAILED"])
+            continue
+        kbps = r.size * 8 / duration / 1000 if duration > 0 else 0
+        rows.append(
+            [
+                str(r.crf),
+                f"{r.size / 1024 / 1024:.2f}MB",
+                f"{kbps:.0f}kb/s",
+                format_seconds(r.encode_time),
+                f"{r.ssim:.4f}" if r.ssim is not None else "-",
+                f"{r.psnr:.2f}dB" if r.psnr is not None else "-",
+                r.path,
+            ]
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  " + "  ".join(c.ljust(w) for c, w in zip(row, widths)))
 
 
 def main():
@@ -45,28 +124,80 @@ def main():
     parser.add_argument(
         "--height", help="height of the output video, e.g 1080 = 1080p", default=None
     )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of CRF variants encoded at once"
+    )
     args = parser.parse_args()
     cpu_count = multiprocessing.cpu_count()
     print(f"Detected {cpu_count} cpus")
-    thread_count = cpu_count if cpu_count < 2 else cpu_count + 1
-    failed: list[str] = []
+    crfs = list(range(CRF_START, CRF_END, CRF_STEP))
+    jobs = args.jobs or max(1, cpu_count // default_job_threads())
+    jobs = max(1, min(jobs, len(crfs)))
+    thread_count = max(1, cpu_count // jobs)
     dirname = os.path.splitext(os.path.basename(args.input))[0]
     os.makedirs(dirname, exist_ok=True)
     ENCODER = "libx264"  # Warning libx265 has poor support still.
-    thread_arg = ""
+    thread_args: list[str] = []
     if ENCODER == "libx264":
-        thread_arg = f"-threads {thread_count}"
-    for crf in range(CRF_START, CRF_END, CRF_STEP):
-        get_height(args.input)
-        video_filter_stmt = generate_filters(args.height)
-        cmd = f'static_ffmpeg -y -hide_banner -i "{args.input}" -movflags +faststart -tune film -preset {ENCODING_PRESET} {thread_arg} -c:v {ENCODER} {video_filter_stmt} -crf {crf} -ss {args.start_timestamp} -to {args.end_timestamp} "{dirname}/{args.height}p_{crf}.mp4"'
-        print(f"Executing:\n  {cmd}")
-        if 0 != os.system(cmd):
-            print(f"Failed to execute {cmd}")
-            failed.append(cmd)
-    if failed:
-        failure_list = "\n".join(failed)
-        print(f"Failed to execute the following commands:\n{failure_list}\n")
+        thread_args = ["-threads", str(thread_count)]
+    clip_duration = timestamp_to_seconds(args.end_timestamp) - timestamp_to_seconds(
+        args.start_timestamp
+    )
+    with tempfile.TemporaryDirectory(prefix=".reference_", dir=dirname) as tmpdir:
+        reference = os.path.join(tmpdir, "reference.mkv")
+        print("Extracting the clip once:")
+        if not extract_reference(
+            args.input,
+            args.start_timestamp,
+            args.end_timestamp,
+            args.height,
+            reference,
+        ):
+            print("Failed to extract the clip")
+            return 1
+        print(f"Encoding {len(crfs)} CRF variants, {jobs} at a time")
+
+        def encode_variant(crf: int) -> MatrixResult:
+            out_path = f"{dirname}/{args.height}p_{crf}.mp4"
+            cmd = [
+                "static_ffmpeg",
+                "-y",
+                "-i",
+                reference,
+                "-movflags",
+                "+faststart",
+                "-tune",
+                "film",
+                "-preset",
+                ENCODING_PRESET,
+                *thread_args,
+                "-c:v",
+                ENCODER,
+                "-crf",
+                str(crf),
+                out_path,
+            ]
+            result = run_ffmpeg(cmd, duration=clip_duration, quiet=True)
+            if not result.ok:
+                print(f"Failed to execute {format_cmd(cmd)}\n{result.stderr}")
+                return MatrixResult(crf=crf, path=out_path, ok=False)
+            ssim, psnr = measure_quality(out_path, reference)
+            print(f"  crf {crf} done in {format_seconds(result.wall_time)}")
+            return MatrixResult(
+                crf=crf,
+                path=out_path,
+                ok=True,
+                encode_time=result.wall_time,
+                size=result.output_bytes,
+                ssim=ssim,
+                psnr=psnr,
+            )
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(encode_variant, crfs))
+    print("\nCRF matrix:")
+    print_matrix(results, clip_duration)
+    if not all(r.ok for r in results):
         return 1
     return 0
 
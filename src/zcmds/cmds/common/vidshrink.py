@@ -1,14 +1,86 @@
 # pylint: skip-file
 
 import argparse
+import json
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from zcmds.util.chunked_encode import encode_chunked
+from zcmds.util.encode_queue import default_job_threads, submit_and_start
+from zcmds.util.ffmpeg_runner import format_seconds, run_ffmpeg
+from zcmds.util.media import VIDEO_EXTENSIONS, expand_media_paths
+
+
+MANIFEST_NAME = ".vidshrink_manifest.json"
+_MANIFEST_LOCK = threading.Lock()
+
+
+def get_out_path(filename: str) -> str:
+    path, _ = os.path.splitext(filename)
+    return f"{path}_small.mp4"
+
+
+def get_partial_path(out_path: str) -> str:
+    path, ext = os.path.splitext(out_path)
+    return f"{path}.partial{ext}"
+
+
+def _manifest_path(out_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(out_path)), MANIFEST_NAME)
+
+
+def load_manifest(path: str) -> dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_done(out_path: str, filename: str, settings: dict[str, Any]) -> None:
+    """Records a finished output so a resumed batch knows which settings made it."""
+    path = _manifest_path(out_path)
+    with _MANIFEST_LOCK:
+        manifest = load_manifest(path)
+        stat = os.stat(filename)
+        manifest[os.path.basename(out_path)] = {
+            "input": os.path.basename(filename),
+            "input_size": stat.st_size,
+            "input_mtime": stat.st_mtime,
+            "settings": settings,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def is_done(filename: str, out_path: str, settings: dict[str, Any]) -> bool:
+    """
+    True if out_path is newer than filename and, when the manifest knows about
+    it, was made from the same input with the same settings.
+    """
+    if not os.path.exists(out_path):
+        return False
+    if os.path.getmtime(out_path) < os.path.getmtime(filename):
+        return False
+    entry = load_manifest(_manifest_path(out_path)).get(os.path.basename(out_path))
+    if entry is None:
+        return True
+    return (
+        entry.get("input_size") == os.path.getsize(filename)
+        and entry.get("settings") == settings
+    )
 
 
 def main():
-    # Expects a single argument: the path to the video file to shrink
-    parser = argparse.ArgumentParser(description="Shrink a video file")
-    parser.add_argument("video_path", help="Path to the video file to shrink")
+    parser = argparse.ArgumentParser(description="Shrink video files")
+    parser.add_argument(
+        "video_path", help="Video files, directories or globs to shrink", nargs="+"
+    )
     # Adds optional crf argument
     parser.add_argument("--crf", help="CRF value to use", type=int, default=26)
     # Adds optional height argument
@@ -23,23 +95,128 @@ def main():
         help="frames per second of the output video, default is no framerate change",
         default=None,
     )
+    parser.add_argument(
+        "--queue",
+        action="store_true",
+        help="submit to the persistent encode queue instead (see: zcmds queue)",
+    )
+    parser.add_argument(
+        "--priority", type=int, default=0, help="queue priority, higher runs first"
+    )
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        default=0,
+        help="split at keyframes and encode N chunks in parallel",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of videos encoded at once"
+    )
+    parser.add_argument(
+        "--recursive", action="store_true", help="search directories recursively"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="re-encode even if the output is current"
+    )
     args = parser.parse_args()
-    filename = args.video_path
-    if not os.path.exists(filename):
-        print(f"{filename} does not exist")
+    if args.chunks > 1 and args.queue:
+        parser.error("--chunks can't be combined with --queue")
+    filenames = expand_media_paths(
+        args.video_path, VIDEO_EXTENSIONS, recursive=args.recursive
+    )
+    # Don't shrink the outputs of a previous run found by a directory scan.
+    filenames = [
+        f
+        for f in filenames
+        if f in args.video_path
+        or not os.path.splitext(f)[0].endswith(("_small", "_small.partial"))
+    ]
+    if not filenames:
+        print(f"No videos found in {' '.join(args.video_path)}")
         sys.exit(1)
     height = args.height
     crf = args.crf
-    path, _ = os.path.splitext(filename)
-    out_path = f"{path}_small.mp4"
+    settings = {"crf": crf, "height": str(height), "fps": args.fps}
+    settings["downmix"] = args.downmix
 
-    downmix_stmt = "-ac 1" if args.downmix else ""
     fps_stmt = f"fps=fps={args.fps}," if args.fps else ""
-    filter_stmt = f'-vf "{fps_stmt}scale=trunc(oh*a/2)*2:{height}"'
     # trunc(oh*...) fixes issue with libx264 encoder not liking an add number of width pixels.
-    cmd = f'static_ffmpeg -hide_banner -y -i "{filename}" {filter_stmt} {downmix_stmt} -movflags +faststart -preset veryslow -c:v libx264 -crf {crf} "{out_path}"'
-    print(f"Running:\n  {cmd}")
-    os.system(cmd)
+    filter_stmt = f"{fps_stmt}scale=trunc(oh*a/2)*2:{height}"
+    video_args = ["-vf", filter_stmt, "-preset", "veryslow", "-c:v", "libx264"]
+    video_args += ["-crf", str(crf)]
+    audio_args = ["-ac", "1"] if args.downmix else []
+    output_args = ["-movflags", "+faststart"]
+
+    pending: list[str] = []
+    for filename in filenames:
+        if not args.force and is_done(filename, get_out_path(filename), settings):
+            print(f"Skipping {filename}, {get_out_path(filename)} is up to date")
+        else:
+            pending.append(filename)
+
+    if args.queue:
+        for filename in pending:
+            cmd = ["static_ffmpeg", "-y", "-i", filename]
+            cmd += video_args + audio_args + output_args + [get_out_path(filename)]
+            job_id = submit_and_start(cmd, priority=args.priority)
+            print(f"Queued job {job_id}: {get_out_path(filename)}")
+        sys.exit(0)
+
+    threads = default_job_threads()
+    jobs = args.jobs or max(1, (os.cpu_count() or 1) // threads)
+    if args.chunks > 1:
+        # The chunks already use every core.
+        jobs = 1
+    jobs = max(1, min(jobs, len(pending) or 1))
+    verbose = jobs == 1
+    cancel_event = threading.Event()
+
+    def shrink(filename: str) -> bool:
+        out_path = get_out_path(filename)
+        partial_path = get_partial_path(out_path)
+        if args.chunks > 1:
+            ok = encode_chunked(
+                filename, partial_path, video_args, audio_args, args.chunks, output_args
+            )
+        else:
+            cmd = ["static_ffmpeg", "-y", "-i", filename] + video_args + audio_args
+            if not verbose:
+                cmd += ["-threads", str(threads)]
+            cmd += output_args + [partial_path]
+            result = run_ffmpeg(cmd, quiet=not verbose, cancel_event=cancel_event)
+            ok = result.ok
+            if not verbose:
+                status = "done" if ok else f"FAILED ({result.returncode})"
+                print(f"{filename}: {status} in {format_seconds(result.wall_time)}")
+                if not ok and not result.cancelled:
+                    print(result.stderr)
+        if not ok:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return False
+        os.replace(partial_path, out_path)
+        record_done(out_path, filename, settings)
+        return True
+
+    if len(pending) > 1:
+        print(f"Shrinking {len(pending)} videos, {jobs} at a time")
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(shrink, f) for f in pending]
+        try:
+            results = [f.result() for f in futures]
+        except KeyboardInterrupt:
+            print("Interrupted, finished videos will be skipped on the next run")
+            cancel_event.set()
+            for f in futures:
+                f.cancel()
+            sys.exit(1)
+    failed = results.count(False)
+    if len(filenames) > 1:
+        print(
+            f"Shrunk {len(results) - failed}, skipped {len(filenames) - len(pending)},"
+            f" failed {failed}"
+        )
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":
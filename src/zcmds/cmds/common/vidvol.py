@@ -3,32 +3,192 @@ Normalizes the audio of a video file.
 """
 
 import argparse
+import json
+import math
 import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Optional
 
+from zcmds.util.ffmpeg_runner import run_ffmpeg
+from zcmds.util.media import (
+    MEDIA_EXTENSIONS,
+    expand_media_paths,
+    ffprobe,
+    get_duration,
+    is_media_file,
+)
 
-def _is_media_file(filename: str) -> bool:
-    if not os.path.isfile(filename):
-        return False
-    ext = os.path.splitext(filename.lower())[1]
-    return ext in [".mp4", ".mkv", ".avi", ".mov", ".mp3", ".wav"]
+
+DEFAULT_WINDOWS = 12
+DEFAULT_WINDOW_SECONDS = 10.0
+_MEAN_RE = re.compile(r"mean_volume:\s*(-?[\d.]+|-inf) dB")
+_MAX_RE = re.compile(r"max_volume:\s*(-?[\d.]+|-inf) dB")
+_LUFS_RE = re.compile(r"^\s*I:\s*(-?[\d.]+|-inf) LUFS", re.MULTILINE)
+
+
+@dataclass
+class VolumeStats:
+    """Volume of a file, estimated from sampled windows when sampled is True."""
+
+    path: str
+    mean_volume: Optional[float]
+    max_volume: Optional[float]
+    lufs: Optional[float]
+    sampled: bool = False
+    windows: int = 1
+    coverage: float = 1.0
+    # 95% confidence interval of the LUFS estimate in LU, None for full scans.
+    lufs_confidence: Optional[float] = None
+    # Why the file couldn't be measured, the volumes are None then.
+    error: Optional[str] = None
 
 
 def ffmpeg_adjust_volume(filename: str, volume: float, out_file: str):
     """
     Adjusts the volume of a video file.
     """
-    cmd = f'static_ffmpeg  -i "{filename}" -filter:a "volume={volume}" "{out_file}"'
-    print(f"Executing:\n  {cmd}")
-    os.system(cmd)
+    cmd = [
+        "static_ffmpeg",
+        "-y",
+        "-i",
+        filename,
+        "-filter:a",
+        f"volume={volume}",
+        out_file,
+    ]
+    run_ffmpeg(cmd)
+
+
+def _parse_db(regex: re.Pattern[str], text: str) -> Optional[float]:
+    match = regex.search(text)
+    if match is None:
+        return None
+    return -math.inf if match.group(1) == "-inf" else float(match.group(1))
+
+
+def _analyze_cmd(
+    filename: str, start: Optional[float] = None, length: Optional[float] = None
+) -> list[str]:
+    cmd = ["static_ffmpeg"]
+    if start is not None:
+        cmd += ["-ss", f"{start:.3f}"]
+    if length is not None:
+        cmd += ["-t", f"{length:.3f}"]
+    cmd += ["-i", filename, "-map", "0:a:0", "-vn", "-sn", "-dn"]
+    return cmd + ["-af", "volumedetect,ebur128=framelog=quiet", "-f", "null", "-"]
+
+
+def _energy_mean(levels: list[float]) -> Optional[float]:
+    """Averages dB levels as power, the way a longer measurement would."""
+    finite = [10 ** (v / 10) for v in levels if v != -math.inf]
+    if not finite:
+        return -math.inf if levels else None
+    return round(10 * math.log10(sum(finite) / len(levels)), 1)
+
+
+def analyze_volume(filename: str, quiet: bool = True) -> VolumeStats:
+    """Full decode through volumedetect and ebur128."""
+    result = run_ffmpeg(_analyze_cmd(filename), outputs=[], quiet=quiet, check=True)
+    return VolumeStats(
+        path=filename,
+        mean_volume=_parse_db(_MEAN_RE, result.stderr),
+        max_volume=_parse_db(_MAX_RE, result.stderr),
+        lufs=_parse_db(_LUFS_RE, result.stderr),
+    )
+
+
+def window_starts(duration: float, windows: int, window_seconds: float) -> list[float]:
+    """Start times of evenly spaced windows, each centered in its slice."""
+    span = duration / windows
+    return [max(0.0, span * i + (span - window_seconds) / 2) for i in range(windows)]
+
+
+def analyze_volume_fast(
+    filename: str,
+    windows: int = DEFAULT_WINDOWS,
+    window_seconds: float = DEFAULT_WINDOW_SECONDS,
+    jobs: Optional[int] = None,
+) -> VolumeStats:
+    """
+    Estimates the volume from input seeked windows analyzed in parallel, so
+    only windows * window_seconds of audio is decoded. Falls back to a full
+    scan when the windows would cover most of the file anyway.
+    """
+    duration = get_duration(ffprobe(filename))
+    if not duration or duration <= windows * window_seconds * 2:
+        return analyze_volume(filename)
+    starts = window_starts(duration, windows, window_seconds)
+    jobs = max(1, min(jobs or (os.cpu_count() or 1), windows))
+
+    def analyze(start: float) -> str:
+        cmd = _analyze_cmd(filename, start, window_seconds)
+        return run_ffmpeg(cmd, outputs=[], quiet=True, check=True).stderr
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        logs = list(executor.map(analyze, starts))
+    means = [v for v in (_parse_db(_MEAN_RE, log) for log in logs) if v is not None]
+    maxes = [v for v in (_parse_db(_MAX_RE, log) for log in logs) if v is not None]
+    lufs = [v for v in (_parse_db(_LUFS_RE, log) for log in logs) if v is not None]
+    # Gate the windows like EBU R128 gates its blocks: absolute at -70 LUFS,
+    # then relative at 10 LU below the loudness of what's left.
+    gated = [v for v in lufs if v > -70]
+    ungated = _energy_mean(gated)
+    if ungated is not None:
+        gated = [v for v in gated if v > ungated - 10]
+    confidence = None
+    if len(gated) > 1:
+        avg = sum(gated) / len(gated)
+        std = math.sqrt(sum((v - avg) ** 2 for v in gated) / (len(gated) - 1))
+        confidence = round(1.96 * std / math.sqrt(len(gated)), 1)
+    return VolumeStats(
+        path=filename,
+        mean_volume=_energy_mean(means),
+        max_volume=max(maxes) if maxes else None,
+        lufs=_energy_mean(gated) if gated else (-70.0 if lufs else None),
+        sampled=True,
+        windows=windows,
+        coverage=round(min(1.0, windows * window_seconds / duration), 4),
+        lufs_confidence=confidence,
+    )
+
+
+def format_stats(stats: VolumeStats) -> str:
+    if stats.error:
+        return f"{stats.path}: FAILED: {stats.error}"
+
+    def db(value: Optional[float], unit: str) -> str:
+        return "n/a" if value is None else f"{value} {unit}"
+
+    line = (
+        f"{stats.path}: mean {db(stats.mean_volume, 'dB')},"
+        f" max {db(stats.max_volume, 'dB')}, {db(stats.lufs, 'LUFS')}"
+    )
+    if stats.sampled:
+        confidence = (
+            f" +/- {stats.lufs_confidence} LU"
+            if stats.lufs_confidence is not None
+            else ""
+        )
+        line += (
+            f"{confidence} (estimated from {stats.windows} windows,"
+            f" {stats.coverage:.1%} of the file)"
+        )
+    return line
 
 
 def ffmpeg_print_volume_detect(filename: str) -> None:
     """
     Uses ffmpeg to get the volume of a video file.
     """
-    cmd = f'static_ffmpeg -i "{filename}" -nostats -hide_banner -af "volumedetect" -f null /dev/null'
-    print("Executing:\n  " + cmd + "\n")
-    os.system(cmd)
+    cmd = ["static_ffmpeg", "-i", filename, "-af", "volumedetect", "-f", "null", "-"]
+    result = run_ffmpeg(cmd, outputs=[])
+    for line in result.stderr.splitlines():
+        if "volumedetect" in line:
+            print(line)
 
 
 def main():
@@ -36,11 +196,86 @@ def main():
         description="Prints the video volume or sets it.\n",
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("vidfile", help="Path to vid file", nargs="?")
+    parser.add_argument(
+        "vidfile", help="Path to vid files, directories or globs", nargs="*"
+    )
     parser.add_argument("--out", help="Path to vid file")
     parser.add_argument("--volume", help="Volume to adjust to")
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="estimate from seeked windows instead of decoding everything",
+    )
+    parser.add_argument(
+        "--windows",
+        type=int,
+        default=DEFAULT_WINDOWS,
+        help="number of windows sampled by --fast",
+    )
+    parser.add_argument(
+        "--window-seconds",
+        type=float,
+        default=DEFAULT_WINDOW_SECONDS,
+        help="length of each --fast window",
+    )
+    parser.add_argument("--json", action="store_true", help="print the stats as json")
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="number of ffmpeg processes at once"
+    )
     args = parser.parse_args()
-    vidfile = args.vidfile or input("in vid file: ")
+    # A directory or glob is a batch even on its own.
+    batch = len(args.vidfile) > 1 or any(not os.path.isfile(p) for p in args.vidfile)
+    measure = args.fast or args.json or batch
+    if args.out is None and args.volume is None and measure:
+        files = expand_media_paths(args.vidfile, MEDIA_EXTENSIONS)
+        if not files:
+            print(f"No media files found in {' '.join(args.vidfile)}")
+            sys.exit(1)
+
+        def measure_file(path: str) -> VolumeStats:
+            try:
+                if args.fast:
+                    return analyze_volume_fast(
+                        path, args.windows, args.window_seconds, args.jobs
+                    )
+                return analyze_volume(path)
+            except subprocess.CalledProcessError as ex:
+                # ffmpeg's last stderr line says why, ffprobe runs quiet.
+                lines = (ex.stderr or "").strip().splitlines()
+                tool = os.path.basename(str(ex.cmd[0]))
+                error = (
+                    lines[-1] if lines else f"{tool} failed with code {ex.returncode}"
+                )
+                return VolumeStats(path, None, None, None, error=error)
+            except ValueError as ex:
+                return VolumeStats(path, None, None, None, error=str(ex))
+
+        if args.fast:
+            # The windows of each file already run in parallel.
+            results = [measure_file(f) for f in files]
+        else:
+            jobs = max(1, min(args.jobs or (os.cpu_count() or 1), len(files)))
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(measure_file, files))
+        if args.json:
+            # -inf isn't valid json, silence is reported as null.
+            data = [
+                {
+                    k: None if isinstance(v, float) and math.isinf(v) else v
+                    for k, v in asdict(r).items()
+                }
+                for r in results
+            ]
+            print(json.dumps(data if len(data) > 1 else data[0], indent=2))
+        else:
+            for stats in results:
+                print(format_stats(stats))
+        if any(r.error for r in results):
+            sys.exit(1)
+        return
+    if batch:
+        parser.error("--out and --volume only work with a single file")
+    vidfile = args.vidfile[0] if args.vidfile else input("in vid file: ")
     if args.out is None and args.volume is None:
         ffmpeg_print_volume_detect(vidfile)
         return
@@ -49,7 +284,7 @@ def main():
     out = args.out or input("out vid file: ")
     if len(os.path.dirname(vidfile)):
         os.makedirs(os.path.dirname(out), exist_ok=True)
-    assert _is_media_file(vidfile), f"{vidfile} is not a media file"
+    assert is_media_file(vidfile), f"{vidfile} is not a media file"
     ffmpeg_adjust_volume(vidfile, vol, out)
 
 
@@ -8,14 +8,17 @@ import sys
 import tempfile
 
 # import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from threading import Thread
-from typing import Callable
+from threading import BoundedSemaphore, Thread
+from typing import Callable, Optional
 
 from PyQt6 import QtCore  # type: ignore
 from PyQt6.QtGui import QDragEnterEvent, QDropEvent  # type: ignore
 from PyQt6.QtWidgets import QApplication, QLabel, QMainWindow  # type: ignore
 
+from zcmds.util.ffmpeg_runner import FfmpegResult, format_seconds, run_ffmpeg
+from zcmds.util.media import ffprobe, get_stream
 from zcmds.util.say import say
 
 
@@ -27,53 +30,237 @@ class VidInfo:
     filetype: str = "mp4"
 
 
+HLS_SEGMENT_SECONDS = 4
+
+
+@dataclass
+class RenditionTiming:
+    name: str
+    pass1: FfmpegResult
+    pass2: Optional[FfmpegResult] = None
+
+    @property
+    def wall_time(self) -> float:
+        return self.pass1.wall_time + (self.pass2.wall_time if self.pass2 else 0.0)
+
+    @property
+    def cpu_time(self) -> Optional[float]:
+        times = [r.cpu_time for r in (self.pass1, self.pass2) if r is not None]
+        if not times or None in times:
+            return None
+        return sum(t for t in times if t is not None)
+
+    @property
+    def ok(self) -> bool:
+        # Single pass jobs (hls) have no second pass.
+        return self.pass1.ok and (self.pass2 is None or self.pass2.ok)
+
+
 def get_encoder(filetype: str) -> str:
-    if filetype == "mp4":
+    if filetype in ("mp4", "hls"):
         return "libx264"
     if filetype == "webm":
         return "libvpx-vp9"
     raise ValueError(f"Unknown filetype: {filetype}")
 
 
-def encode(videopath: str, vidinfos: list[VidInfo]) -> None:
+def get_out_path(videopath: str, vidinfo: VidInfo) -> str:
+    path, _ = os.path.splitext(videopath)
+    bitrate_str = vidinfo.vidbitrate.replace(".", "_")
+    return os.path.join(path, f"{vidinfo.height}_{bitrate_str}.{vidinfo.filetype}")
+
+
+def build_encode_cmds(
+    videopath: str,
+    vidinfos: list[VidInfo],
+    passlogdir: str,
+    threads: Optional[int] = None,
+) -> tuple[list[str], list[str]]:
+    """
+    Builds the two-pass commands for all renditions. The source is decoded once
+    per pass and split into one scaled branch per rendition. Each rendition
+    keeps its own passlog because first pass stats are resolution specific.
+    """
+    # trunc(oh*...) fixes issue with libx264 encoder not liking an add number of width pixels.
+    scales = [f"scale=trunc(oh*a/2)*2:{v.height}" for v in vidinfos]
+    if len(vidinfos) == 1:
+        graph = f"[0:v]{scales[0]}[v0]"
+    else:
+        split = "".join(f"[s{i}]" for i in range(len(vidinfos)))
+        graph = f"[0:v]split={len(vidinfos)}{split}"
+        graph += "".join(f";[s{i}]{scale}[v{i}]" for i, scale in enumerate(scales))
+    cmd_1stpass = ["static_ffmpeg", "-y", "-i", videopath, "-filter_complex", graph]
+    cmd_2ndpass = list(cmd_1stpass)
+    for i, vidinfo in enumerate(vidinfos):
+        video_args = ["-map", f"[v{i}]", "-preset", "veryslow"]
+        video_args += ["-c:v", get_encoder(vidinfo.filetype)]
+        video_args += ["-b:v", vidinfo.vidbitrate]
+        video_args += ["-passlogfile", os.path.join(passlogdir, f"rendition{i}")]
+        if threads:
+            video_args += ["-threads", str(threads)]
+        # ffmpeg names passlogs by global stream index, so the first pass maps
+        # (and cheaply copies) the audio too to keep the indices of both passes equal.
+        cmd_1stpass += video_args + ["-pass", "1", "-map", "0:a?", "-c:a", "copy"]
+        cmd_1stpass += ["-f", "null", os.devnull]
+        cmd_2ndpass += video_args + ["-pass", "2", "-map", "0:a?"]
+        if vidinfo.height <= 480:
+            cmd_2ndpass += ["-ac", "1"]
+        if vidinfo.fast_start and vidinfo.filetype == "mp4":
+            cmd_2ndpass += ["-movflags", "+faststart"]
+        cmd_2ndpass.append(get_out_path(videopath, vidinfo))
+    return cmd_1stpass, cmd_2ndpass
+
+
+def parse_bitrate(bitrate: str) -> int:
+    """Parses ffmpeg style bitrates like "3.0M" or "900k" to bits per second."""
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = bitrate[-1:].lower()
+    if suffix in multipliers:
+        return int(float(bitrate[:-1]) * multipliers[suffix])
+    return int(float(bitrate))
+
+
+def get_hls_dir(videopath: str) -> str:
+    path, _ = os.path.splitext(videopath)
+    return os.path.join(path, "hls")
+
+
+def build_hls_cmd(
+    videopath: str,
+    vidinfos: list[VidInfo],
+    has_audio: bool,
+    segment_seconds: int = HLS_SEGMENT_SECONDS,
+) -> list[str]:
+    """
+    Builds a single pass command that writes an fMP4 HLS ladder with a master
+    playlist. Keyframes are forced on the segment boundaries of every rendition
+    so players can switch renditions at any segment.
+    """
+    hls_dir = get_hls_dir(videopath)
+    cmd, _ = build_encode_cmds(videopath, vidinfos, passlogdir="")
+    # Keep the input and split/scale graph, the outputs are rebuilt below.
+    cmd = cmd[: cmd.index("-filter_complex") + 2]
+    stream_map: list[str] = []
+    for i, vidinfo in enumerate(vidinfos):
+        bitrate = parse_bitrate(vidinfo.vidbitrate)
+        cmd += ["-map", f"[v{i}]", f"-c:v:{i}", get_encoder(vidinfo.filetype)]
+        cmd += [f"-b:v:{i}", str(bitrate), f"-maxrate:v:{i}", str(bitrate * 3 // 2)]
+        cmd += [f"-bufsize:v:{i}", str(bitrate * 2)]
+        entry = f"v:{i}"
+        if has_audio:
+            cmd += ["-map", "0:a:0", f"-c:a:{i}", "aac", f"-b:a:{i}", "128k"]
+            if vidinfo.height <= 480:
+                cmd += [f"-ac:a:{i}", "1"]
+            entry += f",a:{i}"
+        stream_map.append(f"{entry},name:{vidinfo.height}p")
+    cmd += ["-preset", "veryslow", "-sc_threshold", "0"]
+    cmd += ["-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})"]
+    cmd += ["-f", "hls", "-hls_time", str(segment_seconds)]
+    cmd += ["-hls_playlist_type", "vod", "-hls_segment_type", "fmp4"]
+    cmd += ["-hls_flags", "independent_segments"]
+    cmd += ["-master_pl_name", "master.m3u8"]
+    cmd += ["-var_stream_map", " ".join(stream_map)]
+    cmd += ["-hls_segment_filename", os.path.join(hls_dir, "%v", "seg_%05d.m4s")]
+    cmd.append(os.path.join(hls_dir, "%v", "index.m3u8"))
+    return cmd
+
+
+def _encode_hls(videopath: str, vidinfos: list[VidInfo]) -> list[RenditionTiming]:
+    has_audio = get_stream(ffprobe(videopath), "audio") is not None
+    cmd = build_hls_cmd(videopath, vidinfos, has_audio)
+    print("\nEncoding HLS ladder:")
+    result = run_ffmpeg(cmd, outputs=[])
+    return [RenditionTiming(name="hls ladder", pass1=result)]
+
+
+def _encode_together(
+    videopath: str, vidinfos: list[VidInfo], tmpdir: str
+) -> list[RenditionTiming]:
+    out_paths = [get_out_path(videopath, v) for v in vidinfos]
+    cmd_1stpass, cmd_2ndpass = build_encode_cmds(videopath, vidinfos, tmpdir)
+    print("\nRunning first pass:")
+    timing = RenditionTiming(
+        name="all renditions", pass1=run_ffmpeg(cmd_1stpass, outputs=[])
+    )
+    if timing.pass1.ok:
+        print("\nRunning second pass:")
+        timing.pass2 = run_ffmpeg(cmd_2ndpass, outputs=out_paths)
+    return [timing]
+
+
+def _encode_parallel(
+    videopath: str, vidinfos: list[VidInfo], tmpdir: str
+) -> list[RenditionTiming]:
+    """Runs every rendition as its own two-pass job, all at the same time."""
+    threads = max(1, (os.cpu_count() or 1) // len(vidinfos))
+    print(f"\nEncoding {len(vidinfos)} renditions in parallel, {threads} threads each")
+
+    def encode_one(index: int) -> RenditionTiming:
+        vidinfo = vidinfos[index]
+        passlogdir = os.path.join(tmpdir, str(index))
+        os.makedirs(passlogdir, exist_ok=True)
+        cmd_1stpass, cmd_2ndpass = build_encode_cmds(
+            videopath, [vidinfo], passlogdir, threads=threads
+        )
+        name = os.path.basename(get_out_path(videopath, vidinfo))
+        timing = RenditionTiming(
+            name=name, pass1=run_ffmpeg(cmd_1stpass, outputs=[], quiet=True)
+        )
+        if timing.pass1.ok:
+            timing.pass2 = run_ffmpeg(cmd_2ndpass, quiet=True)
+        failed = timing.pass2 or timing.pass1
+        if timing.ok:
+            print(f"  {name} done in {format_seconds(timing.wall_time)}")
+        else:
+            print(f"  {name} failed:\n{failed.stderr}")
+        return timing
+
+    with ThreadPoolExecutor(max_workers=len(vidinfos)) as executor:
+        return list(executor.map(encode_one, range(len(vidinfos))))
+
+
+def print_timing_summary(timings: list[RenditionTiming]) -> None:
+    rows = [["RENDITION", "PASS 1", "PASS 2", "TOTAL", "CPU", "SPEED"]]
+    for t in timings:
+        duration = t.pass1.media_duration
+        speed = f"{duration / t.wall_time:.2f}x" if duration and t.wall_time else "-"
+        rows.append(
+            [
+                t.name,
+                format_seconds(t.pass1.wall_time),
+                format_seconds(t.pass2.wall_time) if t.pass2 else "-",
+                format_seconds(t.wall_time),
+                format_seconds(t.cpu_time) if t.cpu_time is not None else "-",
+                speed if t.ok else "FAILED",
+            ]
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print("\nTiming summary:")
+    for row in rows:
+        print("  " + "  ".join(c.ljust(w) for c, w in zip(row, widths)))
+
+
+def encode(videopath: str, vidinfos: list[VidInfo], parallel: bool = False) -> bool:
     path, _ = os.path.splitext(videopath)
     os.makedirs(path, exist_ok=True)
+    out_paths = [get_out_path(videopath, v) for v in vidinfos]
+    if vidinfos and vidinfos[0].filetype == "hls":
+        out_paths = [os.path.join(get_hls_dir(videopath), "master.m3u8")]
     with tempfile.TemporaryDirectory() as tmpdir:
-        passlogfile = os.path.join(tmpdir, "ffmpeg2pass-0.log")
-        for vidinfo in vidinfos:
-            height = vidinfo.height
-            vidbitrate = vidinfo.vidbitrate
-            encoder = get_encoder(vidinfo.filetype)
-            bitrate_str = vidbitrate.replace(".", "_")
-            ext = vidinfo.filetype
-            out_path = os.path.join(path, f"{height}_{bitrate_str}.{ext}")
-            downmix_stmt = "-ac 1" if height <= 480 else ""
-            # trunc(oh*...) fixes issue with libx264 encoder not liking an add number of width pixels.
-            null_stm: str = "/dev/null" if platform.system() != "Windows" else "NUL"
-            movflags_stmt = "-movflags +faststart" if vidinfo.fast_start else ""
-            cmd_1stpass = (
-                f'static_ffmpeg -y -hide_banner -v quiet -stats -i "{videopath}"'
-                f' -vf scale="trunc(oh*a/2)*2:{height}" {downmix_stmt}'
-                f" {movflags_stmt} -preset veryslow -c:v {encoder}"
-                f" -an -passlogfile {passlogfile} -pass 1 -f null {null_stm}"
-                f' -b:v {vidbitrate} "{out_path}"'
-            )
-            cmd_2ndpass = (
-                f'static_ffmpeg -y -hide_banner -v quiet -stats -i "{videopath}"'
-                f' -vf scale="trunc(oh*a/2)*2:{height}" {downmix_stmt}'
-                f" {movflags_stmt} -preset veryslow -c:v {encoder}"
-                f" -passlogfile {passlogfile}"
-                f' -pass 2 -b:v {vidbitrate} "{out_path}"'
-            )
-            print(f"\nRunning first pass:\n  {cmd_1stpass}\n")
-            proc = subprocess.Popen(cmd_1stpass, shell=True)
-            proc.wait()
-            print(f"\nRunning second pass:\n  {cmd_2ndpass}\n")
-            proc = subprocess.Popen(cmd_2ndpass, shell=True)
-            proc.wait()
-            print(
-                f"\n########################\n# Generated file:\n#  {out_path}\n########################"
-            )
+        if out_paths[0].endswith(".m3u8"):
+            timings = _encode_hls(videopath, vidinfos)
+        elif parallel and len(vidinfos) > 1:
+            timings = _encode_parallel(videopath, vidinfos, tmpdir)
+        else:
+            timings = _encode_together(videopath, vidinfos, tmpdir)
+    print_timing_summary(timings)
+    if not all(t.ok for t in timings):
+        return False
+    generated = "\n".join(f"#  {p}" for p in out_paths)
+    print(
+        f"\n########################\n# Generated files:\n{generated}\n########################"
+    )
+    return True
 
 
 class MainWidget(QMainWindow):
@@ -111,8 +298,10 @@ def open_folder(path: str) -> None:
         subprocess.Popen(["xdg-open", path])
 
 
-def run_gui(vidinfos: list[VidInfo]) -> None:
+def run_gui(vidinfos: list[VidInfo], parallel: bool = False, max_jobs: int = 1) -> None:
     app = QApplication(sys.argv)
+    # Every drop gets a thread, but only max_jobs files encode at once.
+    encode_slots = BoundedSemaphore(max(1, max_jobs))
 
     def callback(videofile: str) -> None:
         path, _ = os.path.splitext(videofile)  # type: ignore
@@ -121,8 +310,17 @@ def run_gui(vidinfos: list[VidInfo]) -> None:
 
         # Open folder in the OS
         def _encode_then_beep():
-            encode(videofile, vidinfos=vidinfos)
-            say("Attention: Video Encoding Complete")
+            if not encode_slots.acquire(blocking=False):
+                print(f"Waiting for a free encode slot: {videofile}")
+                encode_slots.acquire()
+            try:
+                ok = encode(videofile, vidinfos=vidinfos, parallel=parallel)
+            finally:
+                encode_slots.release()
+            if ok:
+                say("Attention: Video Encoding Complete")
+            else:
+                say("Attention: Video Encoding Failed")
 
         Thread(target=_encode_then_beep, daemon=True).start()
 
@@ -161,23 +359,43 @@ def main():
         "--no-fast-start", help="Add fast start flag", action="store_true"
     )
     parser.add_argument(
-        "--type", help="mp4 or webm", default="mp4", choices=["mp4", "webm"]
+        "--type",
+        help="mp4, webm or hls (fMP4 segments with a master playlist)",
+        default="mp4",
+        choices=["mp4", "webm", "hls"],
+    )
+    parser.add_argument(
+        "--parallel",
+        help="Encode the renditions as separate processes at the same time",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-jobs",
+        help="GUI mode: number of dropped files encoded at the same time",
+        type=int,
+        default=1,
     )
     args = parser.parse_args()
+    if args.parallel and args.type == "hls":
+        parser.error(
+            "--parallel can't be used with --type hls, hls encodes every rendition"
+            " in one ffmpeg"
+        )
     fast_start = not args.no_fast_start
     vidinfos = parse_vidinfos(args.encodings, fast_start=fast_start)
     for vidinfo in vidinfos:
         vidinfo.filetype = args.type
     # sort by smallest first
     if not args.video_path:
-        run_gui(vidinfos=vidinfos)
+        run_gui(vidinfos=vidinfos, parallel=args.parallel, max_jobs=args.max_jobs)
         return
     videopath = args.video_path
     if not os.path.exists(videopath):
         print(f"{videopath} does not exist")
         sys.exit(1)
 
-    encode(videopath=args.video_path, vidinfos=vidinfos)
+    if not encode(videopath=args.video_path, vidinfos=vidinfos, parallel=args.parallel):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
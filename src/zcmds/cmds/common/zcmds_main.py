@@ -28,6 +28,10 @@ WIN32 = [
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "queue":
+        from zcmds.util.encode_queue import main as queue_main
+
+        return queue_main(sys.argv[2:])
     cmds = COMMON
     cmds = sorted(cmds)
     print("zcmds:")
@@ -41,4 +45,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
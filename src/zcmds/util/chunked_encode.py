@@ -0,0 +1,136 @@
+"""
+Chunked parallel encoding.
+
+x264 at the slow presets stops scaling after a handful of threads, so a single
+ffmpeg process leaves most of a big machine idle. Instead the source is split
+at keyframes with a stream copy, the chunks are encoded by parallel ffmpeg
+processes and the results are concatenated with a stream copy. Audio is taken
+from the source in the final step so it stays continuous.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from zcmds.util.ffmpeg_runner import FfmpegResult, format_seconds, run_ffmpeg
+from zcmds.util.media import ffprobe, get_duration, get_stream
+
+
+# Chunks shorter than this cost more in process startup and GOP overhead than
+# they gain in parallelism.
+MIN_CHUNK_SECONDS = 10.0
+
+
+def split_times(duration: float, chunks: int) -> list[float]:
+    """Evenly spaced split points. The segment muxer snaps them to keyframes."""
+    chunks = max(1, min(chunks, int(duration // MIN_CHUNK_SECONDS) or 1))
+    return [round(duration * i / chunks, 3) for i in range(1, chunks)]
+
+
+def _write_concat_list(path: str, files: list[str]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for file in files:
+            escaped = os.path.abspath(file).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def encode_chunked(
+    infile: str,
+    out_path: str,
+    video_args: list[str],
+    audio_args: list[str],
+    chunks: int,
+    output_args: Optional[list[str]] = None,
+) -> bool:
+    """
+    Encodes infile to out_path using chunks parallel ffmpeg processes.
+
+    Args:
+        video_args: Video filter and codec args applied to every chunk, e.g.
+            ["-vf", "scale=...", "-c:v", "libx264", "-preset", "veryslow"].
+        audio_args: Audio args used when muxing the source audio, e.g.
+            ["-c:a", "copy"] or ["-ac", "1"].
+        output_args: Extra args for the final mux, e.g. ["-movflags", "+faststart"].
+    Returns:
+        True if out_path was generated.
+    """
+    info = ffprobe(infile)
+    duration = get_duration(info)
+    if not duration or get_stream(info, "video") is None:
+        print(f"Can't chunk {infile}, encoding in a single pass")
+        return _encode_single(infile, out_path, video_args, audio_args, output_args)
+    times = split_times(duration, chunks)
+    if not times:
+        return _encode_single(infile, out_path, video_args, audio_args, output_args)
+
+    start = time.time()
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    # Keep the chunks on the same disk as the output, they can be large.
+    with tempfile.TemporaryDirectory(prefix=".chunks_", dir=out_dir) as tmpdir:
+        print(f"Splitting {infile} into {len(times) + 1} chunks at keyframes")
+        split_cmd = ["static_ffmpeg", "-y", "-i", infile, "-map", "0:v:0", "-an"]
+        split_cmd += ["-c", "copy", "-f", "segment", "-reset_timestamps", "1"]
+        split_cmd += ["-segment_times", ",".join(str(t) for t in times)]
+        split_cmd.append(os.path.join(tmpdir, "src_%04d.mkv"))
+        if not run_ffmpeg(split_cmd, outputs=[], quiet=True).ok:
+            print("Splitting failed")
+            return False
+        sources = sorted(
+            os.path.join(tmpdir, f) for f in os.listdir(tmpdir) if f.startswith("src_")
+        )
+        threads = max(1, (os.cpu_count() or 1) // len(sources))
+        encoded = [
+            os.path.join(tmpdir, os.path.basename(p).replace("src_", "enc_", 1))
+            for p in sources
+        ]
+        cancel_event = threading.Event()
+
+        def encode_one(index: int) -> FfmpegResult:
+            cmd = ["static_ffmpeg", "-y", "-i", sources[index]] + video_args
+            cmd += ["-threads", str(threads), encoded[index]]
+            result = run_ffmpeg(cmd, quiet=True, cancel_event=cancel_event)
+            status = "done" if result.ok else f"failed ({result.returncode})"
+            print(
+                f"  chunk {index + 1}/{len(sources)} {status} in"
+                f" {format_seconds(result.wall_time)}"
+            )
+            if not result.ok:
+                print(result.stderr)
+            return result
+
+        print(f"Encoding {len(sources)} chunks with {threads} threads each")
+        with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+            futures = [executor.submit(encode_one, i) for i in range(len(sources))]
+            try:
+                results = [f.result() for f in futures]
+            except KeyboardInterrupt:
+                cancel_event.set()
+                raise
+        if not all(r.ok for r in results):
+            return False
+
+        concat_list = os.path.join(tmpdir, "concat.txt")
+        _write_concat_list(concat_list, encoded)
+        cmd = ["static_ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list]
+        cmd += ["-i", infile, "-map", "0:v:0", "-map", "1:a?", "-c:v", "copy"]
+        cmd += audio_args + (output_args or []) + [out_path]
+        result = run_ffmpeg(cmd, duration=duration)
+    if not result.ok:
+        return False
+    print(f"Chunked encode finished in {format_seconds(time.time() - start)}")
+    return os.path.exists(out_path)
+
+
+def _encode_single(
+    infile: str,
+    out_path: str,
+    video_args: list[str],
+    audio_args: list[str],
+    output_args: Optional[list[str]],
+) -> bool:
+    cmd = ["static_ffmpeg", "-y", "-i", infile] + video_args + audio_args
+    cmd += (output_args or []) + [out_path]
+    return run_ffmpeg(cmd).ok
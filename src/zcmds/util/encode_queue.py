@@ -0,0 +1,593 @@
+"""
+Persistent local encode queue backed by SQLite.
+
+Commands submit argv lists with a priority and a thread budget. A single
+daemon process runs the jobs, keeping the sum of the running jobs' threads at
+or below the core count. Jobs are stored on disk, so a killed daemon (or a
+reboot) picks the unfinished work back up on the next start.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional, Sequence, cast
+
+import psutil
+from appdirs import user_data_dir  # type: ignore
+
+from zcmds.util.ffmpeg_runner import (
+    FfmpegProgress,
+    format_cmd,
+    format_seconds,
+    run_ffmpeg,
+)
+from zcmds.util.process import launch_detached
+
+
+QUEUE_DB_ENV = "ZCMDS_QUEUE_DB"
+QUEUE_DB_NAME = "encode_queue.sqlite3"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+_FFMPEG_NAMES = {"ffmpeg", "static_ffmpeg"}
+_HEARTBEAT_TIMEOUT = 15.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cmd TEXT NOT NULL,
+    cwd TEXT NOT NULL,
+    label TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    threads INTEGER NOT NULL DEFAULT 1,
+    status TEXT NOT NULL,
+    progress REAL,
+    returncode INTEGER,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS daemon (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    pid INTEGER NOT NULL,
+    heartbeat REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class QueueJob:
+    id: int
+    cmd: list[str]
+    cwd: str
+    label: str
+    priority: int
+    threads: int
+    status: str
+    progress: Optional[float]
+    returncode: Optional[int]
+    cancel_requested: bool
+    created: float
+    started: Optional[float]
+    finished: Optional[float]
+
+
+def cpu_count() -> int:
+    return os.cpu_count() or 1
+
+
+def default_job_threads() -> int:
+    """
+    Threads given to a job when the submitter doesn't say. x264 and vp9 scale
+    poorly past ~8 threads, so big machines run more jobs side by side instead.
+    """
+    return max(1, min(8, cpu_count() // 2))
+
+
+def get_queue_db_path() -> Path:
+    env_path = os.environ.get(QUEUE_DB_ENV)
+    if env_path:
+        return Path(env_path)
+    data_dir = cast(str, user_data_dir("zcmds", "zcmds"))
+    return Path(data_dir) / QUEUE_DB_NAME
+
+
+def with_threads(cmd: Sequence[str], threads: int) -> list[str]:
+    """Adds -threads before the output of an ffmpeg command that lacks one."""
+    out = [str(c) for c in cmd]
+    if Path(out[0]).stem in _FFMPEG_NAMES and "-threads" not in out:
+        out = out[:-1] + ["-threads", str(threads)] + out[-1:]
+    return out
+
+
+def _set_threads(cmd: list[str], threads: int) -> list[str]:
+    """Lowers the -threads of an ffmpeg command to threads."""
+    out = list(cmd)
+    if Path(out[0]).stem in _FFMPEG_NAMES and "-threads" in out:
+        index = out.index("-threads") + 1
+        if index < len(out) and out[index].isdigit() and int(out[index]) > threads:
+            out[index] = str(threads)
+    return out
+
+
+class EncodeQueue:
+    """Thin wrapper around the queue database, safe to use from many processes."""
+
+    def __init__(self, db_path: Optional[Path] = None) -> None:
+        self.db_path = db_path or get_queue_db_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> QueueJob:
+        return QueueJob(
+            id=row["id"],
+            cmd=json.loads(row["cmd"]),
+            cwd=row["cwd"],
+            label=row["label"],
+            priority=row["priority"],
+            threads=row["threads"],
+            status=row["status"],
+            progress=row["progress"],
+            returncode=row["returncode"],
+            cancel_requested=bool(row["cancel_requested"]),
+            created=row["created"],
+            started=row["started"],
+            finished=row["finished"],
+        )
+
+    def submit(
+        self,
+        cmd: Sequence[str | Path],
+        priority: int = 0,
+        threads: Optional[int] = None,
+        cwd: Optional[str] = None,
+        label: Optional[str] = None,
+    ) -> int:
+        """Adds a job and returns its id. Higher priority runs first."""
+        if not cmd:
+            raise ValueError("Command list cannot be empty")
+        threads = max(1, min(threads or default_job_threads(), cpu_count()))
+        argv = with_threads([str(c) for c in cmd], threads)
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (cmd, cwd, label, priority, threads, status, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    json.dumps(argv),
+                    cwd or os.getcwd(),
+                    label or argv[-1],
+                    priority,
+                    threads,
+                    STATUS_QUEUED,
+                    time.time(),
+                ),
+            )
+            return cast(int, cur.lastrowid)
+
+    def jobs(self, statuses: Optional[list[str]] = None) -> list[QueueJob]:
+        query = "SELECT * FROM jobs"
+        params: list[Any] = []
+        if statuses:
+            query += f" WHERE status IN ({','.join('?' for _ in statuses)})"
+            params = list(statuses)
+        query += " ORDER BY id"
+        with self._connect() as conn:
+            return [self._to_job(row) for row in conn.execute(query, params)]
+
+    def get(self, job_id: int) -> Optional[QueueJob]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def claim_next(
+        self, free_threads: int, max_threads: Optional[int] = None
+    ) -> Optional[QueueJob]:
+        """
+        Atomically moves the best queued job that fits free_threads to running.
+        Jobs submitted with more threads than the daemon's max_threads are
+        clamped to it, otherwise they would never fit and wait forever.
+        """
+        cap = max_threads or cpu_count()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND MIN(threads, ?) <= ?"
+                " ORDER BY priority DESC, id ASC LIMIT 1",
+                (STATUS_QUEUED, cap, free_threads),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, started = ?, progress = NULL WHERE id = ?",
+                (STATUS_RUNNING, time.time(), row["id"]),
+            )
+            conn.execute("COMMIT")
+        job = self._to_job(row)
+        job.status = STATUS_RUNNING
+        if job.threads > cap:
+            job.threads = cap
+            job.cmd = _set_threads(job.cmd, cap)
+        return job
+
+    def set_progress(self, job_id: int, percent: Optional[float]) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (percent, job_id))
+
+    def finish(self, job_id: int, returncode: int, cancelled: bool = False) -> None:
+        status = STATUS_DONE if returncode == 0 else STATUS_FAILED
+        if cancelled:
+            status = STATUS_CANCELLED
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, returncode = ?, finished = ? WHERE id = ?",
+                (status, returncode, time.time(), job_id),
+            )
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancels a queued job now, or asks the daemon to stop a running one."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+                (STATUS_CANCELLED, time.time(), job_id, STATUS_QUEUED),
+            )
+            if cur.rowcount:
+                return True
+            cur = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                (job_id, STATUS_RUNNING),
+            )
+            return bool(cur.rowcount)
+
+    def retry(self, job_id: int) -> bool:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, returncode = NULL, progress = NULL,"
+                " cancel_requested = 0, started = NULL, finished = NULL"
+                " WHERE id = ? AND status IN (?, ?)",
+                (STATUS_QUEUED, job_id, STATUS_FAILED, STATUS_CANCELLED),
+            )
+            return bool(cur.rowcount)
+
+    def clear_finished(self) -> int:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?)",
+                (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED),
+            )
+            return cur.rowcount
+
+    def requeue_running(self) -> int:
+        """Puts jobs left running by a dead daemon back in the queue."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, started = NULL, progress = NULL"
+                " WHERE status = ?",
+                (STATUS_QUEUED, STATUS_RUNNING),
+            )
+            return cur.rowcount
+
+    def cancel_requested_ids(self) -> set[int]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND cancel_requested = 1",
+                (STATUS_RUNNING,),
+            ).fetchall()
+        return {row["id"] for row in rows}
+
+    def daemon_pid(self) -> Optional[int]:
+        """Returns the pid of a live daemon, if any."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT pid, heartbeat FROM daemon").fetchone()
+        if row is None:
+            return None
+        if time.time() - row["heartbeat"] > _HEARTBEAT_TIMEOUT:
+            return None
+        if not psutil.pid_exists(row["pid"]):
+            return None
+        return row["pid"]
+
+    def try_register_daemon(self, pid: int) -> bool:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT pid, heartbeat FROM daemon").fetchone()
+            alive = (
+                row is not None
+                and row["pid"] != pid
+                and time.time() - row["heartbeat"] <= _HEARTBEAT_TIMEOUT
+                and psutil.pid_exists(row["pid"])
+            )
+            if not alive:
+                conn.execute(
+                    "INSERT OR REPLACE INTO daemon (id, pid, heartbeat) VALUES (0, ?, ?)",
+                    (pid, time.time()),
+                )
+            conn.execute("COMMIT")
+        return not alive
+
+    def heartbeat(self, pid: int) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE daemon SET heartbeat = ? WHERE pid = ?", (time.time(), pid)
+            )
+
+    def unregister_daemon(self, pid: int) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM daemon WHERE pid = ?", (pid,))
+
+    def unregister_if_idle(self, pid: int) -> bool:
+        """
+        Unregisters the daemon if nothing is queued, in one transaction. A job
+        submitted before this sees the daemon still running and gets run, one
+        submitted after sees no daemon and starts a new one.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT COUNT(*) AS queued FROM jobs WHERE status = ?",
+                (STATUS_QUEUED,),
+            ).fetchone()
+            idle = row["queued"] == 0
+            if idle:
+                conn.execute("DELETE FROM daemon WHERE pid = ?", (pid,))
+            conn.execute("COMMIT")
+        return idle
+
+
+def _run_job(
+    queue: EncodeQueue,
+    job: QueueJob,
+    cancel_event: threading.Event,
+    shutdown_event: threading.Event,
+) -> None:
+    """
+    Runs one job and records how it ended. A job stopped because the daemon
+    is shutting down is left running, for requeue_running to put it back.
+    """
+    last_update = 0.0
+
+    def on_progress(progress: FfmpegProgress) -> None:
+        nonlocal last_update
+        now = time.time()
+        if now - last_update > 2.0 or progress.done:
+            last_update = now
+            queue.set_progress(job.id, progress.percent)
+
+    try:
+        if Path(job.cmd[0]).stem in _FFMPEG_NAMES:
+            result = run_ffmpeg(
+                job.cmd,
+                on_progress=on_progress,
+                cancel_event=cancel_event,
+                quiet=True,
+                cwd=job.cwd,
+            )
+            if result.cancelled and shutdown_event.is_set():
+                return
+            queue.finish(job.id, result.returncode, cancelled=result.cancelled)
+            return
+        proc = subprocess.Popen(job.cmd, cwd=job.cwd)
+        while proc.poll() is None:
+            if cancel_event.wait(0.5):
+                proc.terminate()
+                proc.wait()
+                if not shutdown_event.is_set():
+                    queue.finish(job.id, proc.returncode, cancelled=True)
+                return
+        queue.finish(job.id, proc.returncode)
+    except Exception as ex:  # pylint: disable=broad-except
+        sys.stderr.write(f"Job {job.id} crashed: {ex}\n")
+        queue.finish(job.id, -1)
+
+
+def run_daemon(
+    queue: EncodeQueue,
+    max_threads: Optional[int] = None,
+    poll_interval: float = 1.0,
+    exit_when_idle: bool = False,
+) -> int:
+    """Runs queued jobs until interrupted (or until idle with exit_when_idle)."""
+    pid = os.getpid()
+    if not queue.try_register_daemon(pid):
+        print(f"Encode queue daemon already running (pid {queue.daemon_pid()})")
+        return 1
+    max_threads = max_threads or cpu_count()
+    requeued = queue.requeue_running()
+    if requeued:
+        print(f"Resuming {requeued} interrupted job(s)")
+    print(f"Encode queue daemon {pid} running with {max_threads} threads")
+    running: dict[int, tuple[QueueJob, threading.Thread, threading.Event]] = {}
+    shutdown_event = threading.Event()
+    try:
+        while True:
+            queue.heartbeat(pid)
+            for job_id in list(running):
+                if not running[job_id][1].is_alive():
+                    del running[job_id]
+            for job_id in queue.cancel_requested_ids():
+                if job_id in running:
+                    running[job_id][2].set()
+            used = sum(job.threads for job, _, _ in running.values())
+            job = queue.claim_next(max_threads - used, max_threads)
+            if job is not None:
+                print(f"Starting job {job.id}: {format_cmd(job.cmd)}")
+                event = threading.Event()
+                thread = threading.Thread(
+                    target=_run_job,
+                    args=(queue, job, event, shutdown_event),
+                    daemon=True,
+                )
+                thread.start()
+                running[job.id] = (job, thread, event)
+                continue
+            if exit_when_idle and not running and queue.unregister_if_idle(pid):
+                return 0
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopping encode queue daemon, running jobs will resume on restart")
+        shutdown_event.set()
+        for _, thread, event in running.values():
+            event.set()
+            thread.join(timeout=10)
+        # Interrupted jobs go back in the queue instead of showing as cancelled.
+        queue.requeue_running()
+        return 1
+    finally:
+        queue.unregister_daemon(pid)
+
+
+def ensure_daemon(queue: EncodeQueue) -> None:
+    """
+    Starts a detached daemon, which exits once the queue drains, if none is
+    running. Call it after the job is submitted: a daemon only exits through
+    unregister_if_idle, so one still registered here is bound to see the job.
+    """
+    if queue.daemon_pid() is not None:
+        return
+    cmd: list[str | Path] = [sys.executable, "-m", "zcmds.util.encode_queue"]
+    env_db = os.environ.get(QUEUE_DB_ENV)
+    if env_db:
+        cmd += ["--db", env_db]
+    cmd += ["daemon", "--exit-when-idle"]
+    launch_detached(cmd)
+
+
+def submit_and_start(
+    cmd: Sequence[str | Path],
+    priority: int = 0,
+    threads: Optional[int] = None,
+    label: Optional[str] = None,
+) -> int:
+    """Submits a job, starts the daemon if needed and returns the job id."""
+    queue = EncodeQueue()
+    job_id = queue.submit(cmd, priority=priority, threads=threads, label=label)
+    ensure_daemon(queue)
+    return job_id
+
+
+def format_status(jobs: list[QueueJob]) -> str:
+    headers = ["ID", "STATUS", "PRI", "THR", "PROGRESS", "ELAPSED", "JOB"]
+    lines: list[list[str]] = [headers]
+    now = time.time()
+    for job in jobs:
+        progress = "-"
+        if job.status == STATUS_RUNNING and job.progress is not None:
+            progress = f"{job.progress:.1f}%"
+        elif job.status == STATUS_DONE:
+            progress = "100%"
+        elif job.status == STATUS_FAILED:
+            progress = f"rc={job.returncode}"
+        elapsed = "-"
+        if job.started:
+            elapsed = format_seconds((job.finished or now) - job.started)
+        lines.append(
+            [
+                str(job.id),
+                job.status,
+                str(job.priority),
+                str(job.threads),
+                progress,
+                elapsed,
+                job.label,
+            ]
+        )
+    widths = [max(len(line[i]) for line in lines) for i in range(len(headers) - 1)]
+    return "\n".join(
+        "  ".join([c.ljust(widths[i]) for i, c in enumerate(line[:-1])] + [line[-1]])
+        for line in lines
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="zcmds queue", description="Persistent local encode queue."
+    )
+    parser.add_argument("--db", help="queue database path", default=None)
+    sub = parser.add_subparsers(dest="action")
+    status = sub.add_parser("status", help="show jobs (default)")
+    status.add_argument("--all", action="store_true", help="include finished jobs")
+    daemon = sub.add_parser("daemon", help="run jobs in the foreground")
+    daemon.add_argument("--threads", type=int, help="total thread budget")
+    daemon.add_argument("--exit-when-idle", action="store_true")
+    sub.add_parser("start", help="start a detached daemon")
+    submit = sub.add_parser(
+        "submit", help="queue a command: submit -- static_ffmpeg ..."
+    )
+    submit.add_argument("--priority", type=int, default=0)
+    submit.add_argument("--threads", type=int, default=None)
+    submit.add_argument("cmd", nargs=argparse.REMAINDER)
+    cancel = sub.add_parser("cancel", help="cancel a job")
+    cancel.add_argument("job_id", type=int)
+    retry = sub.add_parser("retry", help="re-queue a failed or cancelled job")
+    retry.add_argument("job_id", type=int)
+    sub.add_parser("clear", help="remove finished jobs")
+    args = parser.parse_args(argv)
+    if args.db:
+        os.environ[QUEUE_DB_ENV] = args.db
+    queue = EncodeQueue(Path(args.db) if args.db else None)
+    action = args.action or "status"
+    if action == "daemon":
+        return run_daemon(
+            queue, max_threads=args.threads, exit_when_idle=args.exit_when_idle
+        )
+    if action == "start":
+        ensure_daemon(queue)
+        return 0
+    if action == "submit":
+        cmd: list[str] = [c for c in args.cmd if c != "--"]
+        if not cmd:
+            print("No command given")
+            return 1
+        job_id = queue.submit(cmd, priority=args.priority, threads=args.threads)
+        ensure_daemon(queue)
+        print(f"Queued job {job_id}")
+        return 0
+    if action == "cancel":
+        ok = queue.cancel(args.job_id)
+        print(f"Cancelled job {args.job_id}" if ok else f"Job {args.job_id} not active")
+        return 0 if ok else 1
+    if action == "retry":
+        ok = queue.retry(args.job_id)
+        print(
+            f"Re-queued job {args.job_id}" if ok else f"Job {args.job_id} not retryable"
+        )
+        if ok:
+            ensure_daemon(queue)
+        return 0 if ok else 1
+    if action == "clear":
+        print(f"Removed {queue.clear_finished()} finished job(s)")
+        return 0
+    show_all = getattr(args, "all", False)
+    statuses = None if show_all else [STATUS_QUEUED, STATUS_RUNNING]
+    jobs = queue.jobs(statuses)
+    pid = queue.daemon_pid()
+    print(f"Daemon: {'running (pid ' + str(pid) + ')' if pid else 'not running'}")
+    print(f"Queue: {queue.db_path}")
+    if jobs:
+        print(format_status(jobs))
+    else:
+        print("No jobs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,452 @@
+"""
+Runs ffmpeg jobs from argv lists with live progress, cancellation and timing.
+
+Every job is appended as one json line to the job log so encode throughput can
+be compared across machines and settings. The log lives in the zcmds user data
+directory unless ZCMDS_FFMPEG_JOB_LOG points somewhere else.
+"""
+
+import io
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Sequence, cast
+
+from appdirs import user_data_dir  # type: ignore
+
+
+JOB_LOG_ENV = "ZCMDS_FFMPEG_JOB_LOG"
+JOB_LOG_NAME = "ffmpeg_jobs.jsonl"
+
+_FFMPEG_NAMES = {"ffmpeg", "static_ffmpeg"}
+_LOG_LOCK = threading.Lock()
+_BENCH_RE = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s")
+
+
+@dataclass
+class FfmpegProgress:
+    """A snapshot of a running job, parsed from ffmpeg's -progress output."""
+
+    out_time: float = 0.0
+    duration: Optional[float] = None
+    frame: Optional[int] = None
+    fps: Optional[float] = None
+    speed: Optional[float] = None
+    done: bool = False
+
+    @property
+    def percent(self) -> Optional[float]:
+        if not self.duration:
+            return None
+        return min(100.0, 100.0 * self.out_time / self.duration)
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Seconds of wall time left, estimated from the current speed."""
+        if not self.duration or not self.speed:
+            return None
+        return max(0.0, (self.duration - self.out_time) / self.speed)
+
+
+@dataclass
+class FfmpegResult:
+    cmd: list[str]
+    returncode: int
+    wall_time: float
+    cpu_time: Optional[float]
+    input_bytes: int
+    output_bytes: int
+    media_duration: Optional[float]
+    out_time: float = 0.0
+    cancelled: bool = False
+    stderr: str = ""
+    inputs: list[str] = field(default_factory=lambda: [])
+    outputs: list[str] = field(default_factory=lambda: [])
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.cancelled
+
+    @property
+    def speed(self) -> Optional[float]:
+        """Media seconds processed per wall second."""
+        if not self.out_time or self.wall_time <= 0:
+            return None
+        return self.out_time / self.wall_time
+
+
+def get_job_log_path() -> Path:
+    env_path = os.environ.get(JOB_LOG_ENV)
+    if env_path:
+        return Path(env_path)
+    data_dir = cast(str, user_data_dir("zcmds", "zcmds"))
+    return Path(data_dir) / JOB_LOG_NAME
+
+
+def format_cmd(cmd: Sequence[str | Path]) -> str:
+    """Returns a copy-pasteable string for an argv list."""
+    args = [str(c) for c in cmd]
+    if sys.platform == "win32":
+        return subprocess.list2cmdline(args)
+    return shlex.join(args)
+
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def parse_progress_line(line: str, progress: FfmpegProgress) -> bool:
+    """
+    Applies one "key=value" line of -progress output to progress. Returns True
+    when the line ends a progress block.
+    """
+    key, _, value = line.strip().partition("=")
+    value = value.strip()
+    try:
+        if key in ("out_time_us", "out_time_ms") and value != "N/A":
+            # out_time_ms is misnamed by ffmpeg and is also in microseconds.
+            progress.out_time = max(0.0, int(value) / 1_000_000)
+        elif key == "frame":
+            progress.frame = int(value)
+        elif key == "fps":
+            progress.fps = float(value)
+        elif key == "speed" and value.endswith("x"):
+            progress.speed = float(value[:-1])
+    except ValueError:
+        pass
+    if key == "progress":
+        progress.done = value == "end"
+        return True
+    return False
+
+
+def print_progress(progress: FfmpegProgress) -> None:
+    """Default progress printer, rewrites a single console line."""
+    parts: list[str] = []
+    if progress.percent is not None:
+        parts.append(f"{progress.percent:5.1f}%")
+    parts.append(f"time={format_seconds(progress.out_time)}")
+    if progress.fps is not None:
+        parts.append(f"fps={progress.fps:.1f}")
+    if progress.speed is not None:
+        parts.append(f"speed={progress.speed:.2f}x")
+    if progress.eta is not None:
+        parts.append(f"eta={format_seconds(progress.eta)}")
+    end = "\n" if progress.done else ""
+    sys.stdout.write("\r  " + "  ".join(parts) + "   " + end)
+    sys.stdout.flush()
+
+
+def resolve_ffmpeg(exe: str) -> str:
+    """
+    Resolves static_ffmpeg to the real binary so that cancellation signals go
+    to ffmpeg itself rather than the python launcher script.
+    """
+    if exe not in _FFMPEG_NAMES:
+        return exe
+    found = shutil.which("ffmpeg")
+    if found:
+        return found
+    try:
+        from static_ffmpeg import add_paths  # type: ignore
+
+        add_paths(weak=True)
+    except ImportError:
+        pass
+    return shutil.which("ffmpeg") or exe
+
+
+def _strip_options(args: list[str]) -> list[str]:
+    """Drops log level and stats options that would hide the progress output."""
+    out: list[str] = []
+    skip_next = False
+    for arg in args:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in ("-v", "-loglevel"):
+            skip_next = True
+            continue
+        if arg in ("-stats", "-nostats", "-hide_banner"):
+            continue
+        out.append(arg)
+    return out
+
+
+def _find_inputs(args: list[str]) -> list[str]:
+    return [args[i + 1] for i, a in enumerate(args[:-1]) if a == "-i"]
+
+
+def _total_size(paths: list[str]) -> int:
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            continue
+    return total
+
+
+def _probe_duration(path: str) -> Optional[float]:
+    from zcmds.util.media import ffprobe, get_duration
+
+    try:
+        return get_duration(ffprobe(path))
+    except (subprocess.CalledProcessError, ValueError, OSError):
+        return None
+
+
+def _parse_time(value: str) -> Optional[float]:
+    """Parses an ffmpeg time, "[HH:]MM:SS[.m]" or seconds."""
+    seconds = 0.0
+    try:
+        for part in value.split(":"):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        return None
+    return seconds
+
+
+def _option_index(args: list[str], option: str) -> Optional[int]:
+    """Index of the value of the first option in args, or None."""
+    for i, arg in enumerate(args[:-1]):
+        if arg == option:
+            return i + 1
+    return None
+
+
+def _option_time(args: list[str], option: str) -> Optional[float]:
+    index = _option_index(args, option)
+    return None if index is None else _parse_time(args[index])
+
+
+def get_job_duration(args: list[str], cwd: Optional[str] = None) -> Optional[float]:
+    """
+    Media seconds an ffmpeg command produces: its -t, else -to minus -ss,
+    else the probed length of the first input minus -ss. An input -ss resets
+    the timestamps, so an output -to after it already counts from zero.
+    """
+    length = _option_time(args, "-t")
+    if length is not None:
+        return length
+    start = _option_time(args, "-ss") or 0.0
+    end = _option_time(args, "-to")
+    if end is not None:
+        first_input = _option_index(args, "-i") or len(args)
+        ss_index = _option_index(args, "-ss") or 0
+        to_index = _option_index(args, "-to") or 0
+        if (ss_index < first_input) != (to_index < first_input):
+            start = 0.0
+        return max(0.0, end - start)
+    inputs = [os.path.join(cwd or "", p) for p in _find_inputs(args)]
+    if not inputs or not os.path.isfile(inputs[0]):
+        return None
+    total = _probe_duration(inputs[0])
+    return None if total is None else max(0.0, total - start)
+
+
+def append_job_log(result: FfmpegResult) -> None:
+    record = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "cwd": os.getcwd(),
+        "cmd": result.cmd,
+        "returncode": result.returncode,
+        "cancelled": result.cancelled,
+        "wall_time": round(result.wall_time, 3),
+        "cpu_time": result.cpu_time,
+        "media_duration": result.media_duration,
+        "out_time": round(result.out_time, 3),
+        "speed": round(result.speed, 3) if result.speed else None,
+        "inputs": result.inputs,
+        "input_bytes": result.input_bytes,
+        "outputs": result.outputs,
+        "output_bytes": result.output_bytes,
+    }
+    path = get_job_log_path()
+    try:
+        with _LOG_LOCK:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+    except OSError as ex:
+        sys.stderr.write(f"Error writing ffmpeg job log {path}: {ex}\n")
+
+
+def run_ffmpeg(
+    cmd: Sequence[str | Path],
+    duration: Optional[float] = None,
+    outputs: Optional[list[str]] = None,
+    on_progress: Optional[Callable[[FfmpegProgress], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    quiet: bool = False,
+    check: bool = False,
+    cwd: Optional[str] = None,
+    stdin_data: Optional[Iterable[bytes]] = None,
+) -> FfmpegResult:
+    """
+    Runs an ffmpeg argv list (no shell) and reports progress while it runs.
+
+    Args:
+        cmd: argv starting with "static_ffmpeg" or "ffmpeg".
+        duration: Media seconds the job will produce, used for percent and ETA.
+            When omitted it comes from -t, -to and -ss or the first input is
+            probed.
+        outputs: Output files to measure, defaults to the last argument.
+        on_progress: Called for every progress block. Defaults to a console
+            progress line unless quiet is set.
+        cancel_event: When set the ffmpeg process is terminated.
+        quiet: Don't print the command or progress.
+        check: Raise subprocess.CalledProcessError if ffmpeg fails.
+        cwd: Directory to run ffmpeg in, relative paths resolve against it.
+        stdin_data: Chunks written to ffmpeg's stdin, for "-i -" inputs. It's
+            consumed lazily so generators can stream frames without buffering.
+            An exception raised by it ends the input and is re-raised.
+    """
+    argv = [str(c) for c in cmd]
+    if not argv:
+        raise ValueError("Command list cannot be empty")
+    args = _strip_options(argv[1:])
+    full_cmd = [
+        resolve_ffmpeg(argv[0]),
+        "-hide_banner",
+        "-nostats",
+        "-benchmark",
+        "-progress",
+        "pipe:1",
+    ] + args
+    inputs = _find_inputs(args)
+    outputs = outputs if outputs is not None else args[-1:]
+    if cwd:
+        inputs = [os.path.join(cwd, p) for p in inputs]
+        outputs = [os.path.join(cwd, p) for p in outputs]
+    if duration is None:
+        duration = get_job_duration(args, cwd)
+    if on_progress is None and not quiet:
+        on_progress = print_progress
+    if not quiet:
+        print(f"Executing:\n  {format_cmd(argv)}\n")
+
+    stderr_tail: deque[str] = deque(maxlen=50)
+    cpu_time: list[float] = []
+
+    start = time.time()
+    proc = subprocess.Popen(
+        full_cmd,
+        cwd=cwd,
+        stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        errors="replace",
+    )
+
+    def _drain_stderr() -> None:
+        assert proc.stderr is not None
+        for line in proc.stderr:
+            match = _BENCH_RE.search(line)
+            if match:
+                cpu_time.append(float(match.group(1)) + float(match.group(2)))
+            elif not line.startswith("bench:"):
+                stderr_tail.append(line.rstrip())
+
+    stderr_thread = threading.Thread(target=_drain_stderr, daemon=True)
+    stderr_thread.start()
+
+    feed_errors: list[BaseException] = []
+
+    def _feed_stdin() -> None:
+        assert proc.stdin is not None and stdin_data is not None
+        # The pipes are opened in text mode for the progress output.
+        pipe = cast(io.TextIOWrapper, proc.stdin).buffer
+        try:
+            for chunk in stdin_data:
+                pipe.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ffmpeg exited early, its return code says why.
+        except BaseException as ex:  # noqa: BLE001
+            feed_errors.append(ex)
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    feed_thread: Optional[threading.Thread] = None
+    if stdin_data is not None:
+        feed_thread = threading.Thread(target=_feed_stdin, daemon=True)
+        feed_thread.start()
+
+    cancelled = False
+
+    def _watch_cancel() -> None:
+        nonlocal cancelled
+        assert cancel_event is not None
+        while proc.poll() is None:
+            if cancel_event.wait(0.25):
+                cancelled = True
+                proc.terminate()
+                return
+
+    if cancel_event is not None:
+        threading.Thread(target=_watch_cancel, daemon=True).start()
+
+    progress = FfmpegProgress(duration=duration)
+    try:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            if parse_progress_line(line, progress) and on_progress is not None:
+                on_progress(progress)
+        proc.wait()
+    except KeyboardInterrupt:
+        cancelled = True
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            # ffmpeg waits for its inputs to end, stdin_data may never end.
+            proc.kill()
+            proc.wait()
+        raise
+    finally:
+        stderr_thread.join(timeout=5)
+        if feed_thread is not None:
+            feed_thread.join(timeout=5)
+        result = FfmpegResult(
+            cmd=full_cmd,
+            returncode=proc.returncode if proc.returncode is not None else -1,
+            wall_time=time.time() - start,
+            cpu_time=round(cpu_time[0], 3) if cpu_time else None,
+            input_bytes=_total_size(inputs),
+            output_bytes=_total_size(outputs),
+            media_duration=duration,
+            out_time=progress.out_time,
+            cancelled=cancelled,
+            stderr="\n".join(stderr_tail),
+            inputs=inputs,
+            outputs=outputs,
+        )
+        append_job_log(result)
+
+    if not quiet:
+        if result.cancelled:
+            print("ffmpeg job cancelled")
+        elif not result.ok:
+            print(f"ffmpeg failed with code {result.returncode}:\n{result.stderr}")
+    if feed_errors:
+        raise feed_errors[0]
+    if check and not result.ok:
+        raise subprocess.CalledProcessError(
+            result.returncode, full_cmd, stderr=result.stderr
+        )
+    return result
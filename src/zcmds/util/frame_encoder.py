@@ -0,0 +1,141 @@
+"""
+Moves frames between python and ffmpeg as rawvideo pipes.
+
+Nothing is written to disk but the output: frames are converted to bytes one at
+a time while ffmpeg reads them from stdin, so a generator can produce any
+number of frames in constant memory. decode_frames is the other direction,
+reading a video's frames from ffmpeg's stdout.
+"""
+
+import subprocess
+import threading
+from collections import deque
+from pathlib import Path
+from typing import IO, Any, Iterable, Iterator, Optional
+
+from zcmds.util.ffmpeg_runner import FfmpegResult, resolve_ffmpeg, run_ffmpeg
+
+
+# Bytes per pixel of the raw formats frames are usually produced in.
+BYTES_PER_PIXEL = {"rgb24": 3, "bgr24": 3, "rgba": 4, "bgra": 4, "gray": 1}
+
+
+def frame_bytes(frame: Any) -> bytes:
+    """
+    The raw pixels of a frame: bytes as is, otherwise anything with tobytes()
+    such as numpy arrays, PIL images and memoryviews.
+    """
+    if isinstance(frame, (bytes, bytearray)):
+        return bytes(frame)
+    tobytes = getattr(frame, "tobytes", None)
+    if tobytes is None:
+        raise TypeError(f"can't get raw pixels from {type(frame).__name__}")
+    return tobytes()
+
+
+def build_rawvideo_cmd(
+    width: int,
+    height: int,
+    out_path: str | Path,
+    fps: float = 30,
+    pix_fmt: str = "rgb24",
+    crf: Optional[int] = None,
+    video_args: Optional[list[str]] = None,
+) -> list[str]:
+    """
+    An ffmpeg argv reading rawvideo frames from stdin. video_args replaces the
+    default libx264/yuv420p encode.
+    """
+    cmd = ["static_ffmpeg", "-y", "-f", "rawvideo", "-pix_fmt", pix_fmt]
+    cmd += ["-s", f"{width}x{height}", "-framerate", str(fps), "-i", "-"]
+    if video_args is None:
+        # yuv420p needs even dimensions.
+        video_args = ["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2,format=yuv420p"]
+        video_args += ["-c:v", "libx264"]
+        if crf is not None:
+            video_args += ["-crf", str(crf)]
+    return cmd + video_args + [str(out_path)]
+
+
+def encode_frames(
+    frames: Iterable[Any],
+    width: int,
+    height: int,
+    out_path: str | Path,
+    fps: float = 30,
+    pix_fmt: str = "rgb24",
+    crf: Optional[int] = None,
+    video_args: Optional[list[str]] = None,
+    frame_count: Optional[int] = None,
+    quiet: bool = False,
+) -> FfmpegResult:
+    """
+    Encodes frames of width x height in pix_fmt to out_path.
+
+    Args:
+        frames: bytes, numpy arrays or PIL images, consumed lazily.
+        frame_count: Number of frames if known, used for the progress estimate.
+    Raises:
+        ValueError: A frame has the wrong number of bytes.
+    """
+    frame_size = width * height * BYTES_PER_PIXEL.get(pix_fmt, 0)
+
+    def chunks() -> Iterator[bytes]:
+        for index, frame in enumerate(frames):
+            data = frame_bytes(frame)
+            if frame_size and len(data) != frame_size:
+                raise ValueError(
+                    f"frame {index} has {len(data)} bytes, expected {frame_size}"
+                    f" for {width}x{height} {pix_fmt}"
+                )
+            yield data
+
+    cmd = build_rawvideo_cmd(width, height, out_path, fps, pix_fmt, crf, video_args)
+    duration = frame_count / fps if frame_count else None
+    return run_ffmpeg(cmd, duration=duration, quiet=quiet, stdin_data=chunks())
+
+
+def decode_frames(
+    infile: str | Path,
+    width: int,
+    height: int,
+    pix_fmt: str = "rgb24",
+    video_filter: Optional[str] = None,
+) -> Iterator[bytes]:
+    """
+    Yields the frames of infile as raw bytes. width and height are the size
+    after video_filter, which should scale to exactly that size if it scales.
+
+    Raises:
+        RuntimeError: ffmpeg failed before the end of the video.
+    """
+    frame_size = width * height * BYTES_PER_PIXEL[pix_fmt]
+    cmd = [resolve_ffmpeg("static_ffmpeg"), "-hide_banner", "-v", "error", "-nostdin"]
+    cmd += ["-i", str(infile), "-map", "0:v:0"]
+    if video_filter:
+        cmd += ["-vf", video_filter]
+    cmd += ["-f", "rawvideo", "-pix_fmt", pix_fmt, "-"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_tail: deque[bytes] = deque(maxlen=20)
+
+    def _drain(pipe: IO[bytes]) -> None:
+        for line in pipe:
+            stderr_tail.append(line)
+
+    assert proc.stdout is not None and proc.stderr is not None
+    threading.Thread(target=_drain, args=(proc.stderr,), daemon=True).start()
+    finished = False
+    try:
+        while True:
+            data = proc.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            yield data
+        finished = True
+    finally:
+        if not finished and proc.poll() is None:
+            proc.kill()
+        proc.wait()
+    if proc.returncode != 0:
+        stderr = b"".join(stderr_tail).decode(errors="replace")
+        raise RuntimeError(f"decoding {infile} failed:\n{stderr}")
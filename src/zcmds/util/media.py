@@ -0,0 +1,218 @@
+"""
+Shared helpers for media commands: input expansion and ffprobe probing.
+"""
+
+import glob
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Optional, cast
+
+import json5 as json
+
+
+VIDEO_EXTENSIONS = [".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv", ".wmv", ".ts"]
+AUDIO_EXTENSIONS = [".mp3", ".wav", ".m4a", ".aac", ".flac", ".ogg", ".opus"]
+MEDIA_EXTENSIONS = VIDEO_EXTENSIONS + AUDIO_EXTENSIONS
+
+# ffprobe is mostly waiting on disk, so more workers than cores is fine.
+DEFAULT_PROBE_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+def is_media_file(path: str, extensions: Optional[list[str]] = None) -> bool:
+    """Returns true if the path is a file with one of the given extensions."""
+    extensions = extensions or MEDIA_EXTENSIONS
+    if not os.path.isfile(path):
+        return False
+    return os.path.splitext(path.lower())[1] in extensions
+
+
+def is_in_out_pair(paths: list[str], outdir: Optional[str] = None) -> bool:
+    """
+    True if paths are the "cmd in out" form of a command that also batches.
+    One or two plain file paths keep that meaning even when the output
+    already exists; the command decides whether to overwrite it. A directory,
+    a glob, --outdir or more than two paths is a batch.
+    """
+    if outdir or len(paths) > 2:
+        return False
+    if any(os.path.isdir(p) or _has_glob_chars(p) for p in paths):
+        return False
+    return not paths or os.path.isfile(paths[0])
+
+
+def _has_glob_chars(path: str) -> bool:
+    return any(c in path for c in "*?[")
+
+
+def expand_media_paths(
+    inputs: Iterable[str],
+    extensions: Optional[list[str]] = None,
+    recursive: bool = False,
+) -> list[str]:
+    """
+    Expands files, directories and glob patterns into a sorted list of media files.
+
+    Explicitly named files are always kept, directories are scanned for files
+    matching the extensions and globs are expanded by the python glob module so
+    that this works the same on windows shells that don't expand wildcards.
+    """
+    out: list[str] = []
+    seen: set[str] = set()
+
+    def add(path: str) -> None:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            out.append(path)
+
+    for item in inputs:
+        if os.path.isdir(item):
+            found: list[str] = []
+            if recursive:
+                for root, _, files in os.walk(item):
+                    for f in files:
+                        found.append(os.path.join(root, f))
+            else:
+                found = [os.path.join(item, f) for f in os.listdir(item)]
+            for f in sorted(found):
+                if is_media_file(f, extensions):
+                    add(f)
+        elif os.path.isfile(item):
+            add(item)
+        elif _has_glob_chars(item):
+            for f in sorted(glob.glob(item, recursive=recursive)):
+                if os.path.isfile(f):
+                    add(f)
+    return out
+
+
+def ffprobe(path: str, show_frames: bool = False) -> dict[str, Any]:
+    """Returns the parsed ffprobe json (format and streams) for a media file."""
+    cmd = [
+        "static_ffprobe",
+        "-v",
+        "error",
+        "-print_format",
+        "json",
+        "-show_format",
+        "-show_streams",
+    ]
+    if show_frames:
+        cmd.append("-show_frames")
+    cmd.append(path)
+    # The errors end up on the CalledProcessError instead of the terminal.
+    stdout = subprocess.check_output(
+        cmd, universal_newlines=True, stderr=subprocess.PIPE
+    )
+    # json5 tolerates the trailing commas that ffprobe emits for some mkv files.
+    data = cast(dict[str, Any], json.loads(stdout))
+    return data
+
+
+def probe_many(
+    paths: list[str], max_workers: int = DEFAULT_PROBE_WORKERS
+) -> dict[str, dict[str, Any] | Exception]:
+    """
+    Probes many files concurrently. The result maps each path to its ffprobe
+    json, or to the exception raised while probing it.
+    """
+
+    def _probe(path: str) -> dict[str, Any] | Exception:
+        try:
+            return ffprobe(path)
+        except (subprocess.CalledProcessError, ValueError, OSError) as exc:
+            return exc
+
+    if not paths:
+        return {}
+    workers = max(1, min(max_workers, len(paths)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_probe, paths))
+    return dict(zip(paths, results))
+
+
+def get_stream(info: dict[str, Any], codec_type: str) -> Optional[dict[str, Any]]:
+    """Returns the first stream of the given type ("video", "audio") or None."""
+    for stream in info.get("streams", []):
+        if stream.get("codec_type") == codec_type:
+            return stream
+    return None
+
+
+def get_duration(info: dict[str, Any]) -> Optional[float]:
+    """Returns the container duration in seconds, falling back to the streams."""
+    candidates = [info.get("format", {}).get("duration")]
+    candidates += [s.get("duration") for s in info.get("streams", [])]
+    for value in candidates:
+        try:
+            if value is not None:
+                return float(value)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_frame_rate(rate: Optional[str]) -> Optional[float]:
+    """Parses ffprobe's "30000/1001" style frame rates."""
+    if not rate:
+        return None
+    num, _, den = rate.partition("/")
+    try:
+        if not den:
+            return float(num)
+        if float(den) == 0:
+            return None
+        return float(num) / float(den)
+    except ValueError:
+        return None
+
+
+def timestamp_to_seconds(timestamp: str) -> float:
+    """Converts ffmpeg style timestamps like "1:02:03.5", "2:04" or "95" to seconds."""
+    parts = [p for p in timestamp.strip().split(":")]
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part or 0)
+    return seconds
+
+
+def packet_times(
+    path: str, start: float, end: float, keyframes_only: bool = False
+) -> list[float]:
+    """
+    Returns the sorted presentation times of the video packets read for the
+    interval [start, end], which starts at the last keyframe at or before start.
+    Only packet headers are read, nothing is decoded, so this is fast even deep
+    into long files.
+    """
+    cmd = [
+        "static_ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=p=0",
+        "-read_intervals",
+        f"{max(0.0, start)}%{end}",
+        path,
+    ]
+    stdout = subprocess.check_output(cmd, universal_newlines=True)
+    times: set[float] = set()
+    for line in stdout.splitlines():
+        pts_time, _, flags = line.strip().partition(",")
+        if keyframes_only and "K" not in flags:
+            continue
+        try:
+            times.add(float(pts_time))
+        except ValueError:
+            continue
+    return sorted(times)
+
+
+def keyframe_times(path: str, start: float, end: float) -> list[float]:
+    """Keyframe times around [start, end], see packet_times."""
+    return packet_times(path, start, end, keyframes_only=True)
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from zcmds.cmds.common.audnorm import (
+    LOUDNESS_CACHE_ENV,
+    load_cached_loudness,
+    parse_loudnorm_json,
+    store_loudness,
+)
+
+
+STDERR = """[Parsed_loudnorm_0 @ 0x5581]
+{
+	"input_i" : "-33.60",
+	"input_tp" : "-24.61",
+	"input_lra" : "0.10",
+	"input_thresh" : "-43.60",
+	"output_i" : "-16.01",
+	"output_tp" : "-7.00",
+	"output_lra" : "0.10",
+	"output_thresh" : "-26.01",
+	"normalization_type" : "linear",
+	"target_offset" : "-0.01"
+}"""
+
+
+class AudnormTester(unittest.TestCase):
+    def test_parse_and_cache(self) -> None:
+        stats = parse_loudnorm_json(STDERR)
+        self.assertAlmostEqual(-33.6, stats.input_i)
+        self.assertAlmostEqual(-0.01, stats.target_offset)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ[LOUDNESS_CACHE_ENV] = os.path.join(tmpdir, "cache.json")
+            try:
+                self.assertIsNone(load_cached_loudness("abc", -16, -1.5, 11))
+                store_loudness("abc", stats, -16, -1.5, 11)
+                self.assertEqual(stats, load_cached_loudness("abc", -16, -1.5, 11))
+                # A new target reuses the measurement without the target offset.
+                other = load_cached_loudness("abc", -20, -1.5, 11)
+                assert other is not None
+                self.assertEqual(stats.input_i, other.input_i)
+                self.assertEqual(0.0, other.target_offset)
+            finally:
+                del os.environ[LOUDNESS_CACHE_ENV]
+
+
+if __name__ == "__main__":
+    unittest.main()
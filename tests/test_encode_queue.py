@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from zcmds.util.encode_queue import (
+    STATUS_CANCELLED,
+    STATUS_QUEUED,
+    STATUS_RUNNING,
+    EncodeQueue,
+    cpu_count,
+    run_daemon,
+    with_threads,
+)
+
+
+class EncodeQueueTester(unittest.TestCase):
+    def test_priority_and_thread_budget(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = EncodeQueue(Path(os.path.join(tmpdir, "queue.sqlite3")))
+            low = queue.submit(["echo", "low"], priority=0, threads=1)
+            high = queue.submit(["echo", "high"], priority=5, threads=1)
+            job = queue.claim_next(free_threads=cpu_count())
+            assert job is not None
+            self.assertEqual(high, job.id)
+            self.assertEqual(STATUS_RUNNING, job.status)
+            # Nothing fits in a zero thread budget.
+            self.assertIsNone(queue.claim_next(free_threads=0))
+            # A restarted daemon puts the running job back in the queue.
+            self.assertEqual(1, queue.requeue_running())
+            self.assertEqual([low, high], [j.id for j in queue.jobs([STATUS_QUEUED])])
+            self.assertTrue(queue.cancel(low))
+            self.assertEqual(STATUS_CANCELLED, (queue.get(low) or job).status)
+
+    def test_wide_job_is_clamped_to_the_daemon(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = EncodeQueue(Path(os.path.join(tmpdir, "queue.sqlite3")))
+            with mock.patch("zcmds.util.encode_queue.cpu_count", return_value=8):
+                queue.submit(["static_ffmpeg", "-i", "in.mp4", "out.mp4"], threads=4)
+            job = queue.claim_next(free_threads=2, max_threads=2)
+            assert job is not None
+            self.assertEqual(2, job.threads)
+            self.assertEqual(["-threads", "2", "out.mp4"], job.cmd[-3:])
+
+    def test_unregister_if_idle(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = EncodeQueue(Path(os.path.join(tmpdir, "queue.sqlite3")))
+            pid = os.getpid()
+            self.assertTrue(queue.try_register_daemon(pid))
+            queue.submit(["echo", "hi"])
+            # A queued job keeps the daemon registered.
+            self.assertFalse(queue.unregister_if_idle(pid))
+            self.assertEqual(pid, queue.daemon_pid())
+            queue.claim_next(free_threads=cpu_count())
+            self.assertTrue(queue.unregister_if_idle(pid))
+            self.assertIsNone(queue.daemon_pid())
+
+    def test_interrupted_daemon_requeues_jobs(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = EncodeQueue(Path(os.path.join(tmpdir, "queue.sqlite3")))
+            job_id = queue.submit(
+                [sys.executable, "-c", "import time; time.sleep(30)"], threads=1
+            )
+            # Ctrl-C lands in the idle sleep once the job has started.
+            with mock.patch(
+                "zcmds.util.encode_queue.time.sleep", side_effect=KeyboardInterrupt
+            ):
+                self.assertEqual(1, run_daemon(queue, max_threads=1))
+            job = queue.get(job_id)
+            assert job is not None
+            self.assertEqual(STATUS_QUEUED, job.status)
+
+    def test_with_threads(self) -> None:
+        cmd = with_threads(["static_ffmpeg", "-i", "in.mp4", "out.mp4"], 4)
+        self.assertEqual(["-threads", "4", "out.mp4"], cmd[-3:])
+        self.assertEqual(["echo", "hi"], with_threads(["echo", "hi"], 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
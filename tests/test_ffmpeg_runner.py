@@ -0,0 +1,61 @@
+import unittest
+
+from zcmds.util.ffmpeg_runner import (
+    FfmpegProgress,
+    get_job_duration,
+    parse_progress_line,
+)
+
+
+PROGRESS_BLOCK = """frame=250
+fps=49.8
+bitrate=1024.0kbits/s
+total_size=1310768
+out_time_us=10000000
+out_time_ms=10000000
+out_time=00:00:10.000000
+dup_frames=0
+drop_frames=0
+speed=2.00x
+progress=continue
+"""
+
+
+class FfmpegRunnerTester(unittest.TestCase):
+    def test_parse_progress_block(self) -> None:
+        progress = FfmpegProgress(duration=40.0)
+        ends = [
+            parse_progress_line(line, progress) for line in PROGRESS_BLOCK.splitlines()
+        ]
+        self.assertEqual([False] * 10 + [True], ends)
+        self.assertEqual(250, progress.frame)
+        self.assertAlmostEqual(10.0, progress.out_time)
+        self.assertAlmostEqual(25.0, progress.percent or 0)
+        self.assertAlmostEqual(2.0, progress.speed or 0)
+        # 30 seconds of media left at 2x speed.
+        self.assertAlmostEqual(15.0, progress.eta or 0)
+        self.assertFalse(progress.done)
+        parse_progress_line("progress=end", progress)
+        self.assertTrue(progress.done)
+
+    def test_unknown_values_are_ignored(self) -> None:
+        progress = FfmpegProgress()
+        parse_progress_line("speed=N/A", progress)
+        parse_progress_line("out_time_us=N/A", progress)
+        self.assertIsNone(progress.speed)
+        self.assertIsNone(progress.percent)
+        self.assertIsNone(progress.eta)
+
+    def test_job_duration_from_time_options(self) -> None:
+        cmd = ["-ss", "00:01:00", "-i", "missing.mp4", "-t", "5", "out.mp4"]
+        self.assertEqual(5.0, get_job_duration(cmd))
+        cmd = ["-ss", "10", "-to", "1:10.5", "-i", "missing.mp4", "out.mp4"]
+        self.assertEqual(60.5, get_job_duration(cmd))
+        # After an input seek the output -to counts from zero.
+        cmd = ["-ss", "10", "-i", "missing.mp4", "-to", "25", "out.mp4"]
+        self.assertEqual(25.0, get_job_duration(cmd))
+        self.assertIsNone(get_job_duration(["-i", "missing.mp4", "out.mp4"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
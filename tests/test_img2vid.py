@@ -0,0 +1,22 @@
+import os
+import unittest
+
+from zcmds.cmds.common.img2vid import detect_sequence
+
+
+class Img2VidTester(unittest.TestCase):
+    def test_detect_sequence(self) -> None:
+        padded = [os.path.join("d", f"frame_{i:04d}.png") for i in range(5, 9)]
+        self.assertEqual(
+            (os.path.join("d", "frame_%04d.png"), 5), detect_sequence(padded)
+        )
+        plain = [f"{i}.jpg" for i in range(1, 12)]
+        self.assertEqual(("%d.jpg", 1), detect_sequence(plain))
+        # Gaps, mixed names and mixed padding can't be read by the image2 demuxer.
+        self.assertIsNone(detect_sequence(["a_1.png", "a_3.png"]))
+        self.assertIsNone(detect_sequence(["a_1.png", "b_2.png"]))
+        self.assertIsNone(detect_sequence(["a_09.png", "a_10.png", "a_011.png"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from zcmds.util.media import expand_media_paths, is_in_out_pair, parse_frame_rate
+
+
+class MediaTester(unittest.TestCase):
+    def test_expand_media_paths(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ["b.mp4", "a.mkv", "notes.txt"]:
+                with open(os.path.join(tmpdir, name), "w") as f:
+                    f.write("x")
+            subdir = os.path.join(tmpdir, "sub")
+            os.makedirs(subdir)
+            with open(os.path.join(subdir, "c.mov"), "w") as f:
+                f.write("x")
+
+            files = expand_media_paths([tmpdir])
+            names = [os.path.basename(f) for f in files]
+            self.assertEqual(["a.mkv", "b.mp4"], names)
+
+            files = expand_media_paths([tmpdir], recursive=True)
+            self.assertIn("c.mov", [os.path.basename(f) for f in files])
+
+            # Globs are expanded and duplicates are removed.
+            pattern = os.path.join(tmpdir, "*.mp4")
+            files = expand_media_paths([pattern, os.path.join(tmpdir, "b.mp4")])
+            self.assertEqual(1, len(files))
+
+    def test_is_in_out_pair(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            a = os.path.join(tmpdir, "a.mp4")
+            b = os.path.join(tmpdir, "b.mp4")
+            for path in [a, b]:
+                with open(path, "w") as f:
+                    f.write("x")
+            self.assertTrue(is_in_out_pair([a, os.path.join(tmpdir, "new.mp4")]))
+            self.assertTrue(is_in_out_pair([a]))
+            # A rerun with the output already there is still in and out.
+            self.assertTrue(is_in_out_pair([a, b]))
+            self.assertFalse(is_in_out_pair([a], outdir=tmpdir))
+            self.assertFalse(is_in_out_pair([tmpdir]))
+            self.assertFalse(is_in_out_pair([a, tmpdir]))
+            self.assertFalse(is_in_out_pair([os.path.join(tmpdir, "*.mp4")]))
+            self.assertFalse(is_in_out_pair([a, b, a]))
+
+    def test_parse_frame_rate(self) -> None:
+        self.assertAlmostEqual(29.97, parse_frame_rate("30000/1001") or 0, places=2)
+        self.assertEqual(25.0, parse_frame_rate("25"))
+        self.assertIsNone(parse_frame_rate("0/0"))
+
+
+if __name__ == "__main__":
+    unittest.main()
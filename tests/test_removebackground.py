@@ -0,0 +1,55 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from zcmds.cmds.common.removebackground import (
+    FrameManifest,
+    apply_alpha,
+    frame_difference,
+    frame_signature,
+    worker_env,
+)
+
+
+class RemoveBackgroundTester(unittest.TestCase):
+    def test_worker_env(self) -> None:
+        with mock.patch("os.cpu_count", return_value=8):
+            self.assertEqual({"OMP_NUM_THREADS": "2"}, worker_env(0, 4))
+            # More workers than cores still get a thread each.
+            self.assertEqual("1", worker_env(0, 16)["OMP_NUM_THREADS"])
+            env = worker_env(3, 4, gpus=[0, 1])
+        self.assertEqual("1", env["CUDA_VISIBLE_DEVICES"])
+
+    def test_reuse_mask(self) -> None:
+        black = bytes(4 * 4 * 3)
+        white = bytes([255]) * (4 * 4 * 3)
+        sig = frame_signature(black, 4, 4)
+        self.assertEqual(0.0, frame_difference(sig, frame_signature(black, 4, 4)))
+        self.assertEqual(1.0, frame_difference(sig, frame_signature(white, 4, 4)))
+        rgba = apply_alpha(bytes([1, 2, 3, 4, 5, 6]), bytes([7, 8]))
+        self.assertEqual(bytes([1, 2, 3, 7, 4, 5, 6, 8]), rgba)
+
+    def test_frame_manifest_resume(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            workdir = Path(tmpdir)
+            manifest = FrameManifest(workdir, {"model": "u2net"})
+            manifest.add(0, bytes(2 * 2 * 4), 2, 2)
+            manifest.close()
+            # A partial line from an interrupted write is ignored.
+            with open(workdir / "manifest.jsonl", "a", encoding="utf-8") as f:
+                f.write('{"frame": 1, "pa')
+            manifest = FrameManifest(workdir, {"model": "u2net"})
+            manifest.add(2, bytes(2 * 2 * 4), 2, 2)
+            manifest.close()
+            manifest = FrameManifest(workdir, {"model": "u2net"})
+            manifest.close()
+            self.assertEqual({0, 2}, manifest.done)
+            manifest = FrameManifest(workdir, {"model": "silueta"})
+            manifest.close()
+            self.assertEqual(set(), manifest.done)
+            self.assertFalse(manifest.frame_path(0).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from zcmds.cmds.common.vidclip import edl_timecode_to_seconds, parse_cut_list
+
+
+EDL = """TITLE: cuts
+FCM: NON-DROP FRAME
+
+001  AX       V     C        00:00:01:15 00:00:05:00 00:00:00:00 00:00:03:15
+001  AX       AA    C        00:00:01:15 00:00:05:00 00:00:00:00 00:00:03:15
+* FROM CLIP NAME: interview.mov
+002  AX       V     C        00:00:05:00 00:00:05:00 00:00:03:15 00:00:03:15
+002  AX       V     D    015 00:01:00:00 00:01:02:10 00:00:03:15 00:00:06:00
+"""
+
+
+class VidClipTester(unittest.TestCase):
+    def test_parse_csv(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "cuts.csv")
+            with open(path, "w") as f:
+                f.write("start,end,outname\n# comment\n1:02,1:10,a.mp4\n\n5,7.5\n")
+            cuts = parse_cut_list(path)
+            self.assertEqual(2, len(cuts))
+            self.assertEqual(("1:02", "1:10", "a.mp4"), tuple(vars(cuts[0]).values()))
+            self.assertIsNone(cuts[1].outname)
+
+    def test_parse_edl(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "cuts.edl")
+            with open(path, "w") as f:
+                f.write(EDL)
+            cuts = parse_cut_list(path, fps=30, source="interview.mov")
+            # The audio event and the outgoing side of the dissolve are dropped.
+            self.assertEqual(2, len(cuts))
+            self.assertAlmostEqual(1.5, float(cuts[0].start))
+            self.assertEqual("interview_001.mov", cuts[0].outname)
+            self.assertAlmostEqual(60, float(cuts[1].start), places=5)
+            self.assertAlmostEqual(62 + 10 / 30, float(cuts[1].end), places=5)
+
+    def test_drop_frame_timecode(self) -> None:
+        # 01:00:00;00 drop frame is exactly 107892 frames at 29.97.
+        seconds = edl_timecode_to_seconds("01:00:00;00", 30000 / 1001)
+        self.assertAlmostEqual(107892 * 1001 / 30000, seconds, places=6)
+        self.assertAlmostEqual(3600, seconds, delta=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()